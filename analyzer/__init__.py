@@ -0,0 +1,16 @@
+"""analyzer - analysis of collected messages (see docs/ROADMAP.md, phase 2).
+
+Builds on the `messages` table written by `collector`.
+"""
+
+from __future__ import annotations
+
+from .context import Context, ContextCache, DayBlock, estimate_tokens, load_context
+
+__all__ = [
+	'Context',
+	'ContextCache',
+	'DayBlock',
+	'estimate_tokens',
+	'load_context',
+]
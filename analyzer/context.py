@@ -0,0 +1,322 @@
+"""Context loader: a channel's recent history formatted for LLM prompts.
+
+Messages become one line each, `[YYYY-MM-DD HH:MM] sender: text` (UTC,
+whitespace collapsed, long messages truncated), grouped into one block
+per UTC day. Days are produced newest first: days not in the cache are
+read from `messages` with keyset pagination, and reading stops as soon
+as the token budget is spent, so a small budget never reads a long
+window.
+
+Formatted day blocks are cached per entity and month in
+`.cache/context/<entity_id>/`. A load first asks Postgres which days
+of the entity received new or edited rows (`messages.updated_at`) since
+the previous load and drops only those blocks, so repeated jobs over
+overlapping windows read just the days that changed. As with incremental
+exports, the recorded check time lags the database clock by `settle`
+seconds so a batch still committing during a load is caught next time.
+"""
+from __future__ import annotations
+import datetime
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator
+
+from collector.storage.postgres_store import get_pg_pool
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+DEFAULT_CACHE_DIR = Path('.cache') / 'context'
+
+_UTC = datetime.timezone.utc
+_PAGE_SIZE = 1000
+
+_PAGE_SQL = '''
+    SELECT id, date, sender_id, text, has_media
+    FROM messages
+    WHERE entity_id = $1 AND date >= $2 AND (date, id) < ($3, $4) AND deleted_at IS NULL
+    ORDER BY date DESC, id DESC
+    LIMIT $5
+'''
+
+_CHANGED_DAYS_SQL = '''
+    SELECT DISTINCT (date AT TIME ZONE 'UTC')::date
+    FROM messages
+    WHERE entity_id = $1 AND updated_at > $2
+'''
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one token per 4 UTF-8 bytes.
+
+    Close to real tokenizers for English and slightly high for Cyrillic
+    (2 bytes per letter), so budgets err on the safe side.
+    """
+    return (len(text.encode('utf-8')) + 3) // 4
+
+
+def format_message(
+    date: datetime.datetime, sender_id: str | None, text: str | None, has_media: bool, max_chars: int
+) -> str | None:
+    """One context line, or None for a message with neither text nor media."""
+    body = ' '.join((text or '').split())
+    if not body:
+        if not has_media:
+            return None
+        body = '<media>'
+    elif len(body) > max_chars:
+        body = body[:max_chars - 1] + '…'
+    return f'[{date.astimezone(_UTC):%Y-%m-%d %H:%M}] {sender_id or "?"}: {body}'
+
+
+def _day_start(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time(), tzinfo=_UTC)
+
+
+@dataclass
+class DayBlock:
+    day: datetime.date
+    # chronological
+    lines: list[str]
+    tokens: int
+    cached: bool = False
+
+    @classmethod
+    def build(cls, day: datetime.date, lines: list[str]) -> 'DayBlock':
+        return cls(day, lines, sum(estimate_tokens(line) + 1 for line in lines))
+
+
+def _month(day: datetime.date) -> str:
+    return f'{day.year:04d}-{day.month:02d}'
+
+
+class ContextCache:
+    """Formatted day blocks in `<directory>/<entity_id>/<YYYY-MM>.json`.
+
+    Month files are read only when one of their days is needed. Keeps the
+    newest `max_months` months of an entity; blocks formatted with a
+    different `max_chars` are discarded. Jobs that may load the same entity
+    at the same time should use separate directories.
+    """
+
+    def __init__(self, directory: str | os.PathLike = DEFAULT_CACHE_DIR, max_months: int = 13) -> None:
+        self.directory = Path(directory)
+        self.max_months = max_months
+
+    def open(self, entity_id: int, max_chars: int) -> '_EntityBlocks':
+        return _EntityBlocks(self.directory / str(entity_id), max_chars, self.max_months)
+
+
+def _read_json(path: Path) -> Any:
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f'Warning: failed to read {path}:', e)
+        return None
+
+
+def _write_json(path: Path, data: Any) -> None:
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+    os.replace(tmp, path)
+
+
+class _EntityBlocks:
+    """Cached blocks of one entity for the duration of a load."""
+
+    def __init__(self, directory: Path, max_chars: int, max_months: int) -> None:
+        self.directory = directory
+        self.max_months = max_months
+        self.max_chars = max_chars
+        meta = _read_json(directory / 'meta.json')
+        valid = meta is not None and meta.get('max_chars') == max_chars
+        self.checked_at = datetime.datetime.fromisoformat(meta['checked_at']) if valid else None
+        self._months: dict[str, dict[str, dict[str, Any]]] = {}
+        self._dirty: set[str] = set()
+        if not valid:
+            # everything on disk is unusable; start over
+            for f in directory.glob('*.json'):
+                f.unlink()
+
+    def _load(self, month: str) -> dict[str, dict[str, Any]]:
+        days = self._months.get(month)
+        if days is None:
+            days = self._months[month] = _read_json(self.directory / f'{month}.json') or {}
+        return days
+
+    def get(self, day: datetime.date) -> DayBlock | None:
+        b = self._load(_month(day)).get(day.isoformat())
+        return None if b is None else DayBlock(day, b['lines'], b['tokens'], cached=True)
+
+    def put(self, block: DayBlock) -> None:
+        month = _month(block.day)
+        self._load(month)[block.day.isoformat()] = {'lines': block.lines, 'tokens': block.tokens}
+        self._dirty.add(month)
+
+    def invalidate(self, days: list[datetime.date]) -> None:
+        for day in days:
+            month = _month(day)
+            if month in self._months or (self.directory / f'{month}.json').exists():
+                if self._load(month).pop(day.isoformat(), None) is not None:
+                    self._dirty.add(month)
+
+    def save(self, checked_at: datetime.datetime) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for month in self._dirty:
+            _write_json(self.directory / f'{month}.json', self._months[month])
+        for f in sorted(self.directory.glob('????-??.json'), reverse=True)[self.max_months:]:
+            f.unlink()
+        _write_json(self.directory / 'meta.json', {'max_chars': self.max_chars, 'checked_at': checked_at.isoformat()})
+        self._dirty.clear()
+
+
+async def _read_days(
+    conn, entity_id: int, first: datetime.date, last: datetime.date, max_chars: int
+) -> AsyncIterator[DayBlock]:
+    """Blocks for the days `last` down to `first` (inclusive), newest first,
+    read page by page; days without messages give empty blocks."""
+    lower = _day_start(first)
+    # message ids are positive, so (next midnight, 0) starts at the newest row
+    cursor: tuple[datetime.datetime, int] = (_day_start(last + datetime.timedelta(days=1)), 0)
+    day, lines = last, []
+    while True:
+        rows = await conn.fetch(_PAGE_SQL, entity_id, lower, *cursor, _PAGE_SIZE)
+        for r in rows:
+            row_day = r['date'].astimezone(_UTC).date()
+            while row_day < day:
+                lines.reverse()
+                yield DayBlock.build(day, lines)
+                day, lines = day - datetime.timedelta(days=1), []
+            line = format_message(r['date'], r['sender_id'], r['text'], r['has_media'], max_chars)
+            if line is not None:
+                lines.append(line)
+        if len(rows) < _PAGE_SIZE:
+            break
+        cursor = (rows[-1]['date'], rows[-1]['id'])
+    while day >= first:
+        lines.reverse()
+        yield DayBlock.build(day, lines)
+        day, lines = day - datetime.timedelta(days=1), []
+
+
+@dataclass
+class Context:
+    entity_id: int
+    text: str = ''
+    tokens: int = 0
+    messages: int = 0
+    # oldest day with messages in `text`
+    oldest: datetime.date | None = None
+    # True when the budget cut off older messages
+    truncated: bool = False
+    days_cached: int = 0
+    days_read: int = 0
+    blocks: list[DayBlock] = field(default_factory=list, repr=False)
+
+    def summary(self) -> str:
+        s = (
+            f'{self.messages} messages, ~{self.tokens} tokens since {self.oldest or "-"}'
+            f' (days: {self.days_cached} cached, {self.days_read} read)'
+        )
+        return s + ', truncated at the token budget' if self.truncated else s
+
+
+async def load_context(
+    entity_id: int,
+    days: int = 30,
+    *,
+    token_budget: int | None = None,
+    until: datetime.date | None = None,
+    max_message_chars: int = 1000,
+    pool: AsyncpgPool | None = None,
+    cache: ContextCache | None = None,
+    settle: float = 60.0,
+) -> Context:
+    """Format the messages of `entity_id` from the `days` UTC days ending
+    with `until` (default today).
+
+    With `token_budget` the newest messages that fit are kept and older
+    days are not read at all. `cache` defaults to `ContextCache()`
+    (`.cache/context/`).
+    """
+    if days < 1:
+        raise ValueError('days must be >= 1')
+    p = pool or get_pg_pool()
+    if p is None:
+        raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+    cache = cache or ContextCache()
+    last = until or datetime.datetime.now(_UTC).date()
+    first = last - datetime.timedelta(days=days - 1)
+    ctx = Context(entity_id)
+    remaining = token_budget or 0
+
+    async with p.acquire() as conn:
+        cached = cache.open(entity_id, max_message_chars)
+        now = await conn.fetchval('SELECT now() - make_interval(secs => $1)', float(settle))
+        if cached.checked_at is not None:
+            cached.invalidate([d for (d,) in await conn.fetch(_CHANGED_DAYS_SQL, entity_id, cached.checked_at)])
+
+        async def newest_first() -> AsyncIterator[DayBlock]:
+            day = last
+            while day >= first:
+                block = cached.get(day)
+                if block is not None:
+                    yield block
+                    day -= datetime.timedelta(days=1)
+                    continue
+                # read the whole run of uncached days in one pass
+                run_end = day
+                while day >= first and cached.get(day) is None:
+                    day -= datetime.timedelta(days=1)
+                async for block in _read_days(conn, entity_id, day + datetime.timedelta(days=1), run_end,
+                                              max_message_chars):
+                    cached.put(block)
+                    yield block
+
+        taken: list[DayBlock] = []
+        reader = newest_first()
+        try:
+            async for block in reader:
+                if block.cached:
+                    ctx.days_cached += 1
+                else:
+                    ctx.days_read += 1
+                if not block.lines:
+                    continue
+                if token_budget is None or block.tokens <= remaining:
+                    taken.append(block)
+                    remaining -= block.tokens
+                    continue
+                # keep the newest lines of this day that still fit
+                lines: list[str] = []
+                for line in reversed(block.lines):
+                    cost = estimate_tokens(line) + 1
+                    if cost > remaining:
+                        break
+                    lines.append(line)
+                    remaining -= cost
+                if lines:
+                    lines.reverse()
+                    taken.append(DayBlock.build(block.day, lines))
+                ctx.truncated = True
+                break
+        finally:
+            await reader.aclose()
+    # only completely read days were put in the cache
+    cached.save(now)
+
+    taken.reverse()
+    ctx.blocks = taken
+    ctx.text = '\n'.join(line for b in taken for line in b.lines)
+    ctx.tokens = sum(b.tokens for b in taken)
+    ctx.messages = sum(len(b.lines) for b in taken)
+    ctx.oldest = taken[0].day if taken else None
+    return ctx
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Backfill the full history of one target with parallel id-range segments.
+
+Interrupt it at any time; the next run resumes every segment from its last
+checkpoint.
+
+Usage:
+    .venv/Scripts/python backfill.py <target> --segments 8 --rate 5 --pg-dsn "postgresql://..."
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+
+import os
+import collector
+
+
+async def main(
+    target: str,
+    session: str = 'session',
+    pg_dsn: str | None = None,
+    segments: int = 8,
+    concurrency: int = 4,
+    rate: float = 5.0,
+    restart: bool = False,
+    metrics_port: int | None = None,
+    metrics_json: str | None = None,
+    archive_raw: bool = False,
+) -> int:
+    api_id, api_hash = collector.get_api_credentials()
+    async with collector.serve_metrics(metrics_port), collector.create_client(session, api_id, api_hash) as client:
+        with collector.EntityCache.for_session(session) as cache:
+            entity = await collector.resolve(client, target, cache=cache)
+        if entity is None:
+            print('Could not resolve target:', target)
+            return 2
+
+        # Prefer explicit PG DSN (CLI) then environment variable `PG_DSN`.
+        if not pg_dsn:
+            pg_dsn = os.getenv('PG_DSN')
+
+        limiter = collector.RateLimiter(rate)
+        options = dict(segments=segments, concurrency=concurrency, rate_limiter=limiter, restart=restart)
+        if pg_dsn:
+            async with collector.pg_pool_context(pg_dsn) as pool:
+                # no checkpoint store on the sink: the backfill walks newest first
+                async with collector.BatchSink(pool, archive_raw=archive_raw) as sink:
+                    result = await collector.backfill(
+                        client, entity, sink, progress=collector.open_backfill_store(pool), **options
+                    )
+                print('Sink:', sink.stats.summary())
+        else:
+            result = await collector.backfill(
+                client, entity, collector.print_store, progress=collector.open_backfill_store(), **options
+            )
+    print('Backfill:', result.summary())
+    print(collector.metrics.format_summary())
+    if metrics_json:
+        collector.metrics.write_snapshot(metrics_json)
+    return 0 if result.done else 1
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Backfill the history of one target in parallel segments')
+    p.add_argument('target', help='channel username or numeric id')
+    p.add_argument('--session', default='session', help='session filename prefix')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN to write messages (overrides PG_DSN env)')
+    p.add_argument('--segments', type=int, default=8, help='number of id ranges to split the history into')
+    p.add_argument('--concurrency', type=int, default=4, help='segments fetched at the same time')
+    p.add_argument('--rate', type=float, default=5.0, help='global limit on history requests per second')
+    p.add_argument('--restart', action='store_true', help='discard saved progress and plan again')
+    p.add_argument('--archive-raw', action='store_true',
+                   help="also archive each message's raw payload, compressed (see storage.raw_archive)")
+    p.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port while running')
+    p.add_argument('--metrics-json', help='write the end-of-run metrics snapshot to this JSON file')
+    args = p.parse_args()
+    raise SystemExit(asyncio.run(main(
+        args.target,
+        session=args.session,
+        pg_dsn=args.pg_dsn,
+        segments=args.segments,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        restart=args.restart,
+        metrics_port=args.metrics_port,
+        metrics_json=args.metrics_json,
+        archive_raw=args.archive_raw,
+    )))
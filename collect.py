@@ -10,31 +10,77 @@ import asyncio
 
 import os
 import collector
+from telethon.utils import get_peer_id
 
 
-async def main(target: str, session: str = 'session', limit: int = 3, pg_dsn: str | None = None) -> int:
+async def main(
+    target: str,
+    session: str = 'session',
+    limit: int = 3,
+    pg_dsn: str | None = None,
+    incremental: bool = False,
+    pipeline: bool = False,
+    warm_cache: bool = False,
+    spool_dir: str = '.spool',
+    write_timeout: float | None = 30.0,
+    archive_raw: bool = False,
+) -> int:
     api_id, api_hash = collector.get_api_credentials()
     async with collector.create_client(session, api_id, api_hash) as client:
-        entity = await collector.resolve(client, target)
+        with collector.EntityCache.for_session(session) as cache:
+            entity = await collector.resolve(client, target, cache=cache)
         if entity is None:
             print('Could not resolve target:', target)
             return 2
 
-        # prefer explicit PG DSN (CLI) then environment variable `PG_DSN`
+        # Prefer explicit PG DSN (CLI) then environment variable `PG_DSN`.
         if not pg_dsn:
             pg_dsn = os.getenv('PG_DSN')
-            
-        # Prefer explicit PG DSN (CLI) then environment variable `PG_DSN`.
-        if pg_dsn:
-            async with collector.pg_pool_context(pg_dsn) as pool:
-                store_fn = lambda m: collector.postgres_store(m, pool=pool)
-                count = await collector.consume_messages(client, entity, store_fn, limit=limit)
-                print(f'Processed {count} messages')
-        else:
-            # fall back to module-level pool if previously initialized
-            store_fn = collector.postgres_store
-            count = await collector.consume_messages(client, entity, store_fn, limit=limit)
+
+        # Messages that cannot reach Postgres go to the local spool; load it
+        # later with scripts/replay_spool.py.
+        with collector.Spool(spool_dir) as spool:
+            pool = None
+            if pg_dsn:
+                try:
+                    pool = await collector.init_pg_pool(pg_dsn)
+                except Exception as e:
+                    print(f'Warning: cannot connect to Postgres ({e!r}); spooling messages to {spool.directory}')
+            else:
+                print(f'PG_DSN not set; spooling messages to {spool.directory}')
+            try:
+                if pool is not None:
+                    # The sink advances the checkpoint with every batch, which is
+                    # only right when messages arrive oldest to newest: an
+                    # incremental run resuming from a checkpoint. Without one
+                    # the run walks newest first, so the checkpoint is advanced
+                    # once at the end instead (see consume_messages).
+                    state = collector.open_state_store(pool) if incremental else None
+                    resuming = state is not None and await collector.load_checkpoint(state, entity) is not None
+                    async with collector.BatchSink(
+                        pool, state=state if resuming else None, spool=spool, write_timeout=write_timeout, archive_raw=archive_raw
+                    ) as sink:
+                        if warm_cache:
+                            await sink.warm_cache([get_peer_id(entity)])
+                        if pipeline:
+                            stats = await collector.run_pipeline(
+                                client, entity, sink, limit=limit, state=state
+                            )
+                            print(stats.summary())
+                            count = stats.stored
+                        else:
+                            count = await collector.consume_messages(
+                                client, entity, sink, limit=limit, state=state
+                            )
+                else:
+                    state = collector.open_state_store() if incremental else None
+                    async with collector.SpoolSink(spool) as sink:
+                        count = await collector.consume_messages(client, entity, sink, limit=limit, state=state)
+            finally:
+                if pool is not None:
+                    await collector.close_pg_pool()
             print(f'Processed {count} messages')
+            print('Sink:', sink.stats.summary())
         return 0
 
 
@@ -44,5 +90,27 @@ if __name__ == '__main__':
     p.add_argument('--session', default='session', help='session filename prefix')
     p.add_argument('--limit', type=int, default=3, help='number of messages to fetch')
     p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN to write messages (overrides PG_DSN env)')
+    p.add_argument('--incremental', action='store_true', help='only fetch messages newer than the stored checkpoint')
+    p.add_argument('--pipeline', action='store_true',
+                   help='overlap fetching and DB writes using the staged pipeline (requires a DSN)')
+    p.add_argument('--warm-cache', action='store_true',
+                   help='preload stored content hashes so unchanged messages are not sent to Postgres')
+    p.add_argument('--archive-raw', action='store_true',
+                   help="also archive each message's raw payload, compressed (see storage.raw_archive)")
+    p.add_argument('--spool-dir', default='.spool',
+                   help='where to spool messages when Postgres is unavailable or slow')
+    p.add_argument('--write-timeout', type=float, default=30.0,
+                   help='spool a batch whose Postgres write takes longer than this many seconds')
     args = p.parse_args()
-    raise SystemExit(asyncio.run(main(args.target, session=args.session, limit=args.limit, pg_dsn=args.pg_dsn)))
+    raise SystemExit(asyncio.run(main(
+        args.target,
+        session=args.session,
+        limit=args.limit,
+        pg_dsn=args.pg_dsn,
+        incremental=args.incremental,
+        pipeline=args.pipeline,
+        warm_cache=args.warm_cache,
+        spool_dir=args.spool_dir,
+        write_timeout=args.write_timeout,
+        archive_raw=args.archive_raw,
+    )))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Collect every target listed in `config.json` concurrently.
+
+Uses one client by default, or several accounts with `--sessions` /
+`--all-sessions` (targets are spread over them, see `ClientPool`).
+
+With `--skip-idle` one sweep over the dialogs decides which targets have
+new messages (see `plan_sync`); the others are not requested at all.
+
+Usage:
+    .venv/Scripts/python collect_all.py --limit 100 --concurrency 8
+    .venv/Scripts/python collect_all.py --all-sessions --concurrency 16
+    .venv/Scripts/python collect_all.py --skip-idle
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+
+import os
+import collector
+
+
+def report(results: list[collector.TargetResult]) -> int:
+    """Print one line per target and return the process exit code."""
+    for r in results:
+        print(r.summary())
+    ok = sum(1 for r in results if r.status == 'ok')
+    total = sum(r.messages for r in results)
+    print(f'{ok}/{len(results)} targets collected, {total} messages stored')
+    return 0 if ok == len(results) else 1
+
+
+async def plan_targets(clients: collector.ClientPool, targets: list[str], state) -> list[str]:
+    """Drop targets without new messages, most behind first."""
+    # the first account's dialogs; targets it has no dialog with stay due
+    account = clients.accounts[0]
+    plan = await collector.plan_sync(account.client, targets, state, entity_cache=account.cache)
+    print('Plan:', plan.summary())
+    return plan.targets
+
+
+async def main(
+    sessions: list[str],
+    limit: int | None = None,
+    concurrency: int = 8,
+    slice_size: int = 200,
+    pg_dsn: str | None = None,
+    incremental: bool = False,
+    max_flood_wait: float = 30.0,
+    metrics_port: int | None = None,
+    metrics_json: str | None = None,
+    warm_cache: bool = False,
+    spool_dir: str = '.spool',
+    skip_idle: bool = False,
+    archive_raw: bool = False,
+) -> int:
+    targets = collector.load_config()
+    if not targets:
+        print('No targets in config.json')
+        return 2
+    if not sessions:
+        print('No sessions found in .sessions/')
+        return 2
+
+    api_id, api_hash = collector.get_api_credentials()
+    # With a single account there is nowhere to move work; sleep through waits.
+    flood_limit = max_flood_wait if len(sessions) > 1 else None
+    async with collector.serve_metrics(metrics_port), \
+            collector.open_client_pool(sessions, api_id, api_hash, max_flood_wait=flood_limit) as clients:
+        # Prefer explicit PG DSN (CLI) then environment variable `PG_DSN`.
+        if not pg_dsn:
+            pg_dsn = os.getenv('PG_DSN')
+
+        if pg_dsn:
+            async with collector.pg_pool_context(pg_dsn) as pool:
+                # The sink is shared by all targets, and targets without a
+                # checkpoint yet are walked newest first, so it never advances
+                # checkpoints per batch; the engine advances each target's
+                # once it completes, after flushing the sink.
+                state = collector.open_state_store(pool) if incremental else None
+                if skip_idle:
+                    targets = await plan_targets(clients, targets, state)
+                # batches go to the local spool while the database is unavailable
+                with collector.Spool(spool_dir) as spool:
+                    async with collector.BatchSink(
+                        pool, spool=spool, write_timeout=30.0, archive_raw=archive_raw
+                    ) as sink:
+                        if warm_cache:
+                            await sink.warm_cache()
+                        results = await collector.collect_with_pool(
+                            clients, targets, sink, concurrency=concurrency, slice_size=slice_size, limit=limit,
+                            state=state,
+                        )
+                print('Sink:', sink.stats.summary())
+        else:
+            state = collector.open_state_store() if incremental else None
+            if skip_idle:
+                targets = await plan_targets(clients, targets, state)
+            results = await collector.collect_with_pool(
+                clients, targets, concurrency=concurrency, slice_size=slice_size, limit=limit, state=state
+            )
+        print(clients.summary())
+    print(collector.metrics.format_summary())
+    if metrics_json:
+        collector.metrics.write_snapshot(metrics_json)
+    return report(results)
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Collect all targets from config.json concurrently')
+    p.add_argument('--session', default='session', help='session filename prefix')
+    p.add_argument('--sessions', help='comma-separated session names to collect with (one account each)')
+    p.add_argument('--all-sessions', action='store_true', help='use every session file found in .sessions/')
+    p.add_argument('--max-flood-wait', type=float, default=30.0,
+                   help='with several accounts, move work off an account whose flood wait exceeds this many seconds')
+    p.add_argument('--limit', type=int, default=0, help='messages per target (0 means no limit)')
+    p.add_argument('--concurrency', type=int, default=8, help='targets fetched at the same time')
+    p.add_argument('--slice', dest='slice_size', type=int, default=200,
+                   help='messages taken from one target before yielding to the next')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN to write messages (overrides PG_DSN env)')
+    p.add_argument('--incremental', action='store_true', help='only fetch messages newer than the stored checkpoints')
+    p.add_argument('--skip-idle', action='store_true',
+                   help='incremental run that skips targets whose dialog shows no new messages (one dialogs sweep)')
+    p.add_argument('--spool-dir', default='.spool',
+                   help='where to spool messages while Postgres is unavailable (see scripts/replay_spool.py)')
+    p.add_argument('--warm-cache', action='store_true',
+                   help='preload stored content hashes so unchanged messages are not sent to Postgres')
+    p.add_argument('--archive-raw', action='store_true',
+                   help="also archive each message's raw payload, compressed (see storage.raw_archive)")
+    p.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port while running')
+    p.add_argument('--metrics-json', help='write the end-of-run metrics snapshot to this JSON file')
+    args = p.parse_args()
+    if args.all_sessions:
+        sessions = collector.discover_sessions()
+    elif args.sessions:
+        sessions = [x.strip() for x in args.sessions.split(',') if x.strip()]
+    else:
+        sessions = [args.session]
+    raise SystemExit(asyncio.run(main(
+        sessions,
+        limit=args.limit if args.limit > 0 else None,
+        concurrency=args.concurrency,
+        slice_size=args.slice_size,
+        pg_dsn=args.pg_dsn,
+        incremental=args.incremental or args.skip_idle,
+        max_flood_wait=args.max_flood_wait,
+        metrics_port=args.metrics_port,
+        metrics_json=args.metrics_json,
+        warm_cache=args.warm_cache,
+        spool_dir=args.spool_dir,
+        skip_idle=args.skip_idle,
+        archive_raw=args.archive_raw,
+    )))
@@ -12,14 +12,29 @@ from __future__ import annotations
 
 # Client / config
 from .client import create_client
+from .client_pool import ClientPool, open_client_pool, discover_sessions
 from .config import get_api_credentials, load_config
 
 # Entity resolution & parsing
 from .resolve import resolve
-from .stream import stream_messages
+from .entity_cache import EntityCache, cache_dialogs
+from .stream import stream_messages, StreamStats
 
 # Fetcher
-from .consumer import consume_messages
+from .consumer import consume_messages, load_checkpoint
+from .engine import collect_targets, collect_with_pool, TargetResult
+from .pipeline import run_pipeline, PipelineStats
+from .tail import tail_targets, TailStats
+from .backfill import backfill, plan_segments, BackfillResult
+from .ratelimit import RateLimiter
+from .media import MediaInfo, extract_media
+from .downloader import MediaStore, download_media
+from .worker import run_worker, WorkerStats
+from .planner import plan_sync, SyncPlan
+from .reconcile import reconcile, ReconcileResult
+from .daemon import CollectorDaemon
+from . import metrics
+from .metrics import serve_metrics
 
 # Storage
 from .storage import (
@@ -28,20 +43,76 @@ from .storage import (
 	postgres_store,
 	close_pg_pool,
 	pg_pool_context,
+	BatchSink,
+	SinkStats,
+	PostgresStateStore,
+	FileStateStore,
+	open_state_store,
+	PostgresBackfillStore,
+	FileBackfillStore,
+	open_backfill_store,
+	Spool,
+	SpoolSink,
+	replay_spool,
+	SearchCursor,
+	search_messages,
+	ExportFilter,
+	ExportWatermarks,
+	export_messages,
+	Job,
+	JobQueue,
+	ChannelActivity,
+	channel_activity,
+	posting_heatmap,
+	rebuild_channel_stats,
+	RawArchive,
 )
 
 __all__ = [
 	# client/config
 	'create_client',
+	'ClientPool',
+	'open_client_pool',
+	'discover_sessions',
 	'get_api_credentials',
 	'load_config',
 
 	# entity / parser
 	'resolve',
+	'EntityCache',
+	'cache_dialogs',
 	'stream_messages',
+	'StreamStats',
 
 	# fetcher
 	'consume_messages',
+	'load_checkpoint',
+	'collect_targets',
+	'collect_with_pool',
+	'TargetResult',
+	'run_pipeline',
+	'PipelineStats',
+	'tail_targets',
+	'TailStats',
+	'backfill',
+	'plan_segments',
+	'BackfillResult',
+	'RateLimiter',
+	'MediaInfo',
+	'extract_media',
+	'MediaStore',
+	'download_media',
+	'run_worker',
+	'WorkerStats',
+	'plan_sync',
+	'SyncPlan',
+	'reconcile',
+	'ReconcileResult',
+	'CollectorDaemon',
+
+	# observability
+	'metrics',
+	'serve_metrics',
 
 	# storage
 	'print_store',
@@ -49,5 +120,28 @@ __all__ = [
 	'postgres_store',
 	'close_pg_pool',
 	'pg_pool_context',
+	'BatchSink',
+	'SinkStats',
+	'PostgresStateStore',
+	'FileStateStore',
+	'open_state_store',
+	'PostgresBackfillStore',
+	'FileBackfillStore',
+	'open_backfill_store',
+	'Spool',
+	'SpoolSink',
+	'replay_spool',
+	'SearchCursor',
+	'search_messages',
+	'ExportFilter',
+	'ExportWatermarks',
+	'export_messages',
+	'Job',
+	'JobQueue',
+	'ChannelActivity',
+	'channel_activity',
+	'posting_heatmap',
+	'rebuild_channel_stats',
+	'RawArchive',
 ]
 
@@ -0,0 +1,189 @@
+"""Parallel historical backfill of one large target.
+
+A plain `stream_messages` walk is sequential: one page of at most 100
+messages per request, newest to oldest. `backfill` instead splits the id
+space `(0, newest id]` into segments and walks them concurrently, each one
+bounded by `offset_id` (its upper end, or its cursor) and `min_id` (its
+lower end).
+
+Progress is kept per segment in a `BackfillStore`. Every
+`checkpoint_every` messages the sink is flushed and only then the
+segment's cursor (the lowest id stored so far) is saved, so an
+interrupted backfill resumes every segment just below its last stored
+message. A page the sink fails to store stops its segment with the
+cursor still above it. A shared `RateLimiter` keeps the total request rate of all
+segments under a global budget.
+
+Messages newer than the planned top id are not part of the backfill;
+incremental runs pick them up from the checkpoint.
+"""
+from __future__ import annotations
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from telethon import TelegramClient
+from telethon.utils import get_peer_id
+
+from .consumer import process_batch
+from .ratelimit import RateLimiter
+from .storage import print_store
+from .storage.backfill_store import BackfillStore, Segment
+from .stream import MAX_PAGE_SIZE, StreamStats, stream_messages
+from .type_annotations import Entity
+
+
+@dataclass
+class BackfillResult:
+    """Outcome of one `backfill` run."""
+    entity_id: int
+    top_id: int = 0
+    segments: int = 0
+    completed: int = 0
+    resumed: bool = False
+    messages: int = 0
+    skipped: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    stream: StreamStats = field(default_factory=StreamStats)
+
+    @property
+    def done(self) -> bool:
+        return self.completed == self.segments
+
+    def summary(self) -> str:
+        rate = self.messages / self.elapsed if self.elapsed > 0 else 0.0
+        return (
+            f'{self.entity_id}: {self.completed}/{self.segments} segments done'
+            f'{" (resumed)" if self.resumed else ""}, {self.messages} stored, {self.skipped} skipped, '
+            f'{f"{self.failed} failed, " if self.failed else ""}'
+            f'{self.stream.pages} pages, {self.stream.flood_waits} flood waits, '
+            f'{self.elapsed:.1f}s ({rate:.0f} msg/s)'
+        )
+
+
+def plan_segments(top_id: int, segments: int, min_size: int = 1000) -> list[Segment]:
+    """Split the ids `(0, top_id]` into at most `segments` ranges, newest first.
+
+    Ranges are never smaller than `min_size` ids, so small channels get
+    fewer segments.
+    """
+    if top_id <= 0:
+        return []
+    n = max(1, min(segments, -(-top_id // max(1, min_size))))
+    step = -(-top_id // n)
+    plan = []
+    high = top_id
+    while high > 0:
+        low = max(0, high - step)
+        plan.append(Segment(low, high))
+        high = low
+    return plan
+
+
+async def _newest_id(client: TelegramClient, entity: Entity, rate_limiter: RateLimiter | None) -> int:
+    async for m in stream_messages(client, entity, limit=1, rate_limiter=rate_limiter):
+        return m.id
+    return 0
+
+
+async def backfill(
+    client: TelegramClient,
+    entity: Entity,
+    store_func: Callable[[Any], Awaitable[None]] = print_store,
+    *,
+    progress: BackfillStore,
+    segments: int = 8,
+    concurrency: int = 4,
+    rate_limiter: RateLimiter | None = None,
+    checkpoint_every: int = 1000,
+    restart: bool = False,
+) -> BackfillResult:
+    """Backfill the history of `entity` into `store_func` in parallel segments.
+
+    A plan already stored in `progress` is resumed (a completed one has
+    nothing left to do); `restart` discards it and plans again from the
+    current newest message. `concurrency` bounds how many segments are
+    fetched at once. If a segment fails the others are cancelled and the
+    error is raised; their progress up to the last checkpoint is kept.
+    A segment whose page the sink fails to store stops without moving its
+    cursor past the page; the others go on and the result is not `done`
+    (its messages count as `failed`).
+    """
+    entity_id = get_peer_id(entity)
+    result = BackfillResult(entity_id)
+    started = time.monotonic()
+
+    plan = [] if restart else await progress.load(entity_id)
+    if plan:
+        result.resumed = True
+    else:
+        top_id = await _newest_id(client, entity, rate_limiter)
+        plan = plan_segments(top_id, segments)
+        await progress.save_plan(entity_id, plan)
+    result.top_id = max((s.high_id for s in plan), default=0)
+    result.segments = len(plan)
+    result.completed = sum(s.done for s in plan)
+
+    flush = getattr(store_func, 'flush', None)
+    save_lock = asyncio.Lock()
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def checkpoint(seg: Segment) -> None:
+        # Flush first so the saved cursor never gets ahead of stored rows.
+        async with save_lock:
+            if flush is not None:
+                await flush()
+            await progress.update(entity_id, seg)
+
+    async def store(seg: Segment, page: list) -> bool:
+        # Whole pages go through the batch normalizer (see `process_batch`).
+        try:
+            stored = await process_batch(page, store_func, raise_errors=True)
+        except Exception as e:
+            print(f'Warning: segment ({seg.low_id}, {seg.high_id}] stopped: store_func raised: {e}')
+            result.failed += len(page)
+            return False
+        result.messages += stored
+        result.skipped += len(page) - stored
+        seg.cursor_id = page[-1].id
+        return True
+
+    async def run(seg: Segment) -> None:
+        async with sem:
+            stats = StreamStats()
+            page: list = []
+            unsaved = 0
+            try:
+                offset = seg.cursor_id if seg.cursor_id is not None else seg.high_id + 1
+                async for m in stream_messages(
+                    client, entity, offset_id=offset, min_id=seg.low_id, stats=stats, rate_limiter=rate_limiter
+                ):
+                    page.append(m)
+                    if len(page) < MAX_PAGE_SIZE:
+                        continue
+                    if not await store(seg, page):
+                        return
+                    unsaved += len(page)
+                    page = []
+                    if unsaved >= checkpoint_every:
+                        await checkpoint(seg)
+                        unsaved = 0
+                if page and not await store(seg, page):
+                    return
+                seg.done = True
+                await checkpoint(seg)
+                result.completed += 1
+            finally:
+                result.stream.add(stats)
+
+    tasks = [asyncio.create_task(run(s)) for s in plan if not s.done]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        result.elapsed = time.monotonic() - started
+    return result
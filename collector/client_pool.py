@@ -0,0 +1,141 @@
+"""Several Telegram accounts behind one scheduler.
+
+Rate limits (and flood waits) are per account, so collecting with N
+sessions scales roughly N-fold. `ClientPool` opens one client per session
+found in `.sessions/` and decides which account serves a target:
+
+- Each target has a preferred account chosen by rendezvous hashing of
+  `(session, target)`. The choice is stable across runs and only targets
+  of an added or removed account move.
+- An account in a flood wait longer than `max_flood_wait` is skipped; its
+  pending targets go to the least busy account that is not waiting.
+
+Each account keeps its own entity cache, because access hashes are only
+valid for the account that obtained them.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Iterable
+
+from telethon import TelegramClient
+
+from .client import create_client
+from .entity_cache import EntityCache
+from .stream import StreamStats
+
+
+@dataclass
+class AccountStats:
+    """Per-account request and flood-wait counters."""
+    targets: int = 0
+    moved_away: int = 0
+    stream: StreamStats = field(default_factory=StreamStats)
+
+
+@dataclass
+class Account:
+    session: str
+    client: TelegramClient
+    cache: EntityCache | None = None
+    stats: AccountStats = field(default_factory=AccountStats)
+    flood_until: float = 0.0
+    active: int = 0
+
+    def flooded(self, now: float | None = None) -> bool:
+        return self.flood_until > (time.monotonic() if now is None else now)
+
+    def summary(self) -> str:
+        s = self.stats
+        resolves = self.cache.misses if self.cache is not None else 0
+        return (
+            f'{self.session}: {s.targets} targets, {s.stream.messages} messages, '
+            f'{s.stream.pages + resolves} requests ({s.stream.pages} pages, {resolves} resolves), '
+            f'{s.stream.flood_waits} flood waits ({s.stream.flood_wait_seconds:.0f}s), '
+            f'{s.moved_away} targets moved away'
+        )
+
+
+def discover_sessions(sessions_dir: str = '.sessions') -> list[str]:
+    """Names of the Telethon session files in `sessions_dir`."""
+    return sorted(p.stem for p in Path(sessions_dir).glob('*.session'))
+
+
+class ClientPool:
+    """Picks an account for each target and tracks flood waits."""
+
+    def __init__(self, accounts: Iterable[Account], *, max_flood_wait: float | None = 30.0) -> None:
+        self.accounts = list(accounts)
+        if not self.accounts:
+            raise ValueError('ClientPool needs at least one account')
+        self.max_flood_wait = max_flood_wait
+
+    @classmethod
+    def single(cls, client: TelegramClient, cache: EntityCache | None = None) -> 'ClientPool':
+        """Wrap one already-connected client. Flood waits are slept in place."""
+        return cls([Account('default', client, cache)], max_flood_wait=None)
+
+    def preferred(self, target: str) -> Account:
+        """The account `target` is assigned to (rendezvous hashing)."""
+        def weight(a: Account) -> bytes:
+            return hashlib.sha1(f'{a.session}\0{target}'.encode()).digest()
+        return max(self.accounts, key=weight)
+
+    async def acquire(self, target: str) -> Account:
+        """Account to use for `target` now, waiting if every account is flooded."""
+        now = time.monotonic()
+        account = self.preferred(target)
+        if not account.flooded(now):
+            return account
+        available = [a for a in self.accounts if not a.flooded(now)]
+        if available:
+            return min(available, key=lambda a: a.active)
+        account = min(self.accounts, key=lambda a: a.flood_until)
+        await asyncio.sleep(account.flood_until - now)
+        return account
+
+    def flood(self, account: Account, seconds: float) -> None:
+        """Record that `account` must not send requests for `seconds`."""
+        account.flood_until = max(account.flood_until, time.monotonic() + seconds)
+        account.stats.stream.flood_wait_seconds += seconds
+
+    def should_move(self, account: Account) -> bool:
+        """True when `account` is flooded and another one is not."""
+        now = time.monotonic()
+        return account.flooded(now) and any(not a.flooded(now) for a in self.accounts)
+
+    def summary(self) -> str:
+        return '\n'.join(a.summary() for a in self.accounts)
+
+    def save_caches(self) -> None:
+        for a in self.accounts:
+            if a.cache is not None:
+                a.cache.save()
+
+
+@asynccontextmanager
+async def open_client_pool(
+    sessions: Iterable[str],
+    api_id: int,
+    api_hash: str,
+    *,
+    max_flood_wait: float | None = 30.0,
+) -> AsyncIterator[ClientPool]:
+    """Start one client per session and yield a `ClientPool` over them.
+
+    Entity caches are saved and every client disconnected on exit.
+    """
+    async with AsyncExitStack() as stack:
+        accounts = []
+        for session in sessions:
+            client = await stack.enter_async_context(create_client(session, api_id, api_hash))
+            accounts.append(Account(session, client, EntityCache.for_session(session)))
+        pool = ClientPool(accounts, max_flood_wait=max_flood_wait)
+        try:
+            yield pool
+        finally:
+            pool.save_caches()
@@ -29,6 +29,18 @@ def load_config() -> list[str]:
     return []
 
 
+def get_search_languages() -> tuple[str, ...]:
+    """Text search configurations for the message search index.
+
+    Read from `TG_SEARCH_LANGUAGES` (comma-separated Postgres text search
+    configuration names). The default, Postgres' `russian` configuration,
+    already stems Latin-script words with the English stemmer, so it covers
+    mixed Russian/English channels in a single pass.
+    """
+    raw = os.getenv('TG_SEARCH_LANGUAGES') or 'russian'
+    return tuple(lang.strip() for lang in raw.split(',') if lang.strip())
+
+
 class Credentials(NamedTuple):
     api_id: int
     api_hash: str
@@ -1,15 +1,127 @@
 from __future__ import annotations
-from typing import Callable, Awaitable
+from typing import Any, Callable, Awaitable, Sequence
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 
 from .type_annotations import Entity
-import asyncio
-from telethon.errors import FloodWaitError
 from telethon.tl.custom.message import Message
+from telethon.utils import get_peer_id
 
-from .stream import stream_messages
+from . import metrics
+from .stream import StreamStats, stream_messages
 from .storage import print_store
-from .normalize import normalize_message, NormalizedMessage
+from .storage.raw_archive import raw_payload
+from .storage.state_store import StateStore
+from .normalize import MessageRow, normalize_batch, normalize_message, NormalizedMessage
+
+
+async def process_message(
+    m: Message, store_func: Callable[[Message], Awaitable[None]] | None, *, raise_errors: bool = False
+) -> str:
+    """Normalize `m` and hand it to `store_func`.
+
+    Returns 'ok', 'skipped' when normalization failed, or 'failed' when
+    `store_func` raised (the error is reported and swallowed, or raised
+    with `raise_errors`). Callers must not treat a 'failed' message as
+    stored, e.g. move a checkpoint past it. A sink with `archive_raw` also
+    gets the raw payload (`NormalizedMessage.raw`).
+    """
+    try:
+        normalized = normalize_message(m)
+    except Exception as e:
+        print(f"Skipping message {getattr(m, 'id', None)!r}: normalization failed: {e}")
+        metrics.MESSAGES_SKIPPED.inc(entity=getattr(m, 'chat_id', None))
+        return 'skipped'
+    metrics.MESSAGES_NORMALIZED.inc(entity=normalized.entity_id)
+
+    if store_func is not None:
+        if getattr(store_func, 'archive_raw', False):
+            normalized.raw = raw_payload(m)
+        try:
+            await store_func(normalized)
+        except Exception as e:
+            if raise_errors:
+                raise
+            print('Warning: store_func raised:', e)
+            return 'failed'
+        metrics.MESSAGES_STORED.inc(entity=normalized.entity_id)
+        metrics.observe_message_date(normalized.entity_id, normalized.date)
+    return 'ok'
+
+
+def _count_rows(rows: Sequence[MessageRow], stored: bool) -> None:
+    per_entity: dict[int, int] = {}
+    for r in rows:
+        per_entity[r[0]] = per_entity.get(r[0], 0) + 1
+    for entity_id, n in per_entity.items():
+        if stored:
+            metrics.MESSAGES_STORED.inc(n, entity=entity_id)
+        else:
+            metrics.MESSAGES_NORMALIZED.inc(n, entity=entity_id)
+    if stored:
+        for r in rows:
+            metrics.observe_message_date(r[0], r[2])
+
+
+def _skip(m: Any, e: ValueError) -> None:
+    print(f"Skipping message {getattr(m, 'id', None)!r}: normalization failed: {e}")
+    metrics.MESSAGES_SKIPPED.inc(entity=getattr(m, 'chat_id', None))
+
+
+def raw_payloads(messages: Sequence[Message]) -> dict[tuple[int, int], bytes]:
+    """Raw payloads of `messages` keyed like the sink's rows."""
+    raw = {}
+    for m in messages:
+        payload = raw_payload(m)
+        if payload is not None:
+            raw[(m.chat_id, m.id)] = payload
+    return raw
+
+
+async def process_batch(
+    messages: Sequence[Message], store_func: Callable[[Any], Awaitable[None]] | None, *, raise_errors: bool = False
+) -> int:
+    """Normalize a page of messages and hand them to `store_func`.
+
+    Sinks with an `add_rows` method (`BatchSink`) get all rows from
+    `normalize_batch` in one call (with `archive_raw`, also the raw
+    payloads); other sinks get one `NormalizedMessage` per message through
+    `process_message`. Returns the number of messages that were not
+    skipped. Errors raised by the sink are reported and
+    swallowed, as in `process_message`, or raised with `raise_errors`.
+    """
+    add_rows = getattr(store_func, 'add_rows', None)
+    if add_rows is None:
+        processed = 0
+        for m in messages:
+            processed += await process_message(m, store_func, raise_errors=raise_errors) != 'skipped'
+        return processed
+
+    rows = normalize_batch(messages, on_error=_skip)
+    _count_rows(rows, stored=False)
+    try:
+        if getattr(store_func, 'archive_raw', False):
+            await add_rows(rows, raw=raw_payloads(messages))
+        else:
+            await add_rows(rows)
+    except Exception as e:
+        if raise_errors:
+            raise
+        print('Warning: store_func raised:', e)
+    else:
+        _count_rows(rows, stored=True)
+    return len(rows)
+
+
+async def load_checkpoint(state: StateStore, entity: Entity) -> int | None:
+    """Return the stored high-water message id for `entity`, if any."""
+    return await state.get(get_peer_id(entity))
+
+
+def manages_state(store_func, state: StateStore | None) -> bool:
+    """True when `store_func` advances `state` itself (e.g. a `BatchSink`
+    created with the same store), so callers must not advance it again."""
+    return state is not None and getattr(store_func, 'state', None) is state
 
 
 async def consume_messages(
@@ -19,46 +131,63 @@ async def consume_messages(
     *,
     resume_after_id: int | None = None,
     limit: int | None = None,
+    state: StateStore | None = None,
+    stats: StreamStats | None = None,
+    max_flood_wait: float | None = None,
+    raise_errors: bool = False,
 ) -> int:
     """Compatibility wrapper: consume `stream_messages` and
     call `store_func` for each message or collect in-memory when
-    `store_func` is None. Returns the number of messages processed.
+    `store_func` is None. Returns the number of messages stored.
+
+    With `state` the run is incremental: it resumes after the entity's
+    stored checkpoint. Unless `store_func` advances the checkpoint itself,
+    it is advanced here once the run completes, after flushing
+    `store_func` (when it buffers) so the checkpoint never gets ahead of
+    the stored rows, and never past a message `store_func` failed to
+    store. Pass `stats` to receive
+    the page and flood-wait counters of the underlying stream.
+
+    Flood waits longer than `max_flood_wait` seconds are raised (see
+    `stream_messages`) instead of slept through. Other errors end the run
+    with a printed message, or are raised with `raise_errors`.
     """
+    if state is not None and resume_after_id is None:
+        resume_after_id = await load_checkpoint(state, entity)
+
     count = 0
+    high_water = 0
+    # Resuming from a checkpoint, messages arrive oldest first, so after a
+    # failed store the checkpoint must stay below it. Without one they
+    # arrive newest first and a failure leaves nothing safe to advance to.
+    failed = False
     try:
-        async for m in stream_messages(client, entity, resume_after_id=resume_after_id, limit=limit):
-            # Validate/normalize the message before handing to store_func.
-            try:
-                normalized = normalize_message(m)
-            except Exception as e:
-                print(f"Skipping message {getattr(m, 'id', None)!r}: normalization failed: {e}")
-                # skip storing this message and continue with the stream
-                continue
-
-            if store_func is not None:
-                try:
-                    await store_func(normalized)
-                except Exception as e:
-                    print('Warning: store_func raised:', e)
-            else:
-                # keep previous behavior of collecting messages in-memory
-                # by doing nothing here; callers that relied on returned
-                # collection should use the async generator instead.
-                pass
-
-            count += 1
-
-    except FloodWaitError as e:
-        # This should be handled by the generator, but keep a fallback
-        wait = int(getattr(e, 'seconds', 0)) or 60
-        print(f'FloodWaitError: sleeping for {wait}s before resuming')
-        await asyncio.sleep(wait + 1)
-        more = await consume_messages(
-            client, entity, store_func, resume_after_id=resume_after_id, limit=(None if limit is None else max(0, limit - count))
-        )
-        return count + more
+        async for m in stream_messages(
+            client, entity, resume_after_id=resume_after_id, limit=limit, stats=stats, max_flood_wait=max_flood_wait
+        ):
+            # Validate/normalize the message before handing to store_func;
+            # messages that fail normalization are skipped.
+            outcome = await process_message(m, store_func, raise_errors=raise_errors)
+            if outcome == 'failed':
+                failed = True
+            elif outcome == 'ok':
+                count += 1
+                if not failed:
+                    high_water = max(high_water, m.id)
+
+    except FloodWaitError:
+        raise
     except Exception as e:
+        if raise_errors:
+            raise
         print('Error while processing messages in fetcher:', e)
         return count
 
+    if failed and resume_after_id is None:
+        high_water = 0
+    if high_water and state is not None and not manages_state(store_func, state):
+        flush = getattr(store_func, 'flush', None)
+        if flush is not None:
+            await flush()
+        await state.advance({get_peer_id(entity): high_water})
     return count
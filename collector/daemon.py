@@ -0,0 +1,379 @@
+"""Long-lived collector that takes jobs over a local Unix domain socket.
+
+A one-shot run spends most of its time starting up: importing Telethon,
+loading the session, `client.start()` and opening a Postgres pool. The
+daemon does that once and keeps the client connected, the pool, the
+`BatchSink` and the entity cache warm; each job then only costs its
+Telegram requests.
+
+The protocol is one JSON object per line. A client sends one request:
+
+- `{"op": "collect", "target": ..., "limit": N, "incremental": true}`
+- `{"op": "backfill", "target": ..., "segments": 8, "concurrency": 4, "restart": false}`
+- `{"op": "reconcile", "target": ..., "last": N}` (or `"days": D`)
+- `{"op": "tail", "targets": [...]}` (default: `config.json`); runs until cancelled
+- `{"op": "status"}`, `{"op": "cancel", "job": ID}`, `{"op": "shutdown"}`
+
+For a job the daemon answers `{"event": "accepted", "job": {...}}`, then a
+`progress` event every `progress_interval` seconds and a final `done`
+event whose job has `status` `done`, `failed` or `cancelled` and the
+job's `result` or `error`. With `"detach": true` (and always for `tail`)
+it answers `accepted` and closes. Jobs keep running when their client
+disconnects. A request for a job that is already running (same op and
+target) attaches to the running job. A completed job's messages have been
+flushed to Postgres.
+
+`collectorctl.py` is the thin client; it only needs the standard library.
+"""
+from __future__ import annotations
+import asyncio
+import dataclasses
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from telethon import TelegramClient
+from telethon.utils import get_peer_id
+
+from . import metrics
+from .backfill import backfill
+from .config import load_config
+from .consumer import consume_messages
+from .entity_cache import EntityCache
+from .ratelimit import RateLimiter
+from .reconcile import reconcile
+from .resolve import resolve
+from .storage.backfill_store import BackfillStore
+from .storage.state_store import StateStore
+from .tail import TailStats, tail_targets
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+    from .storage.batch_sink import BatchSink
+
+
+DEFAULT_SOCKET_PATH = Path('.state') / 'collector.sock'
+
+JOB_OPS = ('collect', 'backfill', 'reconcile', 'tail')
+
+
+class RequestError(Exception):
+    """A request the daemon cannot run (unknown op, bad arguments, unknown target)."""
+
+
+@dataclass
+class DaemonJob:
+    """One job run by the daemon; `info()` is what clients see."""
+    id: int
+    op: str
+    target: str | None
+    options: dict[str, Any]
+    status: str = 'running'  # 'done', 'failed' or 'cancelled' once finished
+    started: float = field(default_factory=time.monotonic)
+    finished: float | None = None
+    entity_id: int | None = None
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    tail_stats: TailStats | None = None
+    task: asyncio.Task | None = None
+    # set once the target is resolved; fails with RequestError if it is not
+    ready: asyncio.Future | None = field(default=None, repr=False)
+    # message counters of the entity when the job started
+    _base: tuple[float, float] = (0.0, 0.0)
+
+    @property
+    def key(self) -> tuple[str, str | None, str]:
+        return (self.op, self.target, json.dumps(self.options, sort_keys=True))
+
+    def _counts(self) -> tuple[float, float]:
+        if self.entity_id is None:
+            return (0.0, 0.0)
+        label = (str(self.entity_id),)
+        return (metrics.MESSAGES_FETCHED.values.get(label, 0.0), metrics.MESSAGES_STORED.values.get(label, 0.0))
+
+    def info(self) -> dict[str, Any]:
+        """JSON-serializable state of the job."""
+        end = self.finished if self.finished is not None else time.monotonic()
+        info: dict[str, Any] = {
+            'id': self.id,
+            'op': self.op,
+            'target': self.target,
+            'status': self.status,
+            'elapsed': round(end - self.started, 3),
+        }
+        if self.tail_stats is not None:
+            info['progress'] = dataclasses.asdict(self.tail_stats)
+        elif self.entity_id is not None:
+            # Counted from the per-entity metrics, so concurrent jobs on the
+            # same entity see each other's messages.
+            fetched, stored = self._counts()
+            info['progress'] = {'fetched': int(fetched - self._base[0]), 'stored': int(stored - self._base[1])}
+        if self.result is not None:
+            info['result'] = self.result
+        if self.error is not None:
+            info['error'] = self.error
+        return info
+
+
+def _result(r: Any) -> dict[str, Any]:
+    return {'summary': r.summary(), **dataclasses.asdict(r)}
+
+
+class CollectorDaemon:
+    """Runs collection jobs received on a Unix socket on one warm client.
+
+    `sink` (a `BatchSink` without `state`: backfills and full collects
+    walk newest first) receives the messages of every job but tails;
+    incremental `collect` jobs advance `state` themselves once their rows
+    are flushed. `tail_sink` (default `sink`) receives tailed messages and
+    may advance `state` itself, since the tail stores oldest to newest.
+    `progress` stores backfill plans and `pool` is used by `reconcile`
+    jobs. `keep_finished` bounds how many finished jobs `status` reports.
+    """
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        sink: 'BatchSink',
+        *,
+        tail_sink: 'BatchSink | None' = None,
+        pool: 'AsyncpgPool | None' = None,
+        state: StateStore | None = None,
+        progress: BackfillStore | None = None,
+        entity_cache: EntityCache | None = None,
+        rate_limiter: RateLimiter | None = None,
+        max_flood_wait: float | None = 30.0,
+        progress_interval: float = 1.0,
+        keep_finished: int = 50,
+    ) -> None:
+        self.client = client
+        self.sink = sink
+        self.tail_sink = tail_sink or sink
+        self.pool = pool
+        self.state = state
+        self.progress = progress
+        self.entity_cache = entity_cache
+        self.rate_limiter = rate_limiter
+        self.max_flood_wait = max_flood_wait
+        self.progress_interval = progress_interval
+        self.keep_finished = keep_finished
+        self.jobs: dict[int, DaemonJob] = {}
+        self.started = time.monotonic()
+        self._next_id = 1
+        self._stop = asyncio.Event()
+
+    async def serve(self, path: str | os.PathLike = DEFAULT_SOCKET_PATH) -> None:
+        """Accept requests on the socket at `path` until a `shutdown`
+        request or cancellation; running jobs are cancelled on the way out
+        and the sink is flushed."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.is_socket():
+            try:
+                _, writer = await asyncio.open_unix_connection(str(path))
+            except (ConnectionError, OSError):
+                # left over from a daemon that did not exit cleanly
+                path.unlink()
+            else:
+                writer.close()
+                raise RuntimeError(f'another daemon is listening on {path}')
+        server = await asyncio.start_unix_server(self._handle, str(path))
+        # only the owner may send jobs
+        os.chmod(path, 0o600)
+        print(f'Listening on {path}')
+        try:
+            async with server:
+                try:
+                    await self._stop.wait()
+                finally:
+                    # before the server closes: it waits for attached clients,
+                    # which wait for their jobs
+                    running = [j.task for j in self.jobs.values() if j.task is not None and not j.task.done()]
+                    for task in running:
+                        task.cancel()
+                    await asyncio.gather(*running, return_exceptions=True)
+        finally:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            await self.sink.flush()
+            if self.tail_sink is not self.sink:
+                await self.tail_sink.flush()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> dict[str, Any]:
+        return {
+            'uptime': round(time.monotonic() - self.started, 3),
+            'running': sum(1 for j in self.jobs.values() if j.status == 'running'),
+            'jobs': [j.info() for j in self.jobs.values()],
+            'sink': self.sink.stats.summary(),
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        async def send(event: str, **payload: Any) -> None:
+            writer.write(json.dumps({'event': event, **payload}, default=str).encode() + b'\n')
+            await writer.drain()
+
+        try:
+            line = await reader.readline()
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('expected a JSON object')
+            except ValueError as e:
+                await send('error', error=f'bad request: {e}')
+                return
+            op = request.get('op')
+            try:
+                if op == 'status':
+                    await send('status', **self.status())
+                elif op == 'cancel':
+                    job = self.jobs.get(request.get('job'))
+                    if job is None:
+                        raise RequestError(f'no job {request.get("job")!r}')
+                    if job.task is not None:
+                        job.task.cancel()
+                    await send('cancelled', job=job.info())
+                elif op == 'shutdown':
+                    await send('shutdown', **self.status())
+                    self.stop()
+                elif op in JOB_OPS:
+                    job = await self._start(request)
+                    await send('accepted', job=job.info())
+                    if request.get('detach') or op == 'tail':
+                        return
+                    while True:
+                        done, _ = await asyncio.wait({job.task}, timeout=self.progress_interval)
+                        if done:
+                            break
+                        await send('progress', job=job.info())
+                    await send('done', job=job.info())
+                else:
+                    raise RequestError(f'unknown op {op!r}')
+            except RequestError as e:
+                await send('error', error=str(e))
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except Exception as e:
+                await send('error', error=repr(e))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # the client went away; its job keeps running
+            pass
+        finally:
+            writer.close()
+
+    async def _start(self, request: dict[str, Any]) -> DaemonJob:
+        op = request['op']
+        target = request.get('target')
+        if op != 'tail' and not target:
+            raise RequestError(f'{op} needs a target')
+        options = {k: v for k, v in request.items() if k not in ('op', 'target', 'detach')}
+        job = DaemonJob(self._next_id, op, None if target is None else str(target), options)
+        # Nothing below awaits until the job is registered, so concurrent
+        # requests get distinct ids and see each other's jobs.
+        for other in self.jobs.values():
+            if other.status == 'running' and other.key == job.key:
+                await asyncio.shield(other.ready)
+                return other
+        if op == 'tail' and any(j.op == 'tail' and j.status == 'running' for j in self.jobs.values()):
+            raise RequestError('a tail job is already running; cancel it first')
+        self._next_id += 1
+        self.jobs[job.id] = job
+        self._forget_finished()
+        job.ready = asyncio.get_running_loop().create_future()
+        job.task = asyncio.create_task(self._run(job))
+        # the job resolves its target first; unknown targets are request errors
+        await asyncio.shield(job.ready)
+        return job
+
+    def _forget_finished(self) -> None:
+        finished = [j.id for j in self.jobs.values() if j.status != 'running']
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job_id]
+
+    async def _resolve(self, job: DaemonJob) -> Any:
+        try:
+            entity = await resolve(self.client, job.target, cache=self.entity_cache)
+        except Exception as e:
+            raise RequestError(f'could not resolve target {job.target!r}: {e!r}') from e
+        if entity is None:
+            raise RequestError(f'could not resolve target {job.target!r}')
+        job.entity_id = get_peer_id(entity)
+        job._base = job._counts()
+        return entity
+
+    async def _run(self, job: DaemonJob) -> None:
+        o = job.options
+        try:
+            entity = None if job.op == 'tail' else await self._resolve(job)
+            job.ready.set_result(None)
+            if job.op == 'collect':
+                count = await consume_messages(
+                    self.client,
+                    entity,
+                    self.sink,
+                    limit=o.get('limit'),
+                    state=self.state if o.get('incremental', True) else None,
+                    max_flood_wait=self.max_flood_wait,
+                    raise_errors=True,
+                )
+                job.result = {'summary': f'{count} messages stored', 'messages': count}
+            elif job.op == 'backfill':
+                if self.progress is None:
+                    raise RuntimeError('backfill jobs need a progress store')
+                job.result = _result(await backfill(
+                    self.client,
+                    entity,
+                    self.sink,
+                    progress=self.progress,
+                    segments=o.get('segments', 8),
+                    concurrency=o.get('concurrency', 4),
+                    rate_limiter=self.rate_limiter,
+                    restart=bool(o.get('restart')),
+                ))
+            elif job.op == 'reconcile':
+                job.result = _result(await reconcile(
+                    self.client,
+                    entity,
+                    self.sink,
+                    last=o.get('last'),
+                    days=o.get('days'),
+                    pool=self.pool,
+                    rate_limiter=self.rate_limiter,
+                    max_flood_wait=self.max_flood_wait,
+                ))
+            else:
+                await self._tail(job)
+            await self.sink.flush()
+            job.status = 'done'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+            if job.tail_stats is not None:
+                job.result = _result(job.tail_stats)
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e) if isinstance(e, RequestError) else repr(e)
+            print(f'Job {job.id} ({job.op} {job.target}) failed: {e!r}')
+        finally:
+            job.finished = time.monotonic()
+            if not job.ready.done():
+                job.ready.set_exception(RequestError(job.error or f'job {job.id} {job.status} before it started'))
+
+    async def _tail(self, job: DaemonJob) -> None:
+        entities = []
+        for t in job.options.get('targets') or load_config():
+            entity = await resolve(self.client, t, cache=self.entity_cache)
+            if entity is None:
+                print('Could not resolve target:', t)
+            else:
+                entities.append(entity)
+        if not entities:
+            raise RequestError('no targets to tail')
+        job.tail_stats = TailStats()
+        await tail_targets(self.client, entities, self.tail_sink, state=self.state, stats=job.tail_stats)
@@ -0,0 +1,225 @@
+"""Optional media download stage.
+
+`download_media` picks files recorded in `message_media` (see `media`)
+that are not in `media_files` yet, fetches their messages again (one
+request per 100 messages, for fresh file references; when a message was
+deleted or no longer carries the file, another message that carried it
+is tried) and downloads each
+file once into a `MediaStore`, keyed by its `file_unique_id`: a file
+forwarded to many channels is downloaded a single time. Downloads run
+with a global concurrency limit and an optional bandwidth limit shared by
+all of them; each finished file is recorded in `media_files` with its
+size and SHA-256.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import mimetypes
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterable
+
+from telethon import TelegramClient
+
+from .media import extract_media
+from .ratelimit import RateLimiter
+from .storage.media_store import pending_media, record_media_file
+from .storage.postgres_store import get_pg_pool
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+DEFAULT_MEDIA_DIR = Path('media')
+
+# Telegram returns at most 100 messages per `get_messages(ids=...)` request.
+_IDS_PER_REQUEST = 100
+
+
+class MediaStore:
+    """Downloaded files under `root`, named by their unique id.
+
+    `<root>/<last two digits of the id>/<file_unique_id><ext>`; the
+    extension comes from the mime type (or the original file name).
+    """
+
+    def __init__(self, root: str | os.PathLike = DEFAULT_MEDIA_DIR) -> None:
+        self.root = Path(root)
+
+    def relative_path(self, file_unique_id: str, mime_type: str | None, file_name: str | None) -> Path:
+        ext = mimetypes.guess_extension(mime_type) if mime_type else None
+        if not ext and file_name:
+            ext = os.path.splitext(file_name)[1]
+        return Path(file_unique_id[-2:]) / f'{file_unique_id}{ext or ""}'
+
+
+class _LimitedFile:
+    """File Telethon writes download chunks to: waits for the bandwidth
+    limiter before each chunk and hashes the content on the way."""
+
+    def __init__(self, f, limiter: RateLimiter | None) -> None:
+        self._f = f
+        self._limiter = limiter
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    async def write(self, chunk: bytes) -> None:
+        if self._limiter is not None:
+            await self._limiter.acquire(len(chunk))
+        self.sha256.update(chunk)
+        self._f.write(chunk)
+        self.size += len(chunk)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+
+@dataclass
+class DownloadStats:
+    files: int = 0
+    bytes: int = 0
+    # files none of whose messages still carry them
+    missing: int = 0
+    failed: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started
+        rate = self.bytes / elapsed if elapsed > 0 else 0.0
+        return (
+            f'{self.files} files ({self.bytes / 1e6:.1f} MB) in {elapsed:.1f}s ({rate / 1e6:.2f} MB/s), '
+            f'{self.missing} missing, {self.failed} failed'
+        )
+
+
+async def download_media(
+    client: TelegramClient,
+    *,
+    store: MediaStore | None = None,
+    pool: AsyncpgPool | None = None,
+    entity_ids: Iterable[int] | None = None,
+    kinds: Iterable[str] | None = None,
+    max_size: int | None = None,
+    limit: int | None = None,
+    concurrency: int = 4,
+    bandwidth: float | None = None,
+) -> DownloadStats:
+    """Download the files in `message_media` that are not in `media_files` yet.
+
+    Filters: `entity_ids`, `kinds` (see `media.MEDIA_KINDS`) and `max_size` in
+    bytes; `limit` caps the number of files. At most `concurrency` files
+    are downloaded at a time and, with `bandwidth` (bytes per second), all
+    of them together stay under that rate. A file that fails is left for
+    the next run.
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be >= 1')
+    p = pool or get_pg_pool()
+    if p is None:
+        raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+    store = store or MediaStore()
+    limiter = RateLimiter(bandwidth, burst=max(bandwidth, 1024 * 1024)) if bandwidth else None
+    stats = DownloadStats()
+    async with p.acquire() as conn:
+        wanted = await pending_media(conn, entity_ids=entity_ids, kinds=kinds, max_size=max_size, limit=limit)
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    # file_unique_id -> (entity_id, message_id) of the messages not tried yet
+    candidates = {r['file_unique_id']: list(zip(r['entity_ids'], r['message_ids'])) for r in wanted}
+    peers: dict[int, Any] = {}
+
+    async def peer_for(entity_id: int) -> Any:
+        if entity_id not in peers:
+            try:
+                peers[entity_id] = await client.get_input_entity(entity_id)
+            except Exception as e:
+                print(f'Warning: cannot resolve entity {entity_id} for media downloads: {e}')
+                peers[entity_id] = None
+        return peers[entity_id]
+
+    async def fetch_messages() -> None:
+        # Each round asks for the next candidate message of every file whose
+        # previous message was deleted or no longer carries it (edited).
+        todo = list(candidates)
+        while todo:
+            by_entity: dict[int, list[tuple[int, str]]] = {}
+            for fuid in todo:
+                entity_id, mid = candidates[fuid].pop(0)
+                by_entity.setdefault(entity_id, []).append((mid, fuid))
+            retry: list[str] = []
+
+            def gone(fuid: str, unresolved: bool = False) -> None:
+                if candidates[fuid]:
+                    retry.append(fuid)
+                elif unresolved:
+                    stats.failed += 1
+                else:
+                    stats.missing += 1
+
+            for entity_id, items in by_entity.items():
+                peer = await peer_for(entity_id)
+                if peer is None:
+                    for _, fuid in items:
+                        gone(fuid, unresolved=True)
+                    continue
+                for i in range(0, len(items), _IDS_PER_REQUEST):
+                    chunk = items[i:i + _IDS_PER_REQUEST]
+                    messages = await client.get_messages(peer, ids=[mid for mid, _ in chunk])
+                    for (_, fuid), m in zip(chunk, messages):
+                        info = extract_media(getattr(m, 'media', None)) if m is not None else None
+                        if info is None or info.file_unique_id != fuid:
+                            gone(fuid)
+                        else:
+                            await queue.put((entity_id, m, info))
+            todo = retry
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def download(entity_id: int, m: Any, info: Any) -> None:
+        rel = store.relative_path(info.file_unique_id, info.mime_type, info.file_name)
+        path = store.root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.part')
+        try:
+            with open(tmp, 'wb') as f:
+                out = _LimitedFile(f, limiter)
+                if await client.download_media(m, file=out) is None:
+                    stats.missing += 1
+                    return
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f'Warning: downloading {info.file_unique_id} ({entity_id}/{m.id}) failed: {e!r}')
+            stats.failed += 1
+            return
+        finally:
+            tmp.unlink(missing_ok=True)
+        async with p.acquire() as conn:
+            await record_media_file(conn, info.file_unique_id, rel.as_posix(), out.size, out.sha256.hexdigest())
+        stats.files += 1
+        stats.bytes += out.size
+
+    async def worker() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            try:
+                await download(*item)
+            except Exception as e:
+                print(f'Warning: media download failed: {e!r}')
+                stats.failed += 1
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        await fetch_messages()
+        await asyncio.gather(*workers)
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return stats
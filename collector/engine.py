@@ -0,0 +1,256 @@
+"""Collect many targets concurrently on one `TelegramClient` or a pool of them.
+
+Targets are scheduled round-robin: a worker takes a target from the run
+queue, pulls at most `slice_size` messages from its stream and puts it back
+at the end of the queue. A channel with millions of messages therefore
+shares the workers with small channels instead of holding one until it is
+exhausted. `concurrency` bounds how many targets are being fetched (and
+so how many Telegram requests are in flight) at any moment.
+
+With a `state` store every target is collected incrementally from its
+checkpoint (see `consume_messages`).
+
+`collect_with_pool` does the same over several accounts (`ClientPool`).
+When a target's account hits a long flood wait, the target's stream is
+closed and the target continues from its last message on another account.
+"""
+from __future__ import annotations
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Awaitable, Callable, Iterable
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+from telethon.tl.custom.message import Message
+from telethon.utils import get_peer_id
+
+from .client_pool import Account, ClientPool
+from .consumer import load_checkpoint, manages_state, process_message
+from .entity_cache import EntityCache
+from .resolve import resolve
+from .storage import print_store
+from .storage.state_store import StateStore
+from .stream import StreamStats, stream_messages
+
+
+@dataclass
+class TargetResult:
+    """Outcome of collecting one target."""
+    target: str
+    status: str = 'pending'  # 'ok', 'unresolved' or 'error'
+    messages: int = 0
+    skipped: int = 0
+    # messages the sink raised on; the checkpoint stays below the first
+    failed: int = 0
+    error: str | None = None
+    elapsed: float = 0.0
+    stream: StreamStats = field(default_factory=StreamStats)
+    accounts: list[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        line = (
+            f'{self.target}: {self.status}, {self.messages} stored, {self.skipped} skipped, {self.failed} failed, '
+            f'{self.stream.pages} pages, {self.stream.flood_waits} flood waits, {self.elapsed:.1f}s'
+        )
+        if len(self.accounts) > 1:
+            line += f' via {" -> ".join(self.accounts)}'
+
+        if self.error:
+            line += f' ({self.error})'
+        return line
+
+
+@dataclass
+class _Job:
+    result: TargetResult
+    stream: AsyncGenerator[Message, None] | None = None
+    account: Account | None = None
+    # stats of the stream currently open on `account`
+    segment: StreamStats = field(default_factory=StreamStats)
+    checkpoint: int | None = None
+    checkpoint_loaded: bool = False
+    entity_id: int | None = None
+    high_water: int = 0
+    last_id: int | None = None
+    # set when a worker first takes the job, not when it is queued
+    started: float | None = None
+
+
+async def collect_targets(
+    client: TelegramClient,
+    targets: Iterable[str],
+    store_func: Callable[[object], Awaitable[None]] = print_store,
+    *,
+    concurrency: int = 8,
+    slice_size: int = 200,
+    limit: int | None = None,
+    state: StateStore | None = None,
+    entity_cache: EntityCache | None = None,
+) -> list[TargetResult]:
+    """Collect `targets` concurrently and return one `TargetResult` each.
+
+    `limit` caps the messages fetched per target. Failures are recorded in
+    the target's result and never abort the other targets. Targets are
+    resolved through `entity_cache` when one is given.
+    """
+    return await collect_with_pool(
+        ClientPool.single(client, entity_cache),
+        targets,
+        store_func,
+        concurrency=concurrency,
+        slice_size=slice_size,
+        limit=limit,
+        state=state,
+    )
+
+
+async def collect_with_pool(
+    pool: ClientPool,
+    targets: Iterable[str],
+    store_func: Callable[[object], Awaitable[None]] = print_store,
+    *,
+    concurrency: int = 8,
+    slice_size: int = 200,
+    limit: int | None = None,
+    state: StateStore | None = None,
+) -> list[TargetResult]:
+    """Like `collect_targets`, spreading targets over the accounts of `pool`."""
+    if concurrency < 1:
+        raise ValueError('concurrency must be >= 1')
+    if slice_size < 1:
+        raise ValueError('slice_size must be >= 1')
+
+    results = [TargetResult(target=str(t)) for t in targets]
+    queue: asyncio.Queue[_Job] = asyncio.Queue()
+    for r in results:
+        queue.put_nowait(_Job(result=r))
+
+    async def detach(job: _Job) -> None:
+        """Close the job's stream and fold its stats into the totals."""
+        stream, job.stream = job.stream, None
+        try:
+            if stream is not None:
+                await stream.aclose()
+        finally:
+            # the account is released even when closing the stream fails
+            if job.account is not None:
+                job.account.active -= 1
+                job.account.stats.stream.add(job.segment)
+                job.result.stream.add(job.segment)
+                job.account = None
+            job.segment = StreamStats()
+
+    async def attach(job: _Job) -> bool:
+        """Open a stream for the job; return False if it cannot be resolved."""
+        r = job.result
+        account = await pool.acquire(r.target)
+        entity = await resolve(account.client, r.target, cache=account.cache)
+        if entity is None:
+            return False
+        job.account = account
+        account.active += 1
+        if not r.accounts or r.accounts[-1] != account.session:
+            r.accounts.append(account.session)
+            account.stats.targets += 1
+        if state is not None and not job.checkpoint_loaded:
+            job.entity_id = get_peer_id(entity)
+            job.checkpoint = await load_checkpoint(state, entity)
+            job.checkpoint_loaded = True
+
+        # Continue after the last message handled on a previous account.
+        resume_after_id, offset_id = job.checkpoint, 0
+        if job.last_id is not None:
+            if resume_after_id is not None:
+                resume_after_id = job.last_id
+            else:
+                offset_id = job.last_id
+        remaining = None if limit is None else max(0, limit - r.messages - r.skipped - r.failed)
+        job.stream = stream_messages(
+            account.client,
+            entity,
+            resume_after_id=resume_after_id,
+            offset_id=offset_id,
+            limit=remaining,
+            stats=job.segment,
+            max_flood_wait=pool.max_flood_wait,
+        )
+        return True
+
+    async def run_slice(job: _Job) -> bool:
+        """Advance `job` by one slice; return True when the target is done."""
+        r = job.result
+        if job.stream is None and not await attach(job):
+            r.status = 'unresolved'
+            return True
+        for _ in range(slice_size):
+            try:
+                m = await anext(job.stream)
+            except StopAsyncIteration:
+                r.status = 'ok'
+                if r.failed and job.checkpoint is None:
+                    # walked newest first: nothing is safe to advance to
+                    job.high_water = 0
+                if job.high_water and not manages_state(store_func, state):
+                    # flush first so the checkpoint never gets ahead of stored rows
+                    flush = getattr(store_func, 'flush', None)
+                    if flush is not None:
+                        await flush()
+                    await state.advance({job.entity_id: job.high_water})
+                return True
+            except FloodWaitError as e:
+                # Too long to sleep through: park this account and let the
+                # target continue elsewhere.
+                account = job.account
+                pool.flood(account, max(0, int(e.seconds)))
+                account.stats.moved_away += 1
+                await detach(job)
+                return False
+            job.last_id = m.id
+            outcome = await process_message(m, store_func)
+            if outcome == 'ok':
+                r.messages += 1
+                if state is not None and not r.failed:
+                    job.high_water = max(job.high_water, m.id)
+            elif outcome == 'failed':
+                r.failed += 1
+            else:
+                r.skipped += 1
+        if pool.should_move(job.account):
+            job.account.stats.moved_away += 1
+            await detach(job)
+        return False
+
+    async def worker() -> None:
+        while True:
+            job = await queue.get()
+            if job.started is None:
+                job.started = time.monotonic()
+            try:
+                try:
+                    done = await run_slice(job)
+                except Exception as e:
+                    job.result.status = 'error'
+                    job.result.error = repr(e)
+                    done = True
+                if done:
+                    job.result.elapsed = time.monotonic() - job.started
+                    try:
+                        await detach(job)
+                    except Exception as e:
+                        # keep the worker alive, or queue.join() never returns
+                        print(f'Warning: closing the stream of {job.result.target} failed: {e!r}')
+                else:
+                    # back of the line: other targets get their turn first
+                    queue.put_nowait(job)
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(results)))]
+    try:
+        await queue.join()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return results
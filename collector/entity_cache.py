@@ -0,0 +1,130 @@
+"""Persistent cache of resolved targets.
+
+Resolving a username costs a `contacts.resolveUsername` request, one of the
+most heavily rate-limited calls in the API. The cache maps target strings
+(usernames and numeric ids, as they appear in `config.json`) to the input
+peer Telegram needs (`id` + `access_hash`), so warm runs resolve targets
+without any request.
+
+Access hashes are per account, so there is one cache file per session,
+stored next to it: `.sessions/<session>.entities.json`. Entries older than
+`ttl` seconds are revalidated with `get_entity`; if that fails the stale
+entry is still used.
+"""
+from __future__ import annotations
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+from telethon import utils
+from telethon.tl import types
+
+from .type_annotations import Entity
+
+DEFAULT_TTL = 7 * 24 * 3600  # seconds
+
+
+def target_key(target: Any) -> str:
+    """Canonical cache key: usernames lower-cased without '@', ids as ints."""
+    key = str(target).strip()
+    try:
+        return str(int(key))
+    except ValueError:
+        return key.lstrip('@').lower()
+
+
+class EntityCache:
+    """JSON-file backed map of target -> input peer.
+
+    Use as a context manager (or call `save()`) to write changes back.
+    """
+
+    def __init__(self, path: str | os.PathLike, ttl: float = DEFAULT_TTL) -> None:
+        self.path = Path(path)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[str, dict[str, Any]] = {}
+        self._dirty = False
+        if self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except Exception as e:
+                print(f'Warning: failed to read {self.path}:', e)
+
+    @classmethod
+    def for_session(cls, session: str, ttl: float = DEFAULT_TTL) -> 'EntityCache':
+        """Cache file stored alongside the session used by `create_client`."""
+        sess_path = Path(session)
+        if str(sess_path.parent) in ('.', ''):
+            sess_path = Path('.sessions') / session
+        return cls(sess_path.with_name(sess_path.name + '.entities.json'), ttl=ttl)
+
+    def __enter__(self) -> 'EntityCache':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.save()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, target: Any) -> tuple[types.TypeInputPeer | None, bool]:
+        """Return `(input_peer, fresh)`; `(None, False)` when not cached."""
+        entry = self._entries.get(target_key(target))
+        if entry is None:
+            return None, False
+        kind, pid, access_hash = entry['type'], entry['id'], entry.get('access_hash')
+        if kind == 'channel':
+            peer = types.InputPeerChannel(pid, access_hash or 0)
+        elif kind == 'user':
+            peer = types.InputPeerUser(pid, access_hash or 0)
+        else:
+            peer = types.InputPeerChat(pid)
+        fresh = time.time() - entry.get('resolved_at', 0) < self.ttl
+        return peer, fresh
+
+    def add(self, entity: Entity, *targets: Any) -> None:
+        """Cache `entity` under `targets` plus its username and marked id.
+
+        The bare id is not a key: user, chat and channel ids overlap, so
+        only the marked id (`get_peer_id`) names one peer.
+        """
+        peer = utils.get_input_peer(entity, allow_self=False)
+        if isinstance(peer, types.InputPeerChannel):
+            entry = {'type': 'channel', 'id': peer.channel_id, 'access_hash': peer.access_hash}
+        elif isinstance(peer, types.InputPeerUser):
+            entry = {'type': 'user', 'id': peer.user_id, 'access_hash': peer.access_hash}
+        elif isinstance(peer, types.InputPeerChat):
+            entry = {'type': 'chat', 'id': peer.chat_id}
+        else:
+            return
+        entry['resolved_at'] = time.time()
+        keys = {target_key(t) for t in targets}
+        keys.add(str(utils.get_peer_id(peer)))
+        username = getattr(entity, 'username', None)
+        if username:
+            keys.add(target_key(username))
+        for k in keys:
+            self._entries[k] = entry
+        self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp.write_text(json.dumps(self._entries, indent=1, sort_keys=True))
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+
+async def cache_dialogs(client, cache: EntityCache, limit: int | None = None) -> int:
+    """Fill `cache` from one `iter_dialogs` pass; returns the dialogs seen."""
+    count = 0
+    async for d in client.iter_dialogs(limit=limit):
+        cache.add(d.entity)
+        count += 1
+    return count
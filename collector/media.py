@@ -0,0 +1,120 @@
+"""Media metadata of messages.
+
+`extract_media` reduces a message's `media` to a `MediaInfo`: kind, size,
+mime type, dimensions, duration, file name and ids. It only reads the TL
+objects Telegram already sent with the message, so it costs no requests.
+Normalization attaches it to every message with media and the sinks store
+it in `message_media`, in the same transaction as the message.
+
+`file_unique_id` identifies the file itself (`photo-<id>` or
+`document-<id>`, Telegram's id of the photo or document), so a file
+forwarded to many channels has one unique id. `file_id` is the bot-API
+style id Telethon packs for documents (its packing no longer works for
+photos, which get None). Downloading is a separate
+stage, see `downloader`.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any
+
+from telethon import utils
+from telethon.tl import types
+
+MEDIA_KINDS = (
+    'photo', 'video', 'animation', 'video_note', 'sticker', 'audio', 'voice', 'document',
+    'webpage', 'geo', 'venue', 'contact', 'poll', 'dice', 'other',
+)
+
+_OTHER_KINDS = {
+    types.MessageMediaWebPage: 'webpage',
+    types.MessageMediaGeo: 'geo',
+    types.MessageMediaGeoLive: 'geo',
+    types.MessageMediaVenue: 'venue',
+    types.MessageMediaContact: 'contact',
+    types.MessageMediaPoll: 'poll',
+    types.MessageMediaDice: 'dice',
+}
+
+
+@dataclass(slots=True)
+class MediaInfo:
+    kind: str
+    file_unique_id: str | None = None
+    file_id: str | None = None
+    size: int | None = None
+    mime_type: str | None = None
+    width: int | None = None
+    height: int | None = None
+    duration: float | None = None
+    file_name: str | None = None
+
+    def row(self, entity_id: int, message_id: int) -> tuple:
+        """The `storage.media_store.MEDIA_COLUMNS` row for this message."""
+        return (
+            entity_id, message_id, self.kind, self.file_unique_id, self.file_id, self.size,
+            self.mime_type, self.width, self.height, self.duration, self.file_name,
+        )
+
+
+def _bot_file_id(doc: Any) -> str | None:
+    # Telethon no longer maintains the packing; don't let it fail a message.
+    try:
+        return utils.pack_bot_file_id(doc)
+    except Exception:
+        return None
+
+
+def _photo_info(photo: Any) -> MediaInfo:
+    info = MediaInfo('photo', mime_type='image/jpeg')
+    if not isinstance(photo, types.Photo):
+        # expired self-destructing photo
+        return info
+    info.file_unique_id = f'photo-{photo.id}'
+    # the largest size is the one that gets downloaded
+    for s in photo.sizes:
+        if isinstance(s, types.PhotoSize):
+            size = s.size
+        elif isinstance(s, types.PhotoSizeProgressive):
+            size = max(s.sizes) if s.sizes else 0
+        else:
+            continue
+        if info.size is None or size > info.size:
+            info.size, info.width, info.height = size, s.w, s.h
+    return info
+
+
+def _document_info(doc: Any) -> MediaInfo:
+    if not isinstance(doc, types.Document):
+        return MediaInfo('document')
+    info = MediaInfo(
+        'document', f'document-{doc.id}', _bot_file_id(doc), doc.size, doc.mime_type or None,
+    )
+    kind = None
+    for attr in doc.attributes:
+        if isinstance(attr, types.DocumentAttributeFilename):
+            info.file_name = attr.file_name
+        elif isinstance(attr, types.DocumentAttributeSticker):
+            kind = 'sticker'
+        elif isinstance(attr, types.DocumentAttributeAnimated):
+            kind = kind or 'animation'
+        elif isinstance(attr, types.DocumentAttributeVideo):
+            kind = kind or ('video_note' if attr.round_message else 'video')
+            info.width, info.height, info.duration = attr.w, attr.h, float(attr.duration)
+        elif isinstance(attr, types.DocumentAttributeAudio):
+            kind = kind or ('voice' if attr.voice else 'audio')
+            info.duration = float(attr.duration)
+        elif isinstance(attr, types.DocumentAttributeImageSize):
+            info.width, info.height = attr.w, attr.h
+    info.kind = kind or 'document'
+    return info
+
+
+def extract_media(media: Any) -> MediaInfo | None:
+    """Metadata of a message's `media`, or None when it has none."""
+    if not media:
+        return None
+    if isinstance(media, types.MessageMediaPhoto):
+        return _photo_info(media.photo)
+    if isinstance(media, types.MessageMediaDocument):
+        return _document_info(media.document)
+    return MediaInfo(_OTHER_KINDS.get(type(media), 'other'))
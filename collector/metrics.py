@@ -0,0 +1,338 @@
+"""Process-wide collection metrics with Prometheus text exposition.
+
+The collector updates the metrics below as it runs; nothing is exported
+unless asked for:
+
+- `start_metrics_server(port)` serves `REGISTRY.render()` (Prometheus text
+  format 0.0.4) over HTTP from the running event loop, so a scraper can
+  watch a long run.
+- `REGISTRY.snapshot()` returns the same data as a JSON-friendly dict
+  (`write_snapshot()` saves it) and `format_summary()` a short
+  human-readable end-of-run report.
+
+Metric families:
+
+- `tg_messages_{fetched,normalized,skipped,stored}_total{entity}`: stages
+  of the consume path. "stored" counts messages accepted by the sink;
+  `tg_sink_rows_written_total` counts rows a database sink inserted or
+  changed and `tg_sink_rows_unchanged_total` rows it skipped as unchanged.
+- `tg_messages_{edited,deleted}_total{entity}`: stored messages that
+  reconciliation (`collector.reconcile`) found edited or deleted.
+- `tg_flood_waits_total` / `tg_flood_wait_seconds_total`: flood waits
+  received and the seconds Telegram asked for.
+- `tg_page_fetch_seconds` / `tg_sink_write_seconds{sink}`: latency
+  histograms of history requests and sink writes.
+- `tg_target_lag_seconds{entity}`: seconds between now and the date of the
+  newest message collected for the target.
+
+The implementation is dependency-free and not thread-safe; all updates
+happen on the event loop.
+"""
+from __future__ import annotations
+import asyncio
+import datetime
+import json
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Iterable
+
+
+Labels = tuple[str, ...]
+
+# Seconds; covers a local COPY (milliseconds) up to a slow Telegram page.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(v: float) -> str:
+    if math.isinf(v):
+        return '+Inf' if v > 0 else '-Inf'
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict[str, Any]) -> Labels:
+        # Called for every update, so keep the common path cheap.
+        if len(labels) == 1 and len(self.labelnames) == 1:
+            (name, value), = labels.items()
+            if name == self.labelnames[0]:
+                return (str(value),)
+        try:
+            key = tuple([str(labels[n]) for n in self.labelnames])
+        except KeyError:
+            key = None
+        if key is None or len(labels) != len(self.labelnames):
+            raise ValueError(f'{self.name}: expected labels {self.labelnames}, got {tuple(labels)}')
+        return key
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def render(self) -> list[str]:
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}'
+            for k, v in sorted(self.values.items())
+        ]
+
+    def snapshot(self) -> Any:
+        if not self.labelnames:
+            return self.values.get((), 0.0)
+        return {','.join(k): v for k, v in sorted(self.values.items())}
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: Any) -> None:
+        self.values[self._key(labels)] = value
+
+
+class LagGauge(Gauge):
+    """Reports `now - timestamp` for the newest timestamp seen per label set."""
+
+    def observe(self, timestamp: float, **labels: Any) -> None:
+        key = self._key(labels)
+        if timestamp > self.values.get(key, -math.inf):
+            self.values[key] = timestamp
+
+    def _lags(self) -> dict[Labels, float]:
+        now = time.time()
+        return {k: max(0.0, now - ts) for k, ts in self.values.items()}
+
+    def render(self) -> list[str]:
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(round(v, 3))}'
+            for k, v in sorted(self._lags().items())
+        ]
+
+    def snapshot(self) -> Any:
+        return {','.join(k): round(v, 3) for k, v in sorted(self._lags().items())}
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(
+        self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # per label set: [bucket counts..., sum, max]
+        self.values: dict[Labels, list[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [0.0] * len(self.buckets) + [0.0, 0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        row[-2] += value
+        row[-1] = max(row[-1], value)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for key, row in sorted(self.values.items()):
+            cumulative = 0.0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(row[-2])}')
+            lines.append(f'{self.name}_count{labels} {_format_value(cumulative)}')
+        return lines
+
+    def snapshot(self) -> Any:
+        out = {}
+        for key, row in sorted(self.values.items()):
+            count = sum(row[:-2])
+            out[','.join(key) or 'all'] = {
+                'count': int(count),
+                'avg': round(row[-2] / count, 6) if count else 0.0,
+                'max': round(row[-1], 6),
+            }
+        return out
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> Any:
+        if metric.name in self.metrics:
+            raise ValueError(f'metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict[str, Any]:
+        return {name: m.snapshot() for name, m in self.metrics.items()}
+
+    def reset(self) -> None:
+        for m in self.metrics.values():
+            m.values.clear()
+
+
+REGISTRY = Registry()
+
+MESSAGES_FETCHED = REGISTRY.register(Counter(
+    'tg_messages_fetched_total', 'Messages received from Telegram', ('entity',)))
+MESSAGES_NORMALIZED = REGISTRY.register(Counter(
+    'tg_messages_normalized_total', 'Messages normalized successfully', ('entity',)))
+MESSAGES_SKIPPED = REGISTRY.register(Counter(
+    'tg_messages_skipped_total', 'Messages skipped because normalization failed', ('entity',)))
+MESSAGES_STORED = REGISTRY.register(Counter(
+    'tg_messages_stored_total', 'Messages accepted by the sink', ('entity',)))
+MESSAGES_EDITED = REGISTRY.register(Counter(
+    'tg_messages_edited_total', 'Stored messages found edited by reconciliation', ('entity',)))
+MESSAGES_DELETED = REGISTRY.register(Counter(
+    'tg_messages_deleted_total', 'Stored messages found deleted by reconciliation', ('entity',)))
+SINK_ROWS_WRITTEN = REGISTRY.register(Counter(
+    'tg_sink_rows_written_total', 'Rows committed to the database', ('sink',)))
+SINK_ROWS_UNCHANGED = REGISTRY.register(Counter(
+    'tg_sink_rows_unchanged_total', 'Rows not rewritten because their content hash was unchanged', ('sink',)))
+SINK_ROWS_SPOOLED = REGISTRY.register(Counter(
+    'tg_sink_rows_spooled_total', 'Rows written to the local spool instead of the database', ('sink',)))
+FLOOD_WAITS = REGISTRY.register(Counter(
+    'tg_flood_waits_total', 'FloodWaitError responses received'))
+FLOOD_WAIT_SECONDS = REGISTRY.register(Counter(
+    'tg_flood_wait_seconds_total', 'Seconds of flood wait requested by Telegram'))
+PAGE_FETCH_SECONDS = REGISTRY.register(Histogram(
+    'tg_page_fetch_seconds', 'Time spent waiting for one page of message history'))
+SINK_WRITE_SECONDS = REGISTRY.register(Histogram(
+    'tg_sink_write_seconds', 'Time spent in one sink write (a batch flush or a single row)', ('sink',)))
+TARGET_LAG_SECONDS = REGISTRY.register(LagGauge(
+    'tg_target_lag_seconds', 'Seconds since the newest collected message of the target', ('entity',)))
+
+
+def observe_message_date(entity_id: int, date: datetime.datetime | None) -> None:
+    """Update the lag of `entity_id` from a collected message's date."""
+    if date is not None:
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        TARGET_LAG_SECONDS.observe(date.timestamp(), entity=entity_id)
+
+
+def format_summary(registry: Registry = REGISTRY) -> str:
+    """Short end-of-run report of the main counters and latencies."""
+    def total(name: str) -> int:
+        return int(registry.metrics[name].total())
+
+    pages = registry.metrics['tg_page_fetch_seconds'].snapshot().get('all', {})
+    writes = registry.metrics['tg_sink_write_seconds'].snapshot()
+    lines = [
+        f'messages: {total("tg_messages_fetched_total")} fetched, '
+        f'{total("tg_messages_normalized_total")} normalized, '
+        f'{total("tg_messages_skipped_total")} skipped, '
+        f'{total("tg_messages_stored_total")} stored',
+        f'flood waits: {total("tg_flood_waits_total")} ({total("tg_flood_wait_seconds_total")}s requested)',
+        f'page fetches: {pages.get("count", 0)} (avg {pages.get("avg", 0.0) * 1000:.1f} ms, '
+        f'max {pages.get("max", 0.0) * 1000:.1f} ms)',
+    ]
+    for sink, w in writes.items():
+        lines.append(
+            f'sink writes ({sink}): {w["count"]} (avg {w["avg"] * 1000:.1f} ms, max {w["max"] * 1000:.1f} ms)'
+        )
+    spooled = total('tg_sink_rows_spooled_total')
+    if spooled:
+        lines.append(f'spooled: {spooled} rows (load them with scripts/replay_spool.py)')
+    lags = registry.metrics['tg_target_lag_seconds'].snapshot()
+    if lags:
+        worst = max(lags.items(), key=lambda kv: kv[1])
+        lines.append(f'lag: {len(lags)} targets, max {worst[1]:.0f}s ({worst[0]})')
+    return '\n'.join(lines)
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, registry: Registry) -> None:
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        path = request.split()[1] if len(request.split()) > 1 else b'/'
+        if path.split(b'?')[0] in (b'/', b'/metrics'):
+            body = registry.render().encode()
+            status = b'200 OK'
+        else:
+            body = b'not found\n'
+            status = b'404 Not Found'
+        writer.write(
+            b'HTTP/1.1 ' + status + b'\r\n'
+            b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+            b'Connection: close\r\n\r\n' + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY) -> asyncio.Server:
+    """Serve `registry` at `http://host:port/metrics` until the server is closed."""
+    return await asyncio.start_server(lambda r, w: _handle(r, w, registry), host, port)
+
+
+@asynccontextmanager
+async def serve_metrics(
+    port: int | None, host: str = '127.0.0.1', registry: Registry = REGISTRY
+) -> AsyncIterator[asyncio.Server | None]:
+    """Serve metrics for the duration of the block; does nothing without a port."""
+    if not port:
+        yield None
+        return
+    server = await start_metrics_server(port, host, registry)
+    print(f'Serving metrics on http://{host}:{port}/metrics')
+    try:
+        yield server
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def write_snapshot(path: str | os.PathLike, registry: Registry = REGISTRY) -> None:
+    """Write `registry.snapshot()` as JSON to `path`."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(registry.snapshot(), f, indent=2, sort_keys=True)
@@ -1,67 +1,154 @@
 """Normalize and validate Telethon `Message` objects before persistence.
 
-The helper aims to be conservative: it validates required fields (id, sender)
+The helper aims to be conservative: it validates required fields (id, chat, sender)
 and coerces optional ones to safe Python types. On validation failure it
 raises ValueError with a clear message naming the field and the reason.
+
+`normalize_batch` applies the same rules to a page of messages and returns
+the row tuples the batch sink stores (see `MessageRow`), skipping the
+intermediate `NormalizedMessage` objects.
+
+Messages with media also carry its metadata (`media.extract_media`).
 """
 from __future__ import annotations
-from typing import Any
+from typing import Any, Callable, Iterable
 import datetime
+import hashlib
 from dataclasses import dataclass
 
+from .media import MediaInfo, extract_media
+
+
+# (entity_id, id, date, sender, text, has_media, media): the column order
+# of `storage.batch_sink.MESSAGE_COLUMNS` up to `has_media`, then the media
+# metadata (None without media). `date` may be None.
+MessageRow = tuple[int, int, 'datetime.datetime | None', str, str, bool, 'MediaInfo | None']
 
-@dataclass
+
+@dataclass(slots=True)
 class NormalizedMessage:
     id: int
     sender: str
     date: datetime.datetime | None
     text: str
     has_media: bool
+    # Marked id of the chat the message belongs to (`Message.chat_id`);
+    # Telegram message ids are only unique within a chat.
+    entity_id: int | None = None
+    media: MediaInfo | None = None
+    # Raw TL payload, set by the consumer when the sink archives it
+    # (`storage.raw_archive`).
+    raw: bytes | None = None
 
+    def row(self) -> MessageRow:
+        return (self.entity_id, self.id, self.date, self.sender, self.text, self.has_media, self.media)
 
-def normalize_message(m: Any) -> NormalizedMessage:
-    """Return a NormalizedMessage built from `m`.
+    def content_hash(self) -> int:
+        return content_hash(self.sender, self.text, self.has_media, self.media and self.media.file_unique_id)
 
-    Coerces and validates fields deterministically. Raises ValueError
-    with a clear message if a required field is missing or cannot be
-    coerced.
+
+def content_hash(sender: str, text: str, has_media: bool, file_unique_id: str | None = None) -> int:
+    """Stable 64-bit hash of the parts of a message that can change.
+
+    Covers what the sink writes besides the key (`date` is fixed at send
+    time), including the attached file, so an edit that only replaces the
+    media is seen as a change. Returned as a signed integer so it fits a
+    Postgres BIGINT; the value is the same across processes and Python
+    versions, and messages without a file keep the hash they had before
+    files were covered.
     """
+    data = f'{sender}\0{int(has_media)}\0{text}'
+    if file_unique_id:
+        data = f'{sender}\0{int(has_media)}\0{file_unique_id}\0{text}'
+    data = data.encode('utf-8', 'surrogatepass')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big', signed=True)
+
+
+def _normalize_row(m: Any) -> MessageRow:
+    # Exact-type checks skip the coercion calls for the values Telethon
+    # actually produces; anything else goes through the original path.
     mid = getattr(m, 'id', None)
-    if mid is None:
-        raise ValueError("normalize_message: missing required field 'id'")
-    try:
-        mid_val = int(mid)
-    except Exception as e:
-        raise ValueError(f"normalize_message: invalid 'id' value {mid!r}: {e}")
+    if type(mid) is not int:
+        if mid is None:
+            raise ValueError("normalize_message: missing required field 'id'")
+        try:
+            mid = int(mid)
+        except Exception as e:
+            raise ValueError(f"normalize_message: invalid 'id' value {mid!r}: {e}")
+
+    entity = getattr(m, 'chat_id', None)
+    if type(entity) is not int:
+        if entity is None:
+            raise ValueError(f"normalize_message: missing required field 'chat_id' for message id {mid!r}")
+        try:
+            entity = int(entity)
+        except Exception as e:
+            raise ValueError(f"normalize_message: invalid 'chat_id' value {entity!r} for message id {mid!r}: {e}")
 
     sender = getattr(m, 'sender_id', None)
     if sender is None:
-        raise ValueError(f"normalize_message: missing required field 'sender_id' for message id {mid_val!r}")
-    try:
-        sender_str = str(sender)
-    except Exception as e:
-        raise ValueError(f"normalize_message: cannot stringify 'sender_id' ({sender!r}) for message id {mid_val!r}: {e}")
+        raise ValueError(f"normalize_message: missing required field 'sender_id' for message id {mid!r}")
+    if type(sender) is not str:
+        try:
+            sender = str(sender)
+        except Exception as e:
+            raise ValueError(
+                f"normalize_message: cannot stringify 'sender_id' ({sender!r}) for message id {mid!r}: {e}"
+            )
 
     date = getattr(m, 'date', None)
-    if date is None:
-        date_val = None
-    else:
-        if isinstance(date, datetime.datetime):
-            date_val = date
-        else:
-            try:
-                date_val = datetime.datetime.fromisoformat(str(date))
-            except Exception:
-                # fallback to string-preserved value (DB will accept str)
-                date_val = None
+    if date is not None and not isinstance(date, datetime.datetime):
+        try:
+            date = datetime.datetime.fromisoformat(str(date))
+        except Exception:
+            # fallback to string-preserved value (DB will accept str)
+            date = None
 
     text = getattr(m, 'text', '') or ''
-    try:
-        text = str(text)
-    except Exception as e:
-        raise ValueError(f"normalize_message: cannot coerce 'text' to str for message id {mid_val!r}: {e}")
-    text = text.replace('\n', ' ')
+    if type(text) is not str:
+        try:
+            text = str(text)
+        except Exception as e:
+            raise ValueError(f"normalize_message: cannot coerce 'text' to str for message id {mid!r}: {e}")
+    if '\n' in text:
+        text = text.replace('\n', ' ')
 
-    has_media = bool(getattr(m, 'media', None))
+    media = getattr(m, 'media', None)
+    if media:
+        return (entity, mid, date, sender, text, True, extract_media(media))
+    return (entity, mid, date, sender, text, False, None)
 
-    return NormalizedMessage(id=mid_val, sender=sender_str, date=date_val, text=text, has_media=has_media)
+
+def normalize_message(m: Any) -> NormalizedMessage:
+    """Return a NormalizedMessage built from `m`.
+
+    Coerces and validates fields deterministically. Raises ValueError
+    with a clear message if a required field is missing or cannot be
+    coerced.
+    """
+    entity, mid, date, sender, text, has_media, media = _normalize_row(m)
+    return NormalizedMessage(mid, sender, date, text, has_media, entity, media)
+
+
+def _report(m: Any, e: ValueError) -> None:
+    print(f"Skipping message {getattr(m, 'id', None)!r}: normalization failed: {e}")
+
+
+def normalize_batch(
+    messages: Iterable[Any], on_error: Callable[[Any, ValueError], None] | None = _report
+) -> list[MessageRow]:
+    """Normalize `messages` straight into sink rows.
+
+    Messages that fail validation are left out and passed to `on_error`
+    with the same ValueError `normalize_message` would raise (by default
+    the skip is printed, as `process_message` does).
+    """
+    rows = []
+    append = rows.append
+    for m in messages:
+        try:
+            append(_normalize_row(m))
+        except ValueError as e:
+            if on_error is not None:
+                on_error(m, e)
+    return rows
@@ -0,0 +1,225 @@
+"""Staged fetch -> normalize -> store pipeline connected by bounded queues.
+
+`consume_messages` awaits the sink inline for every message, so a slow
+database stalls Telegram fetches and vice versa. `run_pipeline` runs the
+same work as independent tasks:
+
+    stream_messages --raw queue--> normalize --row queue--> sink worker(s)
+
+The queues are bounded, so a slow stage applies backpressure upstream
+instead of buffering without limit. The first error in any stage cancels
+the others and is re-raised; cancelling `run_pipeline` cancels every stage.
+
+`PipelineStats` records, per stage, time spent working, waiting for input
+(starved) and waiting for room downstream (blocked), plus the average
+queue occupancy. A raw queue that is usually full means normalization or
+storage is the bottleneck; two mostly empty queues mean Telegram is.
+"""
+from __future__ import annotations
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from telethon import TelegramClient
+from telethon.tl.custom.message import Message
+from telethon.utils import get_peer_id
+
+from . import metrics
+from .consumer import load_checkpoint, manages_state
+from .normalize import normalize_message
+from .storage import print_store
+from .storage.raw_archive import raw_payload
+from .storage.state_store import StateStore
+from .stream import StreamStats, stream_messages
+from .type_annotations import Entity
+
+# Marks the end of the stream on a queue.
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    """Where one stage spent its time."""
+    name: str
+    items: int = 0
+    busy_seconds: float = 0.0
+    starved_seconds: float = 0.0
+    blocked_seconds: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f'{self.name}: {self.items} items, busy {self.busy_seconds:.2f}s, '
+            f'starved {self.starved_seconds:.2f}s, blocked {self.blocked_seconds:.2f}s'
+        )
+
+
+@dataclass
+class QueueStats:
+    """Queue depth sampled every time an item is taken off the queue."""
+    name: str
+    maxsize: int
+    samples: int = 0
+    depth_total: int = 0
+    peak: int = 0
+
+    def sample(self, depth: int) -> None:
+        self.samples += 1
+        self.depth_total += depth
+        self.peak = max(self.peak, depth)
+
+    @property
+    def occupancy(self) -> float:
+        """Mean depth as a fraction of capacity (0.0 - 1.0)."""
+        if not self.samples or not self.maxsize:
+            return 0.0
+        return self.depth_total / self.samples / self.maxsize
+
+    def summary(self) -> str:
+        return f'{self.name} queue: {self.occupancy:.0%} mean occupancy, peak {self.peak}/{self.maxsize}'
+
+
+@dataclass
+class PipelineStats:
+    fetch: StageStats = field(default_factory=lambda: StageStats('fetch'))
+    normalize: StageStats = field(default_factory=lambda: StageStats('normalize'))
+    store: StageStats = field(default_factory=lambda: StageStats('store'))
+    raw_queue: QueueStats = field(default_factory=lambda: QueueStats('raw', 0))
+    row_queue: QueueStats = field(default_factory=lambda: QueueStats('row', 0))
+    stream: StreamStats = field(default_factory=StreamStats)
+    skipped: int = 0
+
+    @property
+    def stored(self) -> int:
+        return self.store.items
+
+    def summary(self) -> str:
+        return '\n'.join([
+            self.fetch.summary(),
+            self.normalize.summary(),
+            self.store.summary(),
+            self.raw_queue.summary(),
+            self.row_queue.summary(),
+            f'{self.stored} stored, {self.skipped} skipped, '
+            f'{self.stream.pages} pages, {self.stream.flood_waits} flood waits',
+        ])
+
+
+async def run_pipeline(
+    client: TelegramClient,
+    entity: Entity,
+    store_func: Callable[[Any], Awaitable[None]] = print_store,
+    *,
+    resume_after_id: int | None = None,
+    limit: int | None = None,
+    state: StateStore | None = None,
+    fetch_queue_size: int = 1000,
+    store_queue_size: int = 1000,
+    sink_workers: int = 1,
+) -> PipelineStats:
+    """Collect `entity` through the staged pipeline and return its stats.
+
+    Arguments match `consume_messages`. Messages that fail normalization
+    are skipped and counted; errors raised by `store_func` abort the run.
+    A sink with `archive_raw` also gets the raw payload of every message
+    (`NormalizedMessage.raw`), serialized in the normalize stage.
+    With more than one sink worker, messages may reach `store_func`
+    slightly out of order.
+    """
+    if sink_workers < 1:
+        raise ValueError('sink_workers must be >= 1')
+    if state is not None and resume_after_id is None:
+        resume_after_id = await load_checkpoint(state, entity)
+
+    stats = PipelineStats()
+    stats.raw_queue.maxsize = fetch_queue_size
+    stats.row_queue.maxsize = store_queue_size
+    raw: asyncio.Queue = asyncio.Queue(maxsize=fetch_queue_size)
+    rows: asyncio.Queue = asyncio.Queue(maxsize=store_queue_size)
+    high_water = 0
+    archive_raw = getattr(store_func, 'archive_raw', False)
+
+    async def fetch() -> None:
+        st = stats.fetch
+        messages = stream_messages(client, entity, resume_after_id=resume_after_id, limit=limit, stats=stats.stream)
+        try:
+            t = time.monotonic()
+            async for m in messages:
+                now = time.monotonic()
+                st.busy_seconds += now - t
+                await raw.put(m)
+                t = time.monotonic()
+                st.blocked_seconds += t - now
+                st.items += 1
+            st.busy_seconds += time.monotonic() - t
+        finally:
+            await messages.aclose()
+        await raw.put(_DONE)
+
+    async def normalize() -> None:
+        st = stats.normalize
+        while True:
+            t = time.monotonic()
+            stats.raw_queue.sample(raw.qsize())
+            m: Message = await raw.get()
+            now = time.monotonic()
+            st.starved_seconds += now - t
+            if m is _DONE:
+                break
+            try:
+                item = normalize_message(m)
+                if archive_raw:
+                    item.raw = raw_payload(m)
+            except Exception as e:
+                print(f"Skipping message {getattr(m, 'id', None)!r}: normalization failed: {e}")
+                metrics.MESSAGES_SKIPPED.inc(entity=getattr(m, 'chat_id', None))
+                stats.skipped += 1
+                continue
+            finally:
+                t = time.monotonic()
+                st.busy_seconds += t - now
+            metrics.MESSAGES_NORMALIZED.inc(entity=item.entity_id)
+            await rows.put(item)
+            st.blocked_seconds += time.monotonic() - t
+            st.items += 1
+        for _ in range(sink_workers):
+            await rows.put(_DONE)
+
+    async def store() -> None:
+        nonlocal high_water
+        st = stats.store
+        while True:
+            t = time.monotonic()
+            stats.row_queue.sample(rows.qsize())
+            item = await rows.get()
+            now = time.monotonic()
+            st.starved_seconds += now - t
+            if item is _DONE:
+                break
+            await store_func(item)
+            st.busy_seconds += time.monotonic() - now
+            metrics.MESSAGES_STORED.inc(entity=item.entity_id)
+            metrics.observe_message_date(item.entity_id, item.date)
+            st.items += 1
+            high_water = max(high_water, item.id)
+
+    tasks = [asyncio.create_task(fetch()), asyncio.create_task(normalize())]
+    tasks += [asyncio.create_task(store()) for _ in range(sink_workers)]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for t in done:
+            if t.exception() is not None:
+                raise t.exception()
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if high_water and state is not None and not manages_state(store_func, state):
+        # Flush a buffering sink first so the checkpoint never gets ahead
+        # of the stored rows.
+        flush = getattr(store_func, 'flush', None)
+        if flush is not None:
+            await flush()
+        await state.advance({get_peer_id(entity): high_water})
+    return stats
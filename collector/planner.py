@@ -0,0 +1,121 @@
+"""Plan an incremental sync from one sweep over the account's dialogs.
+
+Every dialog carries the id of its newest message (`top_message`), and
+`iter_dialogs` returns them 100 per request. Comparing those ids with the
+stored checkpoints tells which targets have anything new without opening
+a history request per target: `plan_sync` skips targets whose newest
+message is already stored and orders the rest by how many message ids
+they are behind (the most behind first, so they start first).
+
+Targets the account has no dialog with (e.g. public channels it never
+joined) cannot be checked this way; they are always due and come last.
+Message ids of channels are per channel, so the lag is roughly the number
+of new messages; for users and basic groups ids are per account and the
+lag is only an upper bound.
+
+The sweep also fills the entity cache, so the due targets resolve
+without further requests.
+"""
+from __future__ import annotations
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+
+from telethon import TelegramClient
+from telethon.utils import get_peer_id
+
+from .entity_cache import EntityCache, target_key
+from .storage.state_store import StateStore
+
+
+@dataclass
+class PlannedTarget:
+    target: str
+    entity_id: int | None = None
+    # newest message id in the dialog list; None when not in the dialogs
+    top_id: int | None = None
+    high_water: int | None = None
+
+    @property
+    def lag(self) -> int | None:
+        """Message ids not collected yet; None when unknown."""
+        if self.top_id is None:
+            return None
+        return max(0, self.top_id - (self.high_water or 0))
+
+    @property
+    def due(self) -> bool:
+        return self.lag is None or self.lag > 0
+
+
+@dataclass
+class SyncPlan:
+    """Outcome of `plan_sync`: due targets, most behind first, and the
+    targets skipped because nothing was posted since the last run."""
+    due: list[PlannedTarget] = field(default_factory=list)
+    skipped: list[PlannedTarget] = field(default_factory=list)
+    dialogs: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def targets(self) -> list[str]:
+        return [p.target for p in self.due]
+
+    def summary(self) -> str:
+        unknown = sum(1 for p in self.due if p.lag is None)
+        behind = sum(p.lag or 0 for p in self.due)
+        return (
+            f'{len(self.due)} targets due ({unknown} not in dialogs), {len(self.skipped)} up to date; '
+            f'~{behind} new message ids; {self.dialogs} dialogs swept in {self.elapsed:.1f}s'
+        )
+
+
+async def plan_sync(
+    client: TelegramClient,
+    targets: Iterable[Any],
+    state: StateStore,
+    *,
+    entity_cache: EntityCache | None = None,
+    limit: int | None = None,
+) -> SyncPlan:
+    """Sweep the dialogs of `client` once and plan which of `targets` to
+    collect, comparing each dialog's newest message id with the
+    checkpoint in `state`. `limit` caps the dialogs swept (most recently
+    active first)."""
+    started = time.monotonic()
+    plan = SyncPlan()
+    tops: dict[str, tuple[int, int]] = {}
+    async for d in client.iter_dialogs(limit=limit):
+        plan.dialogs += 1
+        entity = d.entity
+        if entity_cache is not None:
+            entity_cache.add(entity)
+        entity_id = get_peer_id(entity)
+        top = getattr(d.dialog, 'top_message', None) or (d.message.id if d.message is not None else 0)
+        # the marked id only: bare user, chat and channel ids overlap
+        keys = {str(entity_id)}
+        username = getattr(entity, 'username', None)
+        if username:
+            keys.add(target_key(username))
+        for k in keys:
+            tops[k] = (entity_id, top)
+
+    planned = []
+    seen: set[int] = set()
+    for t in dict.fromkeys(str(t) for t in targets):
+        found = tops.get(target_key(t))
+        if found is None:
+            planned.append(PlannedTarget(t))
+        elif found[0] not in seen:
+            # one entry per chat, however many spellings of it config.json has
+            seen.add(found[0])
+            planned.append(PlannedTarget(t, *found))
+    marks = await state.get_many(seen)
+    for p in planned:
+        if p.entity_id is not None:
+            p.high_water = marks.get(p.entity_id)
+        (plan.due if p.due else plan.skipped).append(p)
+    # most behind first; targets with unknown lag keep their order at the end
+    plan.due.sort(key=lambda p: (p.lag is None, -(p.lag or 0)))
+    plan.elapsed = time.monotonic() - started
+    return plan
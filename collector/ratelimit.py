@@ -0,0 +1,35 @@
+"""Token-bucket rate limiter shared by concurrent tasks."""
+from __future__ import annotations
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Allow on average `rate` units per second, with bursts up to `burst`.
+
+    `acquire(n)` waits until `n` units are available. Units can be
+    requests (a global request budget) or bytes (a bandwidth cap); one
+    limiter can be shared by any number of tasks.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None) -> None:
+        if rate <= 0:
+            raise ValueError('rate must be > 0')
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        # Requests larger than the bucket are allowed; they just wait longer.
+        async with self._lock:
+            self._refill()
+            self._tokens -= amount
+            if self._tokens < 0:
+                await asyncio.sleep(-self._tokens / self.rate)
@@ -0,0 +1,139 @@
+"""Reconcile recent history with the server to catch edits and deletions.
+
+Collection sees a message once; later edits and deletions never reach the
+archive unless the channel is scanned again. `reconcile` re-fetches only a
+window of recent messages of one entity — the newest `last` messages, or
+those of the last `days` days — and compares it with the stored window:
+
+- a fetched message whose content hash differs from the stored one is an
+  edit, and one that is not stored yet is new; only those rows are handed
+  to the sink (unchanged messages are not written at all);
+- a stored message the window did not return is a deletion candidate.
+  Candidates are confirmed with `get_messages(ids=...)` (one request per
+  100 ids), which returns nothing for deleted messages, so a message
+  posted while the window was being read is not mistaken for a deleted
+  one. Confirmed deletions get `deleted_at` (`storage.reconcile_store`).
+
+Requests and reads are proportional to the window, not to the history.
+Messages older than the window are not checked.
+"""
+from __future__ import annotations
+import datetime
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from telethon import TelegramClient
+from telethon.utils import get_peer_id
+
+from . import metrics
+from .consumer import raw_payloads
+from .normalize import content_hash, normalize_batch
+from .storage.reconcile_store import mark_deleted, stored_window
+from .stream import MAX_PAGE_SIZE, StreamStats, stream_messages
+from .type_annotations import Entity
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+    from .ratelimit import RateLimiter
+    from .storage.batch_sink import BatchSink
+
+
+@dataclass
+class ReconcileResult:
+    """Outcome of one `reconcile` run."""
+    entity_id: int
+    # messages re-fetched, and live stored messages in the same window
+    fetched: int = 0
+    stored: int = 0
+    edited: int = 0
+    new: int = 0
+    # stored messages missing from the window, and those confirmed deleted
+    candidates: int = 0
+    deleted: int = 0
+    elapsed: float = 0.0
+    stream: StreamStats = field(default_factory=StreamStats)
+
+    def summary(self) -> str:
+        return (
+            f'{self.entity_id}: {self.fetched} fetched / {self.stored} stored in window, '
+            f'{self.edited} edited, {self.new} new, {self.deleted} deleted '
+            f'({self.candidates} missing checked), {self.stream.pages} pages, {self.elapsed:.1f}s'
+        )
+
+
+async def reconcile(
+    client: TelegramClient,
+    entity: Entity,
+    sink: 'BatchSink',
+    *,
+    last: int | None = None,
+    days: float | None = None,
+    pool: 'AsyncpgPool | None' = None,
+    rate_limiter: 'RateLimiter | None' = None,
+    max_flood_wait: float | None = None,
+) -> ReconcileResult:
+    """Re-fetch the newest `last` messages, or the last `days` days, of
+    `entity`, store edited and new ones through `sink` and mark stored
+    messages deleted on the server. Exactly one of `last` and `days` must
+    be given. The sink is not flushed; close it (or call `flush()`) to
+    write the changed rows."""
+    if (last is None) == (days is None):
+        raise ValueError('reconcile: pass exactly one of last= and days=')
+    started = time.monotonic()
+    entity_id = get_peer_id(entity)
+    result = ReconcileResult(entity_id)
+
+    since = None
+    if days is not None:
+        since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    messages = []
+    async for m in stream_messages(
+        client, entity, limit=last, stats=result.stream,
+        rate_limiter=rate_limiter, max_flood_wait=max_flood_wait,
+    ):
+        if since is not None and m.date is not None and m.date < since:
+            break
+        messages.append(m)
+    result.fetched = len(messages)
+
+    # With `last` the window starts at the oldest message returned; a
+    # shorter page means the whole history was returned.
+    min_id = None
+    if last is not None and messages and len(messages) >= last:
+        min_id = min(m.id for m in messages)
+    stored = await stored_window(entity_id, min_id=min_id, since=since, pool=pool)
+    result.stored = len(stored)
+
+    changed = []
+    for r in normalize_batch(messages):
+        known = stored.get(r[1])
+        if known is None:
+            result.new += 1
+        elif known[1] != content_hash(r[3], r[4], r[5], r[6] and r[6].file_unique_id):
+            result.edited += 1
+        else:
+            continue
+        changed.append(r)
+    if changed:
+        if sink.archive_raw:
+            await sink.add_rows(changed, raw=raw_payloads(messages))
+        else:
+            await sink.add_rows(changed)
+
+    seen = {m.id for m in messages}
+    missing = sorted(mid for mid in stored if mid not in seen)
+    result.candidates = len(missing)
+    gone = []
+    for i in range(0, len(missing), MAX_PAGE_SIZE):
+        chunk = missing[i:i + MAX_PAGE_SIZE]
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        found = await client.get_messages(entity, ids=chunk)
+        gone.extend((mid, stored[mid][0]) for mid, m in zip(chunk, found) if m is None)
+    result.deleted = await mark_deleted(entity_id, gone, pool=pool)
+
+    metrics.MESSAGES_EDITED.inc(result.edited, entity=entity_id)
+    metrics.MESSAGES_DELETED.inc(result.deleted, entity=entity_id)
+    result.elapsed = time.monotonic() - started
+    return result
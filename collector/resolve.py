@@ -1,15 +1,28 @@
 from __future__ import annotations
+from .entity_cache import EntityCache
 from .type_annotations import Entity
 
 
-async def resolve(client, target: str) -> Entity | None:
+async def resolve(client, target: str, cache: EntityCache | None = None) -> Entity | None:
     """Resolve a target (id or username) to an entity.
 
     Minimal, backward-compatible behavior: try numeric id first, then `get_entity`.
+    With a `cache`, a fresh cached input peer is returned without any
+    request; stale entries are revalidated and used as a fallback if the
+    lookup fails.
     """
     if target is None:
         return None
 
+    stale = None
+    if cache is not None:
+        peer, fresh = cache.lookup(target)
+        if fresh:
+            cache.hits += 1
+            return peer
+        cache.misses += 1
+        stale = peer
+
     entity: Entity | None = None
     # try numeric id
     target_id: int | None = None
@@ -18,14 +31,21 @@ async def resolve(client, target: str) -> Entity | None:
     except Exception:
         target_id = None
 
-    if target_id is not None:
-        entity = await client.get_entity(target_id)
+    try:
+        if target_id is not None:
+            entity = await client.get_entity(target_id)
 
-    if entity is None:
-        try:
+        if entity is None:
             entity = await client.get_entity(target)
-        except Exception as e:
-            print('Failed to get entity for target:', target, 'Error:', e)
-            return None
+    except Exception as e:
+        if stale is not None:
+            print('Failed to revalidate cached target:', target, 'Error:', e, '(using cached entry)')
+            return stale
+        if target_id is not None:
+            raise
+        print('Failed to get entity for target:', target, 'Error:', e)
+        return None
 
+    if cache is not None:
+        cache.add(entity, target)
     return entity
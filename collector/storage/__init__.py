@@ -1,11 +1,24 @@
 """Storage package aggregator.
 
 Expose the lightweight `print_store` and the Postgres-backed
-`init_pg_pool`, `postgres_store`, and `close_pg_pool` from a
-single import location (`storage`).
+`init_pg_pool`, `postgres_store`, and `close_pg_pool`, plus the batching
+`BatchSink`, the checkpoint stores, the backfill progress stores, the
+local spool, message search, channel activity aggregates, the streaming
+exporter, the collection job queue, the reconciliation queries and the raw
+message archive, from a single import location (`storage`).
 """
 from .print_store import print_store
 from .postgres_store import init_pg_pool, postgres_store, close_pg_pool, pg_pool_context
+from .batch_sink import BatchSink, SinkStats
+from .state_store import PostgresStateStore, FileStateStore, open_state_store
+from .backfill_store import PostgresBackfillStore, FileBackfillStore, open_backfill_store
+from .spool import Spool, SpoolSink, replay_spool
+from .search import SearchCursor, SearchPage, search_messages
+from .export import ExportFilter, ExportResult, ExportWatermarks, export_messages
+from .job_store import Job, JobQueue
+from .channel_stats import ChannelActivity, channel_activity, posting_heatmap, rebuild_channel_stats
+from .reconcile_store import mark_deleted, stored_window
+from .raw_archive import RawArchive, RawMessage
 
 __all__ = [
     'print_store',
@@ -13,4 +26,32 @@ __all__ = [
     'postgres_store',
     'close_pg_pool',
     'pg_pool_context',
+    'BatchSink',
+    'SinkStats',
+    'PostgresStateStore',
+    'FileStateStore',
+    'open_state_store',
+    'PostgresBackfillStore',
+    'FileBackfillStore',
+    'open_backfill_store',
+    'Spool',
+    'SpoolSink',
+    'replay_spool',
+    'SearchCursor',
+    'SearchPage',
+    'search_messages',
+    'ExportFilter',
+    'ExportResult',
+    'ExportWatermarks',
+    'export_messages',
+    'Job',
+    'JobQueue',
+    'ChannelActivity',
+    'channel_activity',
+    'posting_heatmap',
+    'rebuild_channel_stats',
+    'mark_deleted',
+    'stored_window',
+    'RawArchive',
+    'RawMessage',
 ]
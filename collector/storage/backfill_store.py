@@ -0,0 +1,145 @@
+"""Durable progress of range-split backfills (see `collector.backfill`).
+
+A backfill plan is a list of `Segment`s per entity. Each segment covers
+the message ids `low_id < id <= high_id` and is walked newest->oldest;
+`cursor_id` is the lowest id already stored, so an interrupted segment
+resumes just below it.
+
+As with checkpoints, `PostgresBackfillStore` keeps the plan in the
+`backfill_segments` table and `FileBackfillStore` in a JSON file when no
+database is available.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+from .postgres_store import get_pg_pool
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+DEFAULT_BACKFILL_PATH = Path('.state') / 'backfill_segments.json'
+
+
+@dataclass
+class Segment:
+    low_id: int
+    high_id: int
+    cursor_id: int | None = None
+    done: bool = False
+
+    @property
+    def remaining(self) -> int:
+        """Upper bound on the number of ids left to fetch."""
+        if self.done:
+            return 0
+        top = self.high_id if self.cursor_id is None else self.cursor_id - 1
+        return max(0, top - self.low_id)
+
+
+class PostgresBackfillStore:
+    """Backfill plans stored in the `backfill_segments` table."""
+
+    def __init__(self, pool: AsyncpgPool | None = None) -> None:
+        self.pool = pool
+
+    def _pool(self) -> AsyncpgPool:
+        p = self.pool or get_pg_pool()
+        if p is None:
+            raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+        return p
+
+    async def load(self, entity_id: int) -> list[Segment]:
+        rows = await self._pool().fetch(
+            'SELECT low_id, high_id, cursor_id, done FROM backfill_segments '
+            'WHERE entity_id = $1 ORDER BY low_id DESC',
+            entity_id,
+        )
+        return [Segment(r['low_id'], r['high_id'], r['cursor_id'], r['done']) for r in rows]
+
+    async def save_plan(self, entity_id: int, segments: Iterable[Segment]) -> None:
+        """Replace the plan of `entity_id` with `segments`."""
+        segments = list(segments)
+        async with self._pool().acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('DELETE FROM backfill_segments WHERE entity_id = $1', entity_id)
+                await conn.executemany(
+                    'INSERT INTO backfill_segments (entity_id, low_id, high_id, cursor_id, done) '
+                    'VALUES ($1, $2, $3, $4, $5)',
+                    [(entity_id, s.low_id, s.high_id, s.cursor_id, s.done) for s in segments],
+                )
+
+    async def update(self, entity_id: int, segment: Segment) -> None:
+        await self._pool().execute(
+            'UPDATE backfill_segments SET cursor_id = $3, done = $4, updated_at = now() '
+            'WHERE entity_id = $1 AND low_id = $2',
+            entity_id,
+            segment.low_id,
+            segment.cursor_id,
+            segment.done,
+        )
+
+
+class FileBackfillStore:
+    """Backfill plans stored in a local JSON file (written atomically)."""
+
+    def __init__(self, path: str | os.PathLike = DEFAULT_BACKFILL_PATH) -> None:
+        self.path = Path(path)
+        self._lock = asyncio.Lock()
+        self._plans: dict[int, list[Segment]] | None = None
+
+    def _load(self) -> dict[int, list[Segment]]:
+        if self._plans is None:
+            self._plans = {}
+            if self.path.exists():
+                try:
+                    raw = json.loads(self.path.read_text())
+                    self._plans = {int(k): [Segment(**s) for s in v] for k, v in raw.items()}
+                except Exception as e:
+                    print(f'Warning: failed to read {self.path}:', e)
+        return self._plans
+
+    async def _save(self) -> None:
+        plans = self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp.write_text(json.dumps(
+            {str(k): [asdict(s) for s in v] for k, v in sorted(plans.items())}, indent=2
+        ))
+        os.replace(tmp, self.path)
+
+    async def load(self, entity_id: int) -> list[Segment]:
+        return [Segment(**asdict(s)) for s in self._load().get(entity_id, [])]
+
+    async def save_plan(self, entity_id: int, segments: Iterable[Segment]) -> None:
+        async with self._lock:
+            self._load()[entity_id] = [Segment(**asdict(s)) for s in segments]
+            await self._save()
+
+    async def update(self, entity_id: int, segment: Segment) -> None:
+        async with self._lock:
+            for s in self._load().get(entity_id, []):
+                if s.low_id == segment.low_id:
+                    s.cursor_id = segment.cursor_id
+                    s.done = segment.done
+            await self._save()
+
+
+BackfillStore = PostgresBackfillStore | FileBackfillStore
+
+
+def open_backfill_store(
+    pool: AsyncpgPool | None = None, path: str | os.PathLike = DEFAULT_BACKFILL_PATH
+) -> BackfillStore:
+    """Return a Postgres-backed store when a pool is available, else a file store."""
+    if pool is not None or get_pg_pool() is not None:
+        return PostgresBackfillStore(pool)
+    return FileBackfillStore(path)
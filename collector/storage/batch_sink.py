@@ -0,0 +1,492 @@
+"""Batched Postgres sink built on `COPY`.
+
+`BatchSink` is a drop-in `store_func` for `consume_messages`: it buffers
+`NormalizedMessage` rows in memory and writes them in one transaction per
+batch (COPY into a temporary staging table, then a single set-based
+`INSERT ... SELECT ... ON CONFLICT`). A batch is flushed when it reaches
+`batch_size` rows, when `flush_interval` seconds pass, and on close.
+`add_rows` accepts whole pages of row tuples from `normalize_batch`.
+
+With a `state` store the per-entity high-water marks are advanced together
+with each batch (in the same transaction for `PostgresStateStore`).
+
+With a `spool` a batch that cannot be written (the database is down, or the
+write takes longer than `write_timeout`) goes to the local spool instead
+and later batches skip the database for `retry_after` seconds; see
+`storage.spool`. Without one the rows stay buffered and the error is raised.
+
+Re-scans mostly see messages that are already stored unchanged. Every row
+carries a `content_hash` (see `normalize.content_hash`); the sink keeps the
+hashes of recently written keys in a bounded LRU and drops a message whose
+hash matches before it is buffered. Rows that do reach Postgres only
+update an existing row when its hash differs, so unchanged rows cost no
+tuple rewrite (and no WAL). `warm_cache()` preloads the LRU from the table.
+
+Media metadata travels with its message: a buffered row is the
+`MESSAGE_COLUMNS` tuple followed by the message's `MEDIA_COLUMNS` row (or
+None), and both are merged in the same transaction.
+
+With `archive_raw` the sink also keeps the raw TL payload of every message
+it buffers (`NormalizedMessage.raw`, or the `raw` mapping of `add_rows`)
+and archives those of the messages the merge inserted or changed, or that
+have no archived payload yet (messages stored before archiving was turned
+on), as compressed blocks in the same transaction; see
+`storage.raw_archive`. The hash LRU then only holds archived messages, so
+it never drops a message whose payload is still missing.
+"""
+from __future__ import annotations
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Iterable, Mapping
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .. import metrics
+from ..normalize import content_hash
+from .media_store import clear_media, merge_media
+from .postgres_store import get_pg_pool
+from .raw_archive import archived_keys, write_raw
+from .schema import STATS_DELTA, UNKNOWN_DATE, create_staging, ensure_partitions
+from .state_store import StateStore, high_water_marks
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+    from ..normalize import MessageRow, NormalizedMessage
+    from .spool import Spool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+# Column order shared by the buffered row tuples (which end with the media
+# row), COPY and the merge.
+MESSAGE_COLUMNS = ('entity_id', 'id', 'date', 'sender_id', 'text', 'has_media', 'content_hash')
+
+# The merge also folds the rows it changes into `channel_stats_hourly`
+# (see `schema.STATS_DELTA`).
+_MERGE = f"""
+WITH old AS (
+    SELECT m.entity_id, m.date, m.has_media, COALESCE(char_length(m.text), 0) AS text_chars
+    FROM messages_staging s
+    CROSS JOIN LATERAL (
+        SELECT * FROM messages m
+        WHERE m.entity_id = s.entity_id AND m.id = s.id AND m.date = s.date
+        OFFSET 0  -- keep the per-row primary-key lookup
+    ) m
+    WHERE m.content_hash IS DISTINCT FROM s.content_hash AND m.deleted_at IS NULL
+),
+new AS (
+    INSERT INTO messages (entity_id, id, date, sender_id, text, has_media, content_hash)
+    SELECT s.entity_id, s.id, s.date, s.sender_id, s.text, s.has_media, s.content_hash
+    FROM messages_staging s
+    -- Skip unchanged rows up front: even a no-op DO UPDATE locks (and logs)
+    -- the row. A per-row primary-key lookup; missing rows, and rows marked
+    -- deleted (the message was seen again, so it is restored), compare as NULL.
+    WHERE (
+        SELECT m.content_hash FROM messages m
+        WHERE m.entity_id = s.entity_id AND m.id = s.id AND m.date = s.date AND m.deleted_at IS NULL
+    ) IS DISTINCT FROM s.content_hash
+    ON CONFLICT (entity_id, id, date) DO UPDATE
+    SET sender_id = EXCLUDED.sender_id,
+        text = EXCLUDED.text,
+        has_media = EXCLUDED.has_media,
+        content_hash = EXCLUDED.content_hash,
+        deleted_at = NULL,
+        updated_at = now()
+    WHERE messages.content_hash IS DISTINCT FROM EXCLUDED.content_hash OR messages.deleted_at IS NOT NULL
+    RETURNING entity_id, id, date, has_media, COALESCE(char_length(text), 0) AS text_chars
+),
+{STATS_DELTA}
+SELECT entity_id, id FROM new
+"""
+
+# Newest stored hashes, overall or per entity (for `warm_cache`);
+# `{archived}` restricts them to messages with an archived raw payload.
+_WARM_ALL = """
+SELECT entity_id, id, content_hash FROM messages
+WHERE content_hash IS NOT NULL AND deleted_at IS NULL{archived}
+ORDER BY date DESC LIMIT $1
+"""
+_WARM_ENTITIES = """
+SELECT m.entity_id, m.id, m.content_hash
+FROM unnest($1::bigint[]) AS e(entity_id)
+CROSS JOIN LATERAL (
+    SELECT entity_id, id, content_hash, date FROM messages
+    WHERE entity_id = e.entity_id AND content_hash IS NOT NULL AND deleted_at IS NULL{archived}
+    ORDER BY date DESC LIMIT $2
+) m
+ORDER BY m.date DESC
+"""
+_WARM_ARCHIVED = (
+    ' AND EXISTS (SELECT 1 FROM message_raw r WHERE r.entity_id = messages.entity_id AND r.id = messages.id)'
+)
+
+
+async def merge_rows(conn, rows: list[tuple], written_keys: set[tuple[int, int]] | None = None) -> int:
+    """Merge stored rows (`MESSAGE_COLUMNS` tuples, optionally followed by
+    the message's media row) into `messages` and `message_media` through
+    the staging tables, updating `channel_stats_hourly`; returns how many
+    messages were inserted or changed, and adds their keys to
+    `written_keys` when given. Changed messages whose media row is None
+    lose their `message_media` row (the hash covers `has_media`, so
+    removing the media always counts as a change).
+
+    Must run inside a transaction on `conn`, with the partitions in place.
+    """
+    media = []
+    bare: set[tuple[int, int]] = set()
+    if rows and len(rows[0]) > len(MESSAGE_COLUMNS):
+        media = [r[7] for r in rows if r[7] is not None]
+        bare = {(r[0], r[1]) for r in rows if r[7] is None}
+        rows = [r[:7] for r in rows]
+    await create_staging(conn)
+    await conn.copy_records_to_table('messages_staging', records=rows, columns=MESSAGE_COLUMNS)
+    written = await conn.fetch(_MERGE)
+    await merge_media(conn, media)
+    if bare:
+        await clear_media(conn, [k for k in ((r['entity_id'], r['id']) for r in written) if k in bare])
+    if written_keys is not None:
+        written_keys.update((r['entity_id'], r['id']) for r in written)
+    return len(written)
+
+
+@dataclass
+class SinkStats:
+    """Running counters for a `BatchSink`."""
+    rows: int = 0
+    # rows the merge actually inserted or changed
+    written: int = 0
+    # messages dropped because the LRU had the same hash
+    unchanged: int = 0
+    # rows sent to the spool because the database was unavailable
+    spooled: int = 0
+    # raw payloads archived, and their size before / after compression
+    raw_messages: int = 0
+    raw_bytes: int = 0
+    raw_stored_bytes: int = 0
+    flushes: int = 0
+    flush_seconds: float = 0.0
+    max_flush_seconds: float = 0.0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def rows_per_sec(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def avg_flush_ms(self) -> float:
+        return (self.flush_seconds / self.flushes * 1000.0) if self.flushes else 0.0
+
+    def summary(self) -> str:
+        spooled = f', {self.spooled} spooled' if self.spooled else ''
+        raw = ''
+        if self.raw_messages:
+            raw = (f', {self.raw_messages} raw archived '
+                   f'({self.raw_bytes / 1024:.0f} -> {self.raw_stored_bytes / 1024:.0f} KiB)')
+        return (
+            f'{self.rows} rows in {self.flushes} flushes '
+            f'({self.written} written, {self.unchanged} unchanged skipped{spooled}{raw}), '
+            f'{self.rows_per_sec:.1f} rows/s, '
+            f'flush avg {self.avg_flush_ms:.1f}ms / max {self.max_flush_seconds * 1000.0:.1f}ms'
+        )
+
+
+class BatchSink:
+    """Buffering Postgres `store_func` for `consume_messages`.
+
+    Use as an async context manager (or call `close()`) so the final
+    partial batch is flushed. Messages with the same key are collapsed
+    inside a batch, the last one wins. The schema is expected to exist
+    already (`init_pg_pool` bootstraps it). `cache_size` bounds the hash
+    LRU; 0 disables it. `spool`, `write_timeout` and `retry_after`
+    configure the fallback described in the module docstring;
+    `archive_raw` enables the raw payload archive.
+    """
+
+    def __init__(
+        self,
+        pool: AsyncpgPool | None = None,
+        *,
+        batch_size: int = 500,
+        flush_interval: float = 2.0,
+        state: StateStore | None = None,
+        cache_size: int = 100_000,
+        spool: 'Spool | None' = None,
+        write_timeout: float | None = None,
+        retry_after: float = 30.0,
+        archive_raw: bool = False,
+    ) -> None:
+        if asyncpg is None:
+            raise RuntimeError('asyncpg is not installed; cannot use BatchSink')
+        if batch_size < 1:
+            raise ValueError('batch_size must be >= 1')
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.state = state
+        self.stats = SinkStats()
+        self.cache_size = max(0, cache_size)
+        self.spool = spool
+        self.write_timeout = write_timeout
+        self.retry_after = retry_after
+        self.archive_raw = archive_raw
+        # monotonic time before which flushes go straight to the spool
+        self._db_down_until = 0.0
+        self._buffer: dict[tuple[int, int], tuple] = {}
+        # raw payloads of buffered keys (with `archive_raw`)
+        self._raw: dict[tuple[int, int], bytes] = {}
+        # (entity_id, id) -> content hash of the row known to be stored
+        self._hashes: OrderedDict[tuple[int, int], int] = OrderedDict()
+        # high-water marks of messages skipped as unchanged, for the next flush
+        self._skipped_marks: dict[int, int] = {}
+        self._flush_lock = asyncio.Lock()
+        self._timer: asyncio.Task | None = None
+        self._closed = False
+
+    async def __aenter__(self) -> 'BatchSink':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def __call__(self, m: 'NormalizedMessage') -> None:
+        if self._closed:
+            raise RuntimeError('BatchSink is closed')
+        if m.entity_id is None:
+            raise ValueError(f'BatchSink: message {m.id!r} has no entity_id')
+        self._add(
+            (m.entity_id, m.id),
+            (m.entity_id, m.id, m.date or UNKNOWN_DATE, m.sender, m.text, m.has_media,
+             m.content_hash(), m.media and m.media.row(m.entity_id, m.id)),
+            m.raw,
+        )
+        await self._added()
+
+    async def add_rows(
+        self, rows: Iterable['MessageRow'], raw: Mapping[tuple[int, int], bytes] | None = None
+    ) -> None:
+        """Buffer rows from `normalize_batch` (the fast path for whole pages).
+        `raw` maps `(entity_id, id)` to the messages' raw payloads."""
+        if self._closed:
+            raise RuntimeError('BatchSink is closed')
+        for r in rows:
+            if r[0] is None:
+                raise ValueError(f'BatchSink: message {r[1]!r} has no entity_id')
+            self._add(
+                (r[0], r[1]),
+                (r[0], r[1], r[2] or UNKNOWN_DATE, r[3], r[4], r[5], content_hash(r[3], r[4], r[5], r[6] and r[6].file_unique_id),
+                 r[6] and r[6].row(r[0], r[1])),
+                raw and raw.get((r[0], r[1])),
+            )
+        await self._added()
+
+    def _add(self, key: tuple[int, int], row: tuple, raw: bytes | None = None) -> None:
+        # A buffered row for the key must still be replaced, even when the
+        # new content matches what is stored (an edit that was reverted).
+        if key not in self._buffer and self._hashes.get(key) == row[6]:
+            self._hashes.move_to_end(key)
+            self.stats.unchanged += 1
+            metrics.SINK_ROWS_UNCHANGED.inc(sink='batch')
+            if self.state is not None and key[1] > self._skipped_marks.get(key[0], 0):
+                self._skipped_marks[key[0]] = key[1]
+            return
+        self._buffer[key] = row
+        if raw is not None and self.archive_raw:
+            self._raw[key] = raw
+
+    def _remember(self, rows: Iterable[tuple], only: set[tuple[int, int]] | None = None) -> None:
+        # With `only`, keys outside it are not remembered.
+        if not self.cache_size:
+            return
+        hashes = self._hashes
+        for r in rows:
+            key = (r[0], r[1])
+            if only is not None and key not in only:
+                continue
+            hashes[key] = r[6]
+            hashes.move_to_end(key)
+        while len(hashes) > self.cache_size:
+            hashes.popitem(last=False)
+
+    async def warm_cache(self, entity_ids: Iterable[int] | None = None) -> int:
+        """Load the hashes of the newest stored messages into the LRU.
+
+        With `entity_ids` the cache is split evenly between them, otherwise
+        it is filled with the newest messages overall. Returns the number
+        of hashes loaded.
+        """
+        if not self.cache_size:
+            return 0
+        p = self.pool or get_pg_pool()
+        if p is None:
+            raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+        archived = _WARM_ARCHIVED if self.archive_raw else ''
+        if entity_ids is None:
+            rows = await p.fetch(_WARM_ALL.format(archived=archived), self.cache_size)
+        else:
+            ids = list(entity_ids)
+            if not ids:
+                return 0
+            rows = await p.fetch(
+                _WARM_ENTITIES.format(archived=archived), ids, max(1, self.cache_size // len(ids))
+            )
+        # oldest first, so the newest end up most recently used
+        self._remember((r['entity_id'], r['id'], None, None, None, None, r['content_hash']) for r in reversed(rows))
+        return len(rows)
+
+    async def _added(self) -> None:
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None and self.flush_interval > 0:
+            self._timer = asyncio.create_task(self._flush_periodically())
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    async def flush(self) -> int:
+        """Write all buffered rows. Returns the number of rows written.
+
+        On failure the rows are put back into the buffer (newer rows for
+        the same key win) and the exception is re-raised.
+        """
+        async with self._flush_lock:
+            if not self._buffer:
+                if self._skipped_marks and not self._db_down():
+                    marks, self._skipped_marks = self._skipped_marks, {}
+                    try:
+                        await self.state.advance(marks)
+                    except Exception:
+                        self._keep_marks(marks)
+                        if self.spool is None:
+                            raise
+                        self._db_down_until = time.monotonic() + self.retry_after
+                return 0
+            batch, self._buffer = self._buffer, {}
+            raw, self._raw = self._raw, {}
+            skipped_marks, self._skipped_marks = self._skipped_marks, {}
+            if self._db_down():
+                return self._to_spool(batch, skipped_marks)
+            started = time.monotonic()
+            # with `archive_raw`, the keys known to have an archived payload
+            archived = set() if self.archive_raw else None
+            try:
+                write = self._write(list(batch.values()), skipped_marks, raw, archived)
+                if self.write_timeout is not None:
+                    write = asyncio.wait_for(write, self.write_timeout)
+                written = await write
+            except Exception as e:
+                if self.spool is None:
+                    self._restore(batch, raw, skipped_marks)
+                    raise
+                print(f'Warning: Postgres write failed ({e!r}); spooling to {self.spool.directory} '
+                      f'for the next {self.retry_after:.0f}s')
+                self._db_down_until = time.monotonic() + self.retry_after
+                return self._to_spool(batch, skipped_marks)
+            except BaseException:
+                self._restore(batch, raw, skipped_marks)
+                raise
+            elapsed = time.monotonic() - started
+            self._remember(batch.values(), archived)
+            metrics.SINK_WRITE_SECONDS.observe(elapsed, sink='batch')
+            metrics.SINK_ROWS_WRITTEN.inc(written, sink='batch')
+            metrics.SINK_ROWS_UNCHANGED.inc(len(batch) - written, sink='batch')
+            self.stats.rows += len(batch)
+            self.stats.written += written
+            self.stats.flushes += 1
+            self.stats.flush_seconds += elapsed
+            self.stats.max_flush_seconds = max(self.stats.max_flush_seconds, elapsed)
+            return len(batch)
+
+    def _restore(self, batch: dict, raw: dict, skipped_marks: dict[int, int]) -> None:
+        # newer rows (and payloads) for the same key win
+        batch.update(self._buffer)
+        self._buffer = batch
+        raw.update(self._raw)
+        self._raw = raw
+        self._keep_marks(skipped_marks)
+
+    def _db_down(self) -> bool:
+        return self.spool is not None and time.monotonic() < self._db_down_until
+
+    def _keep_marks(self, marks: dict[int, int]) -> None:
+        for entity_id, mid in marks.items():
+            self._skipped_marks[entity_id] = max(mid, self._skipped_marks.get(entity_id, 0))
+
+    def _to_spool(self, batch: dict[tuple[int, int], tuple], skipped_marks: dict[int, int]) -> int:
+        # The replay advances the checkpoints of spooled rows, if this sink
+        # advances them at all (it has `state`); marks of skipped rows wait
+        # for the database to come back. Raw payloads are not spooled.
+        n = self.spool.append(batch.values(), checkpoint=self.state is not None)
+        self._keep_marks(skipped_marks)
+        self._remember(batch.values(), set() if self.archive_raw else None)
+        metrics.SINK_ROWS_SPOOLED.inc(n, sink='batch')
+        self.stats.rows += n
+        self.stats.spooled += n
+        return n
+
+    async def close(self) -> None:
+        """Stop the interval flusher and flush what is left."""
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            try:
+                await self._timer
+            except asyncio.CancelledError:
+                pass
+            self._timer = None
+        await self.flush()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print('Warning: periodic flush failed:', e)
+
+    async def _write(
+        self,
+        rows: list[tuple],
+        skipped_marks: dict[int, int],
+        raw: dict[tuple[int, int], bytes],
+        archived: set[tuple[int, int]] | None = None,
+    ) -> int:
+        """Merge `rows` and archive `raw`; returns how many rows were
+        inserted or changed. Adds the keys of `rows` that have an archived
+        payload afterwards to `archived`."""
+        p = self.pool or get_pg_pool()
+        if p is None:
+            raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+        marks = {}
+        if self.state is not None:
+            marks = high_water_marks([(r[0], r[1]) for r in rows] + list(skipped_marks.items()))
+        async with p.acquire() as conn:
+            await ensure_partitions(conn, (r[2] for r in rows))
+            async with conn.transaction():
+                # Messages the merge changed, and unchanged ones that have no
+                # payload yet (stored before archiving was turned on).
+                changed: set[tuple[int, int]] = set()
+                written = await merge_rows(conn, rows, changed if archived is not None else None)
+                present: set[tuple[int, int]] = set()
+                if archived is not None:
+                    present = await archived_keys(conn, ((r[0], r[1]) for r in rows if (r[0], r[1]) not in changed))
+                raw = {k: v for k, v in raw.items() if k in changed or k not in present}
+                done = await write_raw(conn, raw) if raw else None
+                if marks and self.state.transactional:
+                    await self.state.advance(marks, conn=conn)
+        if marks and not self.state.transactional:
+            await self.state.advance(marks)
+        if archived is not None:
+            archived.update(present)
+            archived.update(raw)
+        if done is not None:
+            self.stats.raw_messages += done.messages
+            self.stats.raw_bytes += done.raw_bytes
+            self.stats.raw_stored_bytes += done.stored_bytes
+        return written
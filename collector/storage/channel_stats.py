@@ -0,0 +1,170 @@
+"""Per-channel activity aggregates (`channel_stats_hourly`).
+
+One row per entity and UTC hour holds the number of messages, of messages
+with media and the total text length (characters) posted in that hour;
+messages marked deleted are not counted.
+The writers keep it current in the same statement that merges messages:
+`schema.STATS_DELTA` subtracts the old version of every row that changed
+and adds the new one, so edits move text length and media counts and
+re-scans of unchanged messages cost nothing. Reads (`channel_activity`,
+`posting_heatmap`) then cost O(hours) instead of a scan over messages.
+
+`rebuild_channel_stats` recomputes a range from `messages`, e.g. after
+rows were changed by hand, or to correct drift from two writers storing
+the same new message at the same moment.
+"""
+from __future__ import annotations
+import datetime
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterable
+
+from .postgres_store import get_pg_pool
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+_REBUILD = """
+INSERT INTO channel_stats_hourly (entity_id, hour, messages, media, text_chars)
+SELECT entity_id, date_trunc('hour', date AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+       count(*), count(*) FILTER (WHERE has_media), COALESCE(sum(char_length(text)), 0)
+FROM messages
+WHERE deleted_at IS NULL AND {where}
+GROUP BY 1, 2
+"""
+
+
+def _range(entity_ids: Iterable[int] | None, since, until, column: str) -> tuple[str, list]:
+    where, args = ['true'], []
+    if entity_ids is not None:
+        args.append(list(entity_ids))
+        where.append(f'entity_id = ANY(${len(args)}::bigint[])')
+    if since is not None:
+        args.append(since)
+        where.append(f'{column} >= ${len(args)}')
+    if until is not None:
+        args.append(until)
+        where.append(f'{column} < ${len(args)}')
+    return ' AND '.join(where), args
+
+
+def _whole_hour(t: datetime.datetime | None) -> datetime.datetime | None:
+    if t is None:
+        return None
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return t.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+async def rebuild_channel_stats(
+    conn,
+    *,
+    entity_ids: Iterable[int] | None = None,
+    since: datetime.datetime | None = None,
+    until: datetime.datetime | None = None,
+) -> int:
+    """Recompute the aggregates of `entity_ids` (all when None) for the
+    hours from `since` to `until` (rounded down to whole hours) from
+    `messages`; returns the number of hourly rows written.
+
+    Writers wait while it runs, so their deltas apply on top of the
+    rebuilt rows rather than being lost.
+    """
+    since, until = _whole_hour(since), _whole_hour(until)
+    where, args = _range(entity_ids, since, until, 'hour')
+    async with conn.transaction():
+        await conn.execute('LOCK TABLE channel_stats_hourly IN SHARE ROW EXCLUSIVE MODE')
+        await conn.execute(f'DELETE FROM channel_stats_hourly WHERE {where}', *args)
+        where, args = _range(entity_ids, since, until, 'date')
+        status = await conn.execute(_REBUILD.format(where=where), *args)
+    return int(status.split()[-1])
+
+
+@dataclass
+class ChannelActivity:
+    """Aggregates of one entity over one day or hour (`period`, in the
+    requested time zone)."""
+    entity_id: int
+    period: datetime.datetime
+    messages: int
+    media: int
+    text_chars: int
+
+    @property
+    def avg_chars(self) -> float:
+        return self.text_chars / self.messages if self.messages else 0.0
+
+
+def _pool(pool: AsyncpgPool | None) -> AsyncpgPool:
+    p = pool or get_pg_pool()
+    if p is None:
+        raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+    return p
+
+
+async def channel_activity(
+    entity_ids: Iterable[int] | None = None,
+    *,
+    since: datetime.datetime | None = None,
+    until: datetime.datetime | None = None,
+    bucket: str = 'day',
+    tz: str = 'UTC',
+    pool: AsyncpgPool | None = None,
+) -> list[ChannelActivity]:
+    """Activity per entity and `bucket` ('day' or 'hour') between `since`
+    (inclusive) and `until` (exclusive), oldest first. Days are calendar
+    days in `tz` and `period` is a naive local time (the aggregates are
+    hourly, so zones offset by half hours are approximated); periods
+    without messages are omitted."""
+    if bucket not in ('day', 'hour'):
+        raise ValueError("bucket must be 'day' or 'hour'")
+    where, args = _range(entity_ids, since, until, 'hour')
+    args.append(tz)
+    rows = await _pool(pool).fetch(
+        f"""
+        SELECT entity_id, date_trunc('{bucket}', hour AT TIME ZONE ${len(args)}) AS period,
+               sum(messages) AS messages, sum(media) AS media, sum(text_chars) AS text_chars
+        FROM channel_stats_hourly
+        WHERE {where}
+        GROUP BY 1, 2
+        HAVING sum(messages) > 0
+        ORDER BY 2, 1
+        """,
+        *args,
+    )
+    return [
+        ChannelActivity(r['entity_id'], r['period'], int(r['messages']), int(r['media']), int(r['text_chars']))
+        for r in rows
+    ]
+
+
+async def posting_heatmap(
+    entity_ids: Iterable[int] | None = None,
+    *,
+    since: datetime.datetime | None = None,
+    until: datetime.datetime | None = None,
+    tz: str = 'UTC',
+    pool: AsyncpgPool | None = None,
+) -> list[list[int]]:
+    """Messages per weekday and hour of day in `tz`: 7 rows (Monday first)
+    of 24 counts."""
+    where, args = _range(entity_ids, since, until, 'hour')
+    args.append(tz)
+    rows = await _pool(pool).fetch(
+        f"""
+        SELECT extract(isodow FROM hour AT TIME ZONE ${len(args)})::int AS dow,
+               extract(hour FROM hour AT TIME ZONE ${len(args)})::int AS h,
+               sum(messages) AS messages
+        FROM channel_stats_hourly
+        WHERE {where}
+        GROUP BY 1, 2
+        """,
+        *args,
+    )
+    grid = [[0] * 24 for _ in range(7)]
+    for r in rows:
+        grid[r['dow'] - 1][r['h']] = int(r['messages'])
+    return grid
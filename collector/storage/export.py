@@ -0,0 +1,271 @@
+"""Streaming export of the `messages` table to JSONL or Parquet.
+
+Rows are read through a server-side cursor in fixed-size chunks inside a
+read-only `REPEATABLE READ` transaction, and each chunk is written out
+while the next one is fetched, so memory stays bounded by `chunk_size`
+whatever the size of the table. JSONL is gzip-compressed; Parquet (which
+needs the optional `pyarrow`) gets one row group per chunk.
+
+Incremental exports use `messages.updated_at`: an export covers the rows
+changed after the previous watermark and records a new one. The new
+watermark lags the export snapshot by `settle` seconds so that a batch
+still committing when the snapshot was taken is picked up by the next
+export instead of being missed.
+"""
+from __future__ import annotations
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .postgres_store import get_pg_pool
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+DEFAULT_WATERMARK_PATH = Path('.state') / 'export_watermarks.json'
+
+EXPORT_COLUMNS = ('entity_id', 'id', 'date', 'sender_id', 'text', 'has_media', 'content_hash', 'updated_at', 'deleted_at')
+
+
+@dataclass
+class ExportFilter:
+    """Which rows to export. `since`/`until` bound the message date
+    (inclusive / exclusive), `updated_after`/`updated_until` the
+    `updated_at` column (exclusive / inclusive)."""
+    entity_ids: list[int] | None = None
+    since: datetime.datetime | None = None
+    until: datetime.datetime | None = None
+    updated_after: datetime.datetime | None = None
+    updated_until: datetime.datetime | None = None
+
+    def query(self, as_json: bool = False) -> tuple[str, list[Any]]:
+        """SQL and arguments selecting `EXPORT_COLUMNS`, or with `as_json`
+        each row as one JSON object text."""
+        where, args = [], []
+
+        def arg(value: Any) -> str:
+            args.append(value)
+            return f'${len(args)}'
+
+        if self.entity_ids is not None:
+            where.append(f'entity_id = ANY({arg(list(self.entity_ids))}::bigint[])')
+        if self.since is not None:
+            where.append(f'date >= {arg(self.since)}')
+        if self.until is not None:
+            where.append(f'date < {arg(self.until)}')
+        if self.updated_after is not None:
+            where.append(f'updated_at > {arg(self.updated_after)}')
+        if self.updated_until is not None:
+            where.append(f'updated_at <= {arg(self.updated_until)}')
+        sql = f'SELECT {", ".join(EXPORT_COLUMNS)} FROM messages'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if as_json:
+            sql = f'SELECT row_to_json(m)::text FROM ({sql}) m'
+        return sql, args
+
+
+async def iter_message_chunks(
+    conn, flt: ExportFilter, chunk_size: int = 10_000, as_json: bool = False
+) -> AsyncIterator[list]:
+    """Yield the rows matching `flt` as lists of at most `chunk_size` records.
+
+    Must run inside a transaction on `conn` (the cursor lives as long as
+    the transaction). Rows come in storage order.
+    """
+    sql, args = flt.query(as_json)
+    cursor = await conn.cursor(sql, *args)
+    while True:
+        rows = await cursor.fetch(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+class JsonlWriter:
+    """Gzip-compressed JSON lines, one object per message.
+
+    Postgres renders the objects (`row_to_json`), which is several times
+    faster than encoding records in Python.
+    """
+
+    as_json = True
+
+    def __init__(self, path: str | os.PathLike, compresslevel: int = 6) -> None:
+        self._file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=compresslevel)
+
+    def write(self, rows: list) -> None:
+        self._file.write('\n'.join([r[0] for r in rows]) + '\n')
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetWriter:
+    """Parquet file written one row group per chunk (requires `pyarrow`)."""
+
+    as_json = False
+
+    def __init__(self, path: str | os.PathLike, compression: str = 'zstd') -> None:
+        if pyarrow is None:
+            raise RuntimeError('pyarrow is not installed; cannot export Parquet')
+        ts = pyarrow.timestamp('us', tz='UTC')
+        self.schema = pyarrow.schema([
+            ('entity_id', pyarrow.int64()),
+            ('id', pyarrow.int64()),
+            ('date', ts),
+            ('sender_id', pyarrow.string()),
+            ('text', pyarrow.string()),
+            ('has_media', pyarrow.bool_()),
+            ('content_hash', pyarrow.int64()),
+            ('updated_at', ts),
+            ('deleted_at', ts),
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(str(path), self.schema, compression=compression)
+
+    def write(self, rows: list) -> None:
+        columns = [list(c) for c in zip(*rows)]
+        self._writer.write_table(pyarrow.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+WRITERS = {'jsonl': JsonlWriter, 'parquet': ParquetWriter}
+
+
+def format_for_path(path: str | os.PathLike) -> str:
+    """Guess the export format from a file name (`.parquet` or JSONL)."""
+    return 'parquet' if str(path).endswith(('.parquet', '.pq')) else 'jsonl'
+
+
+class ExportWatermarks:
+    """Last exported `updated_at` per export name, in a local JSON file."""
+
+    def __init__(self, path: str | os.PathLike = DEFAULT_WATERMARK_PATH) -> None:
+        self.path = Path(path)
+
+    def _load(self) -> dict[str, str]:
+        if not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text())
+        except Exception as e:
+            print(f'Warning: failed to read {self.path}:', e)
+            return {}
+
+    def get(self, name: str) -> datetime.datetime | None:
+        value = self._load().get(name)
+        return datetime.datetime.fromisoformat(value) if value else None
+
+    def set(self, name: str, watermark: datetime.datetime) -> None:
+        marks = self._load()
+        marks[name] = watermark.isoformat()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp.write_text(json.dumps(marks, indent=2, sort_keys=True))
+        os.replace(tmp, self.path)
+
+
+@dataclass
+class ExportResult:
+    path: Path
+    rows: int = 0
+    chunks: int = 0
+    # upper `updated_at` bound of this export (the next watermark)
+    watermark: datetime.datetime | None = None
+    started: float = field(default_factory=time.monotonic)
+    elapsed: float = 0.0
+
+    def summary(self) -> str:
+        size = self.path.stat().st_size if self.path.exists() else 0
+        rate = self.rows / self.elapsed if self.elapsed > 0 else 0.0
+        return (
+            f'{self.rows} rows in {self.chunks} chunks to {self.path} '
+            f'({size / 1e6:.1f} MB) in {self.elapsed:.1f}s ({rate:.0f} rows/s)'
+        )
+
+
+async def export_messages(
+    path: str | os.PathLike,
+    flt: ExportFilter | None = None,
+    *,
+    fmt: str | None = None,
+    pool: AsyncpgPool | None = None,
+    chunk_size: int = 10_000,
+    incremental: str | None = None,
+    watermarks: ExportWatermarks | None = None,
+    settle: float = 60.0,
+) -> ExportResult:
+    """Export the messages matching `flt` to `path`.
+
+    The file is written under a temporary name and renamed when complete.
+    With `incremental` (an export name) only rows changed since that
+    export's last watermark are written, and the watermark is advanced
+    after the file is in place.
+    """
+    fmt = fmt or format_for_path(path)
+    if fmt not in WRITERS:
+        raise ValueError(f'unknown export format {fmt!r}; expected one of {sorted(WRITERS)}')
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be >= 1')
+    p = pool or get_pg_pool()
+    if p is None:
+        raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+    flt = flt or ExportFilter()
+    if incremental:
+        watermarks = watermarks or ExportWatermarks()
+        flt.updated_after = watermarks.get(incremental)
+
+    path = Path(path)
+    tmp = path.with_name(path.name + '.part')
+    result = ExportResult(path)
+    writer = WRITERS[fmt](tmp)
+    # Encoding and compressing a chunk runs in a thread while the next
+    # chunk is fetched, so at most two chunks are held at a time.
+    pending: asyncio.Future | None = None
+    try:
+        async with p.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                result.watermark = await conn.fetchval(
+                    'SELECT now() - make_interval(secs => $1)', float(settle)
+                )
+                if incremental:
+                    flt.updated_until = result.watermark
+                async for rows in iter_message_chunks(conn, flt, chunk_size, writer.as_json):
+                    if pending is not None:
+                        await pending
+                    pending = asyncio.ensure_future(asyncio.to_thread(writer.write, rows))
+                    result.rows += len(rows)
+                    result.chunks += 1
+                if pending is not None:
+                    await pending
+        writer.close()
+    except BaseException:
+        if pending is not None and not pending.done():
+            # the thread cannot be interrupted; let it finish before closing
+            await asyncio.wait([pending])
+        writer.close()
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+    if incremental:
+        watermarks.set(incremental, result.watermark)
+    result.elapsed = time.monotonic() - result.started
+    return result
@@ -0,0 +1,219 @@
+"""Postgres-backed queue of collection jobs (see `collector.worker`).
+
+A job asks for one target to be fetched incrementally (`fetch`) or
+backfilled (`backfill`). Schedulers `enqueue` jobs; any number of worker
+processes, on any host, `claim` them with `FOR UPDATE SKIP LOCKED`, so two
+workers never get the same job and none waits on another's lock.
+
+A claimed job is leased to its worker until `lease_until`. The worker
+extends the lease with `heartbeat` while it runs; a job whose lease ran out
+(its worker died or lost the database) is put back in the queue by the
+next `claim`. Every update from a worker is fenced by the job's attempt
+number, so a worker that lost its lease cannot complete or reschedule a
+job another worker already took over.
+
+At most one job per target and kind is open (queued or running), so
+running a scheduler repeatedly does not pile up duplicates.
+"""
+from __future__ import annotations
+import datetime
+import json
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Iterable
+
+from .postgres_store import get_pg_pool
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+JOB_KINDS = ('fetch', 'backfill')
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+@dataclass
+class Job:
+    """A claimed job. `attempts` counts this run and fences the lease."""
+    id: int
+    kind: str
+    target: str
+    options: dict[str, Any] = field(default_factory=dict)
+    priority: int = 0
+    attempts: int = 0
+    max_attempts: int = 5
+    worker: str | None = None
+
+    @property
+    def last_attempt(self) -> bool:
+        return self.attempts >= self.max_attempts
+
+
+_EXPIRE = """
+UPDATE collection_jobs
+SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+    worker = NULL,
+    lease_until = NULL,
+    run_after = now(),
+    last_error = 'lease expired on ' || COALESCE(worker, '?'),
+    updated_at = now(),
+    finished_at = CASE WHEN attempts >= max_attempts THEN now() END
+WHERE status = 'running' AND lease_until < now()
+"""
+
+_CLAIM = """
+UPDATE collection_jobs j
+SET status = 'running',
+    worker = $1,
+    attempts = j.attempts + 1,
+    lease_until = now() + make_interval(secs => $2),
+    updated_at = now()
+FROM (
+    SELECT id FROM collection_jobs
+    WHERE status = 'queued' AND run_after <= now() AND ($3::text[] IS NULL OR kind = ANY($3::text[]))
+    ORDER BY priority DESC, run_after, id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+) c
+WHERE j.id = c.id
+RETURNING j.id, j.kind, j.target, j.options, j.priority, j.attempts, j.max_attempts, j.worker
+"""
+
+# Worker updates only apply while the worker still holds this attempt's lease.
+_FENCE = "id = $1 AND worker = $2 AND attempts = $3 AND status = 'running'"
+
+
+def _updated(status: str) -> bool:
+    return status.split()[-1] != '0'
+
+
+class JobQueue:
+    """The `collection_jobs` table."""
+
+    def __init__(self, pool: AsyncpgPool | None = None) -> None:
+        self.pool = pool
+
+    def _pool(self) -> AsyncpgPool:
+        p = self.pool or get_pg_pool()
+        if p is None:
+            raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+        return p
+
+    async def enqueue(
+        self,
+        kind: str,
+        targets: Iterable[str],
+        *,
+        priority: int = 0,
+        options: dict[str, Any] | None = None,
+        delay: float = 0.0,
+        max_attempts: int = 5,
+    ) -> int:
+        """Queue a `kind` job for each of `targets`, to run after `delay`
+        seconds; returns how many were queued. Targets that already have an
+        open job of this kind are left alone."""
+        if kind not in JOB_KINDS:
+            raise ValueError(f'unknown job kind {kind!r}; expected one of {", ".join(JOB_KINDS)}')
+        targets = list(dict.fromkeys(str(t) for t in targets))
+        if not targets:
+            return 0
+        async with self._pool().acquire() as conn:
+            status = await conn.execute(
+                """
+                INSERT INTO collection_jobs (kind, target, options, priority, max_attempts, run_after)
+                SELECT $1, t, $3::jsonb, $4, $5, now() + make_interval(secs => $6)
+                FROM unnest($2::text[]) AS t
+                ON CONFLICT (kind, target) WHERE status IN ('queued', 'running') DO NOTHING
+                """,
+                kind,
+                targets,
+                json.dumps(options or {}),
+                priority,
+                max_attempts,
+                float(delay),
+            )
+        return int(status.split()[-1])
+
+    async def claim(self, worker: str, *, kinds: Iterable[str] | None = None, lease: float = 60.0) -> Job | None:
+        """Lease the most urgent ready job to `worker` for `lease` seconds,
+        or return None when nothing is ready. Higher `priority` first, then
+        the longest waiting."""
+        async with self._pool().acquire() as conn:
+            await conn.execute(_EXPIRE)
+            row = await conn.fetchrow(_CLAIM, worker, float(lease), list(kinds) if kinds is not None else None)
+        if row is None:
+            return None
+        return Job(
+            row['id'], row['kind'], row['target'], json.loads(row['options']), row['priority'],
+            row['attempts'], row['max_attempts'], row['worker'],
+        )
+
+    async def _update(self, job: Job, assignments: str, *args: Any) -> bool:
+        async with self._pool().acquire() as conn:
+            status = await conn.execute(
+                f'UPDATE collection_jobs SET {assignments}, updated_at = now() WHERE {_FENCE}',
+                job.id, job.worker, job.attempts, *args,
+            )
+        return _updated(status)
+
+    async def heartbeat(self, job: Job, lease: float = 60.0) -> bool:
+        """Extend the lease by `lease` seconds from now; False if it was lost."""
+        return await self._update(job, 'lease_until = now() + make_interval(secs => $4)', float(lease))
+
+    async def complete(self, job: Job, messages: int = 0) -> bool:
+        return await self._update(
+            job,
+            "status = 'done', lease_until = NULL, last_error = NULL, finished_at = now(), messages = messages + $4",
+            messages,
+        )
+
+    async def retry(self, job: Job, error: str, delay: float, messages: int = 0) -> bool:
+        """Queue the job again in `delay` seconds, or fail it for good
+        when it has used up its attempts."""
+        if job.last_attempt:
+            return await self.fail(job, error, messages)
+        return await self._update(
+            job,
+            "status = 'queued', worker = NULL, lease_until = NULL, run_after = now() + make_interval(secs => $4), "
+            'last_error = $5, messages = messages + $6',
+            float(delay), error, messages,
+        )
+
+    async def reschedule(self, job: Job, delay: float, reason: str | None = None, messages: int = 0) -> bool:
+        """Queue the job again in `delay` seconds without counting this run
+        as an attempt (a flood wait or a worker shutting down)."""
+        return await self._update(
+            job,
+            "status = 'queued', worker = NULL, lease_until = NULL, attempts = attempts - 1, "
+            'run_after = now() + make_interval(secs => $4), last_error = COALESCE($5, last_error), '
+            'messages = messages + $6',
+            float(delay), reason, messages,
+        )
+
+    async def fail(self, job: Job, error: str, messages: int = 0) -> bool:
+        """Fail the job for good."""
+        return await self._update(
+            job,
+            "status = 'failed', lease_until = NULL, last_error = $4, finished_at = now(), messages = messages + $5",
+            error, messages,
+        )
+
+    async def counts(self) -> dict[tuple[str, str], int]:
+        """Number of jobs per `(kind, status)`."""
+        async with self._pool().acquire() as conn:
+            rows = await conn.fetch('SELECT kind, status, count(*) AS n FROM collection_jobs GROUP BY kind, status')
+        return {(r['kind'], r['status']): r['n'] for r in rows}
+
+    async def prune(self, older_than: datetime.timedelta) -> int:
+        """Delete done and failed jobs that finished more than `older_than` ago."""
+        async with self._pool().acquire() as conn:
+            status = await conn.execute(
+                """
+                DELETE FROM collection_jobs
+                WHERE status IN ('done', 'failed') AND finished_at < now() - $1::interval
+                """,
+                older_than,
+            )
+        return int(status.split()[-1])
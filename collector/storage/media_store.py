@@ -0,0 +1,130 @@
+"""SQL for media metadata (`message_media`) and downloaded files (`media_files`).
+
+The sinks merge `MEDIA_COLUMNS` rows (`media.MediaInfo.row()`) in the
+same transaction as the messages they belong to, and drop the rows of
+changed messages that no longer carry media; the downloader asks for
+files it does not have yet and records the ones it stored.
+"""
+from __future__ import annotations
+from typing import Iterable
+
+from .schema import create_media_staging
+
+# Column order of media rows, COPY and the merge.
+MEDIA_COLUMNS = (
+    'entity_id', 'message_id', 'kind', 'file_unique_id', 'file_id', 'size',
+    'mime_type', 'width', 'height', 'duration', 'file_name',
+)
+
+_MERGE_MEDIA = """
+INSERT INTO message_media (entity_id, message_id, kind, file_unique_id, file_id, size,
+                           mime_type, width, height, duration, file_name)
+SELECT entity_id, message_id, kind, file_unique_id, file_id, size,
+       mime_type, width, height, duration, file_name
+FROM message_media_staging
+ON CONFLICT (entity_id, message_id) DO UPDATE
+SET kind = EXCLUDED.kind,
+    file_unique_id = EXCLUDED.file_unique_id,
+    file_id = EXCLUDED.file_id,
+    size = EXCLUDED.size,
+    mime_type = EXCLUDED.mime_type,
+    width = EXCLUDED.width,
+    height = EXCLUDED.height,
+    duration = EXCLUDED.duration,
+    file_name = EXCLUDED.file_name,
+    updated_at = now()
+-- re-scans send the same metadata again; leave those rows alone
+WHERE (message_media.kind, message_media.file_unique_id, message_media.file_id, message_media.size,
+       message_media.mime_type, message_media.width, message_media.height, message_media.duration,
+       message_media.file_name)
+    IS DISTINCT FROM (EXCLUDED.kind, EXCLUDED.file_unique_id, EXCLUDED.file_id, EXCLUDED.size,
+                      EXCLUDED.mime_type, EXCLUDED.width, EXCLUDED.height, EXCLUDED.duration,
+                      EXCLUDED.file_name)
+"""
+
+
+async def merge_media(conn, rows: list[tuple]) -> int:
+    """Upsert media rows (`MEDIA_COLUMNS` tuples); returns how many were
+    inserted or changed. Must run inside a transaction on `conn`; a
+    message may appear only once in `rows`."""
+    if not rows:
+        return 0
+    await create_media_staging(conn)
+    await conn.copy_records_to_table('message_media_staging', records=rows, columns=MEDIA_COLUMNS)
+    status = await conn.execute(_MERGE_MEDIA)
+    return int(status.split()[-1])
+
+
+async def clear_media(conn, keys: list[tuple[int, int]]) -> int:
+    """Delete the media rows of messages (`(entity_id, message_id)` keys)
+    that no longer carry media, e.g. after an edit removed it; returns how
+    many were deleted."""
+    if not keys:
+        return 0
+    status = await conn.execute(
+        """
+        DELETE FROM message_media m
+        USING unnest($1::bigint[], $2::bigint[]) AS k(entity_id, message_id)
+        WHERE m.entity_id = k.entity_id AND m.message_id = k.message_id
+        """,
+        [k[0] for k in keys],
+        [k[1] for k in keys],
+    )
+    return int(status.split()[-1])
+
+
+async def pending_media(
+    conn,
+    *,
+    entity_ids: Iterable[int] | None = None,
+    kinds: Iterable[str] | None = None,
+    max_size: int | None = None,
+    limit: int | None = None,
+    candidates: int = 5,
+) -> list:
+    """Files that are not in `media_files` yet: records of
+    `file_unique_id` and the `entity_ids` / `message_ids` of up to
+    `candidates` messages carrying the file, newest first, so a caller can
+    fall back to another message when the first one is gone."""
+    where, args = ['m.file_unique_id IS NOT NULL'], []
+
+    def arg(value) -> str:
+        args.append(value)
+        return f'${len(args)}'
+
+    if entity_ids is not None:
+        where.append(f'm.entity_id = ANY({arg(list(entity_ids))}::bigint[])')
+    if kinds is not None:
+        where.append(f'm.kind = ANY({arg(list(kinds))}::text[])')
+    if max_size is not None:
+        where.append(f'm.size <= {arg(max_size)}')
+    n = arg(max(1, candidates))
+    sql = f"""
+        SELECT m.file_unique_id,
+               (array_agg(m.entity_id ORDER BY m.message_id DESC, m.entity_id))[1:{n}] AS entity_ids,
+               (array_agg(m.message_id ORDER BY m.message_id DESC, m.entity_id))[1:{n}] AS message_ids
+        FROM message_media m
+        WHERE {' AND '.join(where)}
+          AND NOT EXISTS (SELECT 1 FROM media_files f WHERE f.file_unique_id = m.file_unique_id)
+        GROUP BY m.file_unique_id
+        ORDER BY m.file_unique_id
+    """
+    if limit is not None:
+        sql += f' LIMIT {arg(limit)}'
+    return await conn.fetch(sql, *args)
+
+
+async def record_media_file(conn, file_unique_id: str, path: str, size: int, sha256: str) -> None:
+    """Record a downloaded file (`path` relative to the media store)."""
+    await conn.execute(
+        """
+        INSERT INTO media_files (file_unique_id, path, size, sha256)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (file_unique_id) DO UPDATE
+        SET path = EXCLUDED.path, size = EXCLUDED.size, sha256 = EXCLUDED.sha256, downloaded_at = now()
+        """,
+        file_unique_id,
+        path,
+        size,
+        sha256,
+    )
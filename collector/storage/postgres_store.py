@@ -1,5 +1,6 @@
 from __future__ import annotations
 import asyncio
+import time
 from typing import TYPE_CHECKING
 from contextlib import asynccontextmanager
 
@@ -8,6 +9,10 @@ try:
 except ImportError:
     asyncpg = None
 
+from .. import metrics
+from .media_store import clear_media, merge_media
+from .schema import STATS_DELTA, UNKNOWN_DATE, ensure_partitions, ensure_schema
+
 if TYPE_CHECKING:
     from asyncpg.pool import Pool as AsyncpgPool
     # Telethon Message type for static typing (import only during type checking)
@@ -28,7 +33,8 @@ _pg_lock: asyncio.Lock = asyncio.Lock()
 async def init_pg_pool(dsn: str, min_size: int = 1, max_size: int = 10) -> AsyncpgPool:
     """Initialize and return a module-level asyncpg pool.
 
-    Raises a RuntimeError if `asyncpg` is not installed.
+    The schema is bootstrapped (pending migrations applied) once, when the
+    pool is created. Raises a RuntimeError if `asyncpg` is not installed.
     """
     global _pg_pool, _pg_lock
     if asyncpg is None:
@@ -43,7 +49,19 @@ async def init_pg_pool(dsn: str, min_size: int = 1, max_size: int = 10) -> Async
             # inner check guarantees only the coroutine that holds the lock
             # will create and assign `_pg_pool`.
             if _pg_pool is None:
-                _pg_pool = await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size)
+                pool = await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size)
+                try:
+                    async with pool.acquire() as conn:
+                        await ensure_schema(conn)
+                except BaseException:
+                    await pool.close()
+                    raise
+                _pg_pool = pool
+    return _pg_pool
+
+
+def get_pg_pool() -> AsyncpgPool | None:
+    """Return the module-level asyncpg pool, or None if not initialized."""
     return _pg_pool
 
 
@@ -93,33 +111,55 @@ async def postgres_store(m: 'NormalizedMessage', pool: AsyncpgPool | None = None
     # messages are normalized before calling this function.
     nm = m
 
+    started = time.monotonic()
     async with p.acquire() as conn:
-        # Use a composite primary key (sender_id, id) so message ids are
-        # unique per sender/chat and cannot collide across different senders.
-        await conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS messages (
-                sender_id TEXT,
-                id BIGINT,
-                date TIMESTAMP WITH TIME ZONE,
-                text TEXT,
-                has_media BOOLEAN,
-                PRIMARY KEY (sender_id, id)
+        date = nm.date or UNKNOWN_DATE
+        await ensure_partitions(conn, (date,))
+        # The media row is written in the same transaction as its message.
+        async with conn.transaction():
+            # An unchanged message (same content hash) leaves the row untouched;
+            # a changed one is folded into `channel_stats_hourly`. A message
+            # marked deleted is restored, since it was just seen.
+            written = await conn.fetchval(
+                f"""
+                WITH old AS (
+                    SELECT entity_id, date, has_media, COALESCE(char_length(text), 0) AS text_chars
+                    FROM messages
+                    WHERE entity_id = $1 AND id = $2 AND date = $3 AND content_hash IS DISTINCT FROM $7
+                      AND deleted_at IS NULL
+                ),
+                new AS (
+                    INSERT INTO messages (entity_id, id, date, sender_id, text, has_media, content_hash)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    ON CONFLICT (entity_id, id, date) DO UPDATE
+                    SET sender_id = EXCLUDED.sender_id,
+                        text = EXCLUDED.text,
+                        has_media = EXCLUDED.has_media,
+                        content_hash = EXCLUDED.content_hash,
+                        deleted_at = NULL,
+                        updated_at = now()
+                    WHERE messages.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                       OR messages.deleted_at IS NOT NULL
+                    RETURNING entity_id, date, has_media, COALESCE(char_length(text), 0) AS text_chars
+                ),
+                {STATS_DELTA}
+                SELECT count(*) FROM new
+                """,
+                nm.entity_id,
+                nm.id,
+                date,
+                nm.sender,
+                nm.text,
+                nm.has_media,
+                nm.content_hash(),
             )
-            """
-        )
-        await conn.execute(
-            """
-            INSERT INTO messages (sender_id, id, date, text, has_media)
-            VALUES ($1, $2, $3, $4, $5)
-            ON CONFLICT (sender_id, id) DO UPDATE
-            SET date = EXCLUDED.date,
-                text = EXCLUDED.text,
-                has_media = EXCLUDED.has_media
-            """,
-            nm.sender,
-            nm.id,
-            nm.date,
-            nm.text,
-            nm.has_media,
-        )
+            if nm.media is not None:
+                await merge_media(conn, [nm.media.row(nm.entity_id, nm.id)])
+            elif written:
+                # an edit removed the media
+                await clear_media(conn, [(nm.entity_id, nm.id)])
+    metrics.SINK_WRITE_SECONDS.observe(time.monotonic() - started, sink='row')
+    if not written:
+        metrics.SINK_ROWS_UNCHANGED.inc(sink='row')
+    else:
+        metrics.SINK_ROWS_WRITTEN.inc(sink='row')
@@ -1,5 +1,6 @@
 from __future__ import annotations
 from typing import Any
+from ..media import extract_media
 from ..normalize import NormalizedMessage
 
 
@@ -12,20 +13,27 @@ async def print_store(m: Any) -> None:
     print('--- Latest message ---')
     if isinstance(m, NormalizedMessage):
         mid = m.id
+        entity_id = m.entity_id
         date = m.date
         sender = m.sender
         text = m.text
         has_media = m.has_media
+        media = m.media
     else:
         mid = getattr(m, 'id', None)
+        entity_id = getattr(m, 'chat_id', None)
         date = getattr(m, 'date', None)
         sender = getattr(m, 'sender_id', None)
         text = (getattr(m, 'text', '') or '').replace('\n', ' ')
         has_media = bool(getattr(m, 'media', None))
+        media = extract_media(getattr(m, 'media', None))
 
     print('id:', mid)
+    print('entity_id:', entity_id)
     print('date:', date)
     print('sender_id:', sender)
     print('text:', text)
     if has_media:
-        print('Has media: yes (not downloaded)')
+        kind = f'{media.kind}, ' if media is not None else ''
+        size = f'{media.size} bytes, ' if media is not None and media.size else ''
+        print(f'Has media: yes ({kind}{size}not downloaded)')
@@ -0,0 +1,239 @@
+"""Compressed archive of raw Telegram message payloads.
+
+`messages` keeps a few normalized columns; everything else Telegram sends
+(views, forwards, reactions, reply info, entities, ...) would be lost. With
+`BatchSink(archive_raw=True)` the TL serialization of each message the sink
+inserts or changes, or that has no archived payload yet (`bytes(message)`,
+Telegram's own compact binary encoding) is kept in a side table instead of
+inline JSON:
+
+- `message_raw_blocks` holds one zlib-compressed block per entity and sink
+  flush: the payloads of the batch back to back, so similar messages
+  compress together. The block records the API layer of its payloads.
+- `message_raw` maps `(entity_id, id)` to its block and byte range. A
+  message written again (an edit) points to the newer block.
+
+Blocks are written in the same transaction as the batch's rows. Batches
+that go to the spool while Postgres is unavailable are not archived.
+
+`RawArchive` reads the archive back: `get`/`get_many` fetch and decompress
+only the blocks holding the requested messages (recent blocks are cached)
+and decode only those messages; `iter_entity` walks an entity block by
+block and yields `RawMessage` objects that decode on first access. Decoding
+needs Telethon, with a layer that still knows the stored constructors.
+"""
+from __future__ import annotations
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Iterable, Mapping
+
+try:
+    from telethon.extensions import BinaryReader
+    from telethon.tl.alltlobjects import LAYER
+except ImportError:
+    BinaryReader = None
+    LAYER = 0
+
+from .postgres_store import get_pg_pool
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+CODEC = 'zlib'
+ZLIB_LEVEL = 6
+
+_INSERT_BLOCK = """
+INSERT INTO message_raw_blocks (entity_id, layer, codec, messages, raw_bytes, data)
+VALUES ($1, $2, $3, $4, $5, $6)
+RETURNING id
+"""
+_UPSERT_INDEX = """
+INSERT INTO message_raw (entity_id, id, block_id, start, length)
+SELECT $1, i.id, $2, i.start, i.length
+FROM unnest($3::bigint[], $4::int[], $5::int[]) AS i(id, start, length)
+ON CONFLICT (entity_id, id) DO UPDATE
+SET block_id = EXCLUDED.block_id, start = EXCLUDED.start, length = EXCLUDED.length
+"""
+_ARCHIVED = """
+SELECT r.entity_id, r.id
+FROM unnest($1::bigint[], $2::bigint[]) AS k(entity_id, id)
+JOIN message_raw r ON r.entity_id = k.entity_id AND r.id = k.id
+"""
+_LOCATE = """
+SELECT id, block_id, start, length FROM message_raw
+WHERE entity_id = $1 AND id = ANY($2::bigint[])
+"""
+
+
+def raw_payload(m: Any) -> bytes | None:
+    """TL serialization of a Telethon message; None for objects without one."""
+    try:
+        return bytes(m)
+    except Exception:
+        return None
+
+
+def decode_payload(payload: bytes) -> Any:
+    """Decode one stored payload back into a Telethon TL object."""
+    if BinaryReader is None:
+        raise RuntimeError('telethon is not installed; cannot decode raw payloads')
+    return BinaryReader(payload).tgread_object()
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f'unknown raw archive codec {codec!r}')
+
+
+async def archived_keys(conn, keys: Iterable[tuple[int, int]]) -> set[tuple[int, int]]:
+    """The `(entity_id, id)` keys among `keys` that have an archived payload."""
+    keys = list(keys)
+    if not keys:
+        return set()
+    entity_ids, ids = zip(*keys)
+    rows = await conn.fetch(_ARCHIVED, list(entity_ids), list(ids))
+    return {(r['entity_id'], r['id']) for r in rows}
+
+
+@dataclass
+class RawWrite:
+    """What one `write_raw` call stored."""
+    messages: int = 0
+    blocks: int = 0
+    raw_bytes: int = 0
+    stored_bytes: int = 0
+
+
+async def write_raw(conn, payloads: Mapping[tuple[int, int], bytes]) -> RawWrite:
+    """Store `{(entity_id, id): payload}` as one compressed block per entity.
+
+    Meant to run inside the transaction that merges the same messages.
+    """
+    by_entity: dict[int, list[tuple[int, bytes]]] = {}
+    for (entity_id, mid), payload in payloads.items():
+        by_entity.setdefault(entity_id, []).append((mid, payload))
+    done = RawWrite()
+    for entity_id, items in by_entity.items():
+        items.sort()
+        ids, starts, lengths = [], [], []
+        pos = 0
+        for mid, payload in items:
+            ids.append(mid)
+            starts.append(pos)
+            lengths.append(len(payload))
+            pos += len(payload)
+        data = zlib.compress(b''.join(p for _, p in items), ZLIB_LEVEL)
+        block_id = await conn.fetchval(_INSERT_BLOCK, entity_id, LAYER, CODEC, len(items), pos, data)
+        await conn.execute(_UPSERT_INDEX, entity_id, block_id, ids, starts, lengths)
+        done.messages += len(items)
+        done.blocks += 1
+        done.raw_bytes += pos
+        done.stored_bytes += len(data)
+    return done
+
+
+@dataclass
+class RawMessage:
+    """One archived message; `message` decodes the payload on first use."""
+    entity_id: int
+    id: int
+    payload: bytes
+    _decoded: Any = field(default=None, repr=False)
+
+    @property
+    def message(self) -> Any:
+        if self._decoded is None:
+            self._decoded = decode_payload(self.payload)
+        return self._decoded
+
+
+class RawArchive:
+    """Reads messages back from the raw archive.
+
+    Keeps up to `cache_blocks` decompressed blocks, so reading messages
+    that were collected together decompresses their block once.
+    """
+
+    def __init__(self, pool: AsyncpgPool | None = None, cache_blocks: int = 8) -> None:
+        self.pool = pool
+        self.cache_blocks = max(1, cache_blocks)
+        self._blocks: OrderedDict[int, bytes] = OrderedDict()
+
+    def _pool(self) -> AsyncpgPool:
+        p = self.pool or get_pg_pool()
+        if p is None:
+            raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+        return p
+
+    async def _load_blocks(self, conn, block_ids: Iterable[int]) -> dict[int, bytes]:
+        wanted = set(block_ids)
+        found = {b: self._blocks[b] for b in wanted if b in self._blocks}
+        missing = wanted - found.keys()
+        if missing:
+            rows = await conn.fetch(
+                'SELECT id, codec, data FROM message_raw_blocks WHERE id = ANY($1::bigint[])', list(missing)
+            )
+            for r in rows:
+                found[r['id']] = self._remember(r['id'], _decompress(r['codec'], r['data']))
+        for b in found:
+            if b in self._blocks:
+                self._blocks.move_to_end(b)
+        return found
+
+    def _remember(self, block_id: int, data: bytes) -> bytes:
+        self._blocks[block_id] = data
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return data
+
+    async def payloads(self, entity_id: int, ids: Iterable[int]) -> dict[int, bytes]:
+        """Raw payloads of the archived messages among `ids`, not decoded."""
+        p = self._pool()
+        async with p.acquire() as conn:
+            located = await conn.fetch(_LOCATE, entity_id, list(ids))
+            blocks = await self._load_blocks(conn, (r['block_id'] for r in located))
+        return {
+            r['id']: blocks[r['block_id']][r['start']:r['start'] + r['length']]
+            for r in located if r['block_id'] in blocks
+        }
+
+    async def get_many(self, entity_id: int, ids: Iterable[int]) -> dict[int, Any]:
+        """Decoded TL messages of the archived messages among `ids`."""
+        return {mid: decode_payload(p) for mid, p in (await self.payloads(entity_id, ids)).items()}
+
+    async def get(self, entity_id: int, mid: int) -> Any | None:
+        """Decoded TL message `mid` of `entity_id`, None if not archived."""
+        return (await self.get_many(entity_id, [mid])).get(mid)
+
+    async def iter_entity(
+        self, entity_id: int, *, min_id: int | None = None, max_id: int | None = None
+    ) -> AsyncIterator[RawMessage]:
+        """Yield the archived messages of `entity_id` (ids from `min_id` to
+        `max_id`, inclusive) block by block, each decoded only when its
+        `message` is read. One block is decompressed at a time."""
+        where, args = ['entity_id = $1'], [entity_id]
+        if min_id is not None:
+            args.append(min_id)
+            where.append(f'id >= ${len(args)}')
+        if max_id is not None:
+            args.append(max_id)
+            where.append(f'id <= ${len(args)}')
+        sql = (
+            f'SELECT id, block_id, start, length FROM message_raw WHERE {" AND ".join(where)} '
+            'ORDER BY block_id, start'
+        )
+        p = self._pool()
+        async with p.acquire() as conn, conn.transaction():
+            block_id, block = None, b''
+            async for r in conn.cursor(sql, *args):
+                if r['block_id'] != block_id:
+                    block_id = r['block_id']
+                    block = (await self._load_blocks(conn, [block_id])).get(block_id, b'')
+                start = r['start']
+                yield RawMessage(entity_id, r['id'], block[start:start + r['length']])
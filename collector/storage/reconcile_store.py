@@ -0,0 +1,87 @@
+"""Stored side of edit/deletion reconciliation (see `collector.reconcile`).
+
+`stored_window` reads the key and content hash of the live (not deleted)
+messages of one entity in a window, by lowest id or by date, so the cost
+is one index range scan the size of the window. `mark_deleted` sets
+`deleted_at` on messages that no longer exist on the server and takes
+them out of `channel_stats_hourly` in the same statement. Deleted rows
+are kept; a message that is stored again is restored (the writers clear
+`deleted_at`).
+"""
+from __future__ import annotations
+import datetime
+from typing import TYPE_CHECKING, Iterable
+
+from .postgres_store import get_pg_pool
+from .schema import STATS_DELTA
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+# `old` holds the rows that stop being counted; nothing is added.
+_MARK_DELETED = f"""
+WITH old AS (
+    UPDATE messages m
+    SET deleted_at = now(), updated_at = now()
+    FROM unnest($2::bigint[], $3::timestamptz[]) AS d(id, date)
+    WHERE m.entity_id = $1 AND m.id = d.id AND m.date = d.date AND m.deleted_at IS NULL
+    RETURNING m.entity_id, m.date, m.has_media, COALESCE(char_length(m.text), 0) AS text_chars
+),
+new AS (
+    SELECT * FROM old WHERE false
+),
+{STATS_DELTA}
+SELECT count(*) FROM old
+"""
+
+
+def _pool(pool: AsyncpgPool | None) -> AsyncpgPool:
+    p = pool or get_pg_pool()
+    if p is None:
+        raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+    return p
+
+
+async def stored_window(
+    entity_id: int,
+    *,
+    min_id: int | None = None,
+    since: datetime.datetime | None = None,
+    pool: AsyncpgPool | None = None,
+) -> dict[int, tuple[datetime.datetime, int | None]]:
+    """Return `{id: (date, content_hash)}` of the live stored messages of
+    `entity_id` with an id of at least `min_id` and a date of at least
+    `since` (either may be None)."""
+    where, args = ['entity_id = $1', 'deleted_at IS NULL'], [entity_id]
+    if min_id is not None:
+        args.append(min_id)
+        where.append(f'id >= ${len(args)}')
+    if since is not None:
+        args.append(since)
+        where.append(f'date >= ${len(args)}')
+    rows = await _pool(pool).fetch(
+        f'SELECT id, date, content_hash FROM messages WHERE {" AND ".join(where)}', *args
+    )
+    return {r['id']: (r['date'], r['content_hash']) for r in rows}
+
+
+async def mark_deleted(
+    entity_id: int,
+    keys: Iterable[tuple[int, datetime.datetime]],
+    *,
+    pool: AsyncpgPool | None = None,
+) -> int:
+    """Mark the messages `(id, date)` of `entity_id` as deleted now and
+    remove them from the activity aggregates; returns how many live rows
+    were marked."""
+    keys = list(keys)
+    if not keys:
+        return 0
+    ids, dates = zip(*keys)
+    async with _pool(pool).acquire() as conn:
+        async with conn.transaction():
+            return await conn.fetchval(_MARK_DELETED, entity_id, list(ids), list(dates))
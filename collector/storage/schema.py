@@ -0,0 +1,544 @@
+"""Postgres schema bootstrap and versioned migrations.
+
+`ensure_schema()` runs once per pool (see `init_pg_pool`) and applies any
+migrations newer than the version recorded in `schema_migrations`. Each
+migration runs in its own transaction under an advisory lock, so several
+collectors starting at once do not race each other.
+
+The `messages` table is keyed by the chat (`entity_id`) and the message id,
+which is how Telegram numbers messages, and is range-partitioned by month
+on `date`. Postgres requires the partition key in every unique constraint,
+so the primary key is `(entity_id, id, date)`; a message's `date` never
+changes after it is sent, so this is still one row per message.
+"""
+from __future__ import annotations
+import datetime
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable, Sequence
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from ..config import get_search_languages
+
+
+# Stored for messages whose date could not be parsed; `date` is part of the
+# primary key so it cannot be NULL.
+UNKNOWN_DATE = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Arbitrary key for `pg_advisory_xact_lock` so concurrent bootstraps serialize.
+_MIGRATION_LOCK_KEY = 0x7467_7061_7273  # 'tgpars'
+
+# Month partitions known to exist in this process (see `ensure_partitions`).
+_known_partitions: set[tuple[int, int]] = set()
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Any], Awaitable[None]]
+
+
+_CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+)
+"""
+
+_CREATE_MESSAGES = """
+CREATE TABLE messages (
+    entity_id BIGINT NOT NULL,
+    id BIGINT NOT NULL,
+    date TIMESTAMP WITH TIME ZONE NOT NULL,
+    sender_id TEXT,
+    text TEXT,
+    has_media BOOLEAN,
+    PRIMARY KEY (entity_id, id, date)
+) PARTITION BY RANGE (date)
+"""
+
+# Latest-per-entity and per-entity date ranges.
+_CREATE_ENTITY_DATE_INDEX = 'CREATE INDEX IF NOT EXISTS messages_entity_date_idx ON messages (entity_id, date DESC)'
+# Global "latest N messages" and date-range scans across entities.
+_CREATE_DATE_INDEX = 'CREATE INDEX IF NOT EXISTS messages_date_idx ON messages (date DESC)'
+
+# Session-local staging table used by the batch sink; rows disappear at
+# commit so a pooled connection can reuse it for the next batch.
+_CREATE_STAGING = """
+CREATE TEMP TABLE IF NOT EXISTS messages_staging (
+    entity_id BIGINT,
+    id BIGINT,
+    date TIMESTAMP WITH TIME ZONE,
+    sender_id TEXT,
+    text TEXT,
+    has_media BOOLEAN,
+    content_hash BIGINT
+) ON COMMIT DELETE ROWS
+"""
+
+
+_CREATE_MEDIA_STAGING = """
+CREATE TEMP TABLE IF NOT EXISTS message_media_staging (
+    entity_id BIGINT,
+    message_id BIGINT,
+    kind TEXT,
+    file_unique_id TEXT,
+    file_id TEXT,
+    size BIGINT,
+    mime_type TEXT,
+    width INTEGER,
+    height INTEGER,
+    duration DOUBLE PRECISION,
+    file_name TEXT
+) ON COMMIT DELETE ROWS
+"""
+
+
+async def _table_exists(conn, name: str) -> bool:
+    return bool(await conn.fetchval('SELECT to_regclass($1) IS NOT NULL', name))
+
+
+async def _column_exists(conn, table: str, column: str) -> bool:
+    return bool(await conn.fetchval(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = $1 AND column_name = $2
+        )
+        """,
+        table,
+        column,
+    ))
+
+
+# Legacy rows whose sender is a channel (marked id), i.e. channel posts.
+_LEGACY_CHANNEL_ROW = "sender_id LIKE '-100%' AND sender_id ~ '^-[0-9]+$'"
+
+
+async def _migrate_v1(conn) -> None:
+    """Create the partitioned `messages` table, moving a legacy table aside.
+
+    The legacy layout was keyed by `(sender_id, id)` and had no chat column.
+    Only channel posts are copied over, using `sender_id` as `entity_id`
+    (Telethon reports the channel itself as their sender, with a marked
+    `-100...` id). Other rows (users posting in groups, non-numeric
+    senders) do not say which chat they belong to and are left behind. The
+    old table is kept as `messages_legacy` for inspection.
+    """
+    legacy = await _table_exists(conn, 'messages') and not await _column_exists(conn, 'messages', 'entity_id')
+    if legacy:
+        await conn.execute('ALTER TABLE messages RENAME TO messages_legacy')
+        await conn.execute('ALTER INDEX IF EXISTS messages_pkey RENAME TO messages_legacy_pkey')
+
+    await conn.execute(_CREATE_MESSAGES)
+    await conn.execute(_CREATE_ENTITY_DATE_INDEX)
+    await conn.execute(_CREATE_DATE_INDEX)
+
+    if legacy:
+        months = await conn.fetch(
+            f"SELECT DISTINCT date_trunc('month', COALESCE(date, $1) AT TIME ZONE 'UTC') AS m "
+            f"FROM messages_legacy WHERE {_LEGACY_CHANNEL_ROW}",
+            UNKNOWN_DATE,
+        )
+        await ensure_partitions(conn, (r['m'] for r in months))
+        moved = await conn.execute(
+            f"""
+            INSERT INTO messages (entity_id, id, date, sender_id, text, has_media)
+            SELECT sender_id::bigint, id, COALESCE(date, $1), sender_id, text, has_media
+            FROM messages_legacy
+            WHERE {_LEGACY_CHANNEL_ROW}
+            ON CONFLICT DO NOTHING
+            """,
+            UNKNOWN_DATE,
+        )
+        print(f'Migrated {moved.split()[-1]} rows from the legacy messages table; originals kept in messages_legacy')
+
+
+async def _migrate_v2(conn) -> None:
+    """Per-entity high-water marks for incremental collection."""
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS collection_state (
+            entity_id BIGINT PRIMARY KEY,
+            high_water_id BIGINT NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+        """
+    )
+
+
+async def _migrate_v3(conn) -> None:
+    """Per-segment progress of range-split backfills."""
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backfill_segments (
+            entity_id BIGINT NOT NULL,
+            low_id BIGINT NOT NULL,
+            high_id BIGINT NOT NULL,
+            cursor_id BIGINT,
+            done BOOLEAN NOT NULL DEFAULT false,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (entity_id, low_id)
+        )
+        """
+    )
+
+
+async def _migrate_v4(conn) -> None:
+    """Content hash of each message, so unchanged rows are not rewritten.
+
+    Existing rows get NULL and are filled in the next time they are seen.
+    """
+    await conn.execute('ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_hash BIGINT')
+
+
+async def _migrate_v5(conn) -> None:
+    """When each message row was last inserted or changed, for incremental exports.
+
+    `now()` is a stable default, so existing rows get the migration time
+    without a table rewrite.
+    """
+    await conn.execute(
+        'ALTER TABLE messages ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()'
+    )
+    await conn.execute('CREATE INDEX IF NOT EXISTS messages_updated_at_idx ON messages (updated_at)')
+
+
+def search_tsquery_sql(languages: Sequence[str], param: str) -> str:
+    """tsquery matching `param` (a web-search style query) in any of `languages`."""
+    return '(' + ' || '.join(f"websearch_to_tsquery('{lang}'::regconfig, {param})" for lang in languages) + ')'
+
+
+async def _check_languages(conn, languages: Sequence[str]) -> None:
+    if not languages:
+        raise ValueError('at least one text search language is required')
+    for lang in languages:
+        # names end up in DDL, so only plain identifiers are accepted
+        if not re.fullmatch(r'[a-z_][a-z0-9_]*', lang):
+            raise ValueError(f'invalid text search configuration name {lang!r}')
+        if not await conn.fetchval('SELECT 1 FROM pg_ts_config WHERE cfgname = $1', lang):
+            raise ValueError(f'unknown text search configuration {lang!r}')
+
+
+async def set_search_languages(conn, languages: Sequence[str]) -> None:
+    """(Re)create `messages.search_tsv` and its GIN index for `languages`.
+
+    With several configurations the column holds the text parsed with each
+    of them (each one costs a full parse on every insert). The languages
+    are kept as the column comment (see `search_languages`).
+    Changing them rewrites the table; run it in a quiet period.
+    """
+    await _check_languages(conn, languages)
+    vector = ' || '.join(f"to_tsvector('{lang}'::regconfig, COALESCE(text, ''))" for lang in languages)
+    async with conn.transaction():
+        await conn.execute('ALTER TABLE messages DROP COLUMN IF EXISTS search_tsv')
+        await conn.execute(f'ALTER TABLE messages ADD COLUMN search_tsv tsvector GENERATED ALWAYS AS ({vector}) STORED')
+        await conn.execute('CREATE INDEX messages_search_idx ON messages USING gin (search_tsv)')
+        await conn.execute(f"COMMENT ON COLUMN messages.search_tsv IS '{','.join(languages)}'")
+
+
+async def search_languages(conn) -> tuple[str, ...]:
+    """Languages `messages.search_tsv` was built with (empty if it does not exist)."""
+    comment = await conn.fetchval(
+        """
+        SELECT col_description(a.attrelid, a.attnum) FROM pg_attribute a
+        WHERE a.attrelid = to_regclass('messages') AND a.attname = 'search_tsv' AND NOT a.attisdropped
+        """
+    )
+    return tuple(comment.split(',')) if comment else ()
+
+
+async def ensure_trigram_index(conn) -> bool:
+    """Create `pg_trgm` and the trigram index on `messages.text`.
+
+    Returns False, with a warning, when the extension is not installed on
+    the server or may not be created by this role.
+    """
+    if not await conn.fetchval("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"):
+        print('Warning: the pg_trgm extension is not available; substring search will scan the table '
+              'and fuzzy search is disabled')
+        return False
+    try:
+        async with conn.transaction():
+            await conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except asyncpg.InsufficientPrivilegeError as e:
+        print(f'Warning: cannot create the pg_trgm extension ({e}); ask an administrator to run '
+              f'CREATE EXTENSION pg_trgm, then scripts/search.py --setup-trigram')
+        return False
+    await conn.execute('CREATE INDEX IF NOT EXISTS messages_text_trgm_idx ON messages USING gin (text gin_trgm_ops)')
+    return True
+
+
+async def _migrate_v6(conn) -> None:
+    """Full-text search column over `text` (languages from `TG_SEARCH_LANGUAGES`)."""
+    await set_search_languages(conn, get_search_languages())
+
+
+async def _migrate_v7(conn) -> None:
+    """Trigram index for substring and fuzzy search, when `pg_trgm` is available."""
+    await ensure_trigram_index(conn)
+
+
+async def _migrate_v8(conn) -> None:
+    """Media metadata per message and the files the downloader stored."""
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS message_media (
+            entity_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            kind TEXT NOT NULL,
+            file_unique_id TEXT,
+            file_id TEXT,
+            size BIGINT,
+            mime_type TEXT,
+            width INTEGER,
+            height INTEGER,
+            duration DOUBLE PRECISION,
+            file_name TEXT,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (entity_id, message_id)
+        )
+        """
+    )
+    await conn.execute(
+        'CREATE INDEX IF NOT EXISTS message_media_file_idx ON message_media (file_unique_id)'
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_files (
+            file_unique_id TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size BIGINT NOT NULL,
+            sha256 TEXT NOT NULL,
+            downloaded_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+        """
+    )
+
+
+async def _migrate_v9(conn) -> None:
+    """Queue of collection jobs claimed by distributed workers."""
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS collection_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL CHECK (kind IN ('fetch', 'backfill')),
+            target TEXT NOT NULL,
+            options JSONB NOT NULL DEFAULT '{}',
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            lease_until TIMESTAMP WITH TIME ZONE,
+            worker TEXT,
+            last_error TEXT,
+            messages BIGINT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            finished_at TIMESTAMP WITH TIME ZONE
+        )
+        """
+    )
+    # at most one open job per target and kind, so scheduling is idempotent
+    await conn.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS collection_jobs_open_idx ON collection_jobs (kind, target)
+        WHERE status IN ('queued', 'running')
+        """
+    )
+    await conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS collection_jobs_ready_idx ON collection_jobs (priority DESC, run_after, id)
+        WHERE status = 'queued'
+        """
+    )
+    await conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS collection_jobs_lease_idx ON collection_jobs (lease_until)
+        WHERE status = 'running'
+        """
+    )
+
+
+# CTEs that fold a merge into the aggregates. Expects the statement to
+# define `old` (rows as they were before the merge, only those the merge
+# changes) and `new` (the merge's RETURNING), both with columns
+# (entity_id, date, has_media, text_chars). Every CTE of a statement sees
+# the same snapshot, so `old` is read before `new` is written.
+STATS_DELTA = """
+stats_delta AS (
+    SELECT entity_id, date_trunc('hour', date AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS hour,
+           sum(n) AS messages, sum(media) AS media, sum(chars) AS text_chars
+    FROM (
+        SELECT entity_id, date, 1 AS n, has_media::int AS media, text_chars AS chars FROM new
+        UNION ALL
+        SELECT entity_id, date, -1, -has_media::int, -text_chars FROM old
+    ) d
+    GROUP BY 1, 2
+    HAVING sum(n) <> 0 OR sum(media) <> 0 OR sum(chars) <> 0
+),
+stats_upsert AS (
+    INSERT INTO channel_stats_hourly AS c (entity_id, hour, messages, media, text_chars)
+    -- a fixed order keeps concurrent writers from deadlocking on shared hours
+    SELECT entity_id, hour, messages, media, text_chars FROM stats_delta ORDER BY entity_id, hour
+    ON CONFLICT (entity_id, hour) DO UPDATE
+    SET messages = c.messages + EXCLUDED.messages,
+        media = c.media + EXCLUDED.media,
+        text_chars = c.text_chars + EXCLUDED.text_chars
+)
+"""
+
+async def _migrate_v10(conn) -> None:
+    """Hourly per-entity activity aggregates, filled from the stored messages."""
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channel_stats_hourly (
+            entity_id BIGINT NOT NULL,
+            hour TIMESTAMP WITH TIME ZONE NOT NULL,
+            messages INTEGER NOT NULL DEFAULT 0,
+            media INTEGER NOT NULL DEFAULT 0,
+            text_chars BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (entity_id, hour)
+        )
+        """
+    )
+    await conn.execute(
+        """
+        INSERT INTO channel_stats_hourly (entity_id, hour, messages, media, text_chars)
+        SELECT entity_id, date_trunc('hour', date AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+               count(*), count(*) FILTER (WHERE has_media), COALESCE(sum(char_length(text)), 0)
+        FROM messages
+        GROUP BY 1, 2
+        ON CONFLICT DO NOTHING
+        """
+    )
+
+
+async def _migrate_v11(conn) -> None:
+    """When a message was found deleted on the server (NULL while it exists)."""
+    await conn.execute('ALTER TABLE messages ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE')
+
+
+async def _migrate_v12(conn) -> None:
+    """Compressed raw TL payloads (`storage.raw_archive`): one block per
+    entity and sink flush, and where each message lies in its block."""
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS message_raw_blocks (
+            id BIGSERIAL PRIMARY KEY,
+            entity_id BIGINT NOT NULL,
+            -- Telegram API layer of the payloads and the compression used
+            layer INTEGER NOT NULL,
+            codec TEXT NOT NULL,
+            messages INTEGER NOT NULL,
+            raw_bytes INTEGER NOT NULL,
+            data BYTEA NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+        """
+    )
+    # already compressed: keep TOAST from trying again
+    await conn.execute('ALTER TABLE message_raw_blocks ALTER COLUMN data SET STORAGE EXTERNAL')
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS message_raw (
+            entity_id BIGINT NOT NULL,
+            id BIGINT NOT NULL,
+            block_id BIGINT NOT NULL REFERENCES message_raw_blocks (id) ON DELETE CASCADE,
+            start INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            PRIMARY KEY (entity_id, id)
+        )
+        """
+    )
+    await conn.execute('CREATE INDEX IF NOT EXISTS message_raw_block_idx ON message_raw (block_id)')
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, 'partitioned messages keyed by (entity_id, id)', _migrate_v1),
+    Migration(2, 'collection_state checkpoints', _migrate_v2),
+    Migration(3, 'backfill_segments progress', _migrate_v3),
+    Migration(4, 'messages.content_hash', _migrate_v4),
+    Migration(5, 'messages.updated_at', _migrate_v5),
+    Migration(6, 'messages.search_tsv full-text index', _migrate_v6),
+    Migration(7, 'messages.text trigram index', _migrate_v7),
+    Migration(8, 'message_media metadata and media_files', _migrate_v8),
+    Migration(9, 'collection_jobs queue', _migrate_v9),
+    Migration(10, 'channel_stats_hourly aggregates', _migrate_v10),
+    Migration(11, 'messages.deleted_at', _migrate_v11),
+    Migration(12, 'message_raw archive blocks', _migrate_v12),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+async def ensure_schema(conn) -> int:
+    """Apply pending migrations on `conn` and return the schema version."""
+    await conn.execute(_CREATE_MIGRATIONS_TABLE)
+    current = await conn.fetchval('SELECT COALESCE(max(version), 0) FROM schema_migrations')
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        async with conn.transaction():
+            await conn.execute('SELECT pg_advisory_xact_lock($1)', _MIGRATION_LOCK_KEY)
+            # Another process may have applied it while we waited for the lock.
+            done = await conn.fetchval('SELECT 1 FROM schema_migrations WHERE version = $1', migration.version)
+            if done:
+                continue
+            await migration.apply(conn)
+            await conn.execute(
+                'INSERT INTO schema_migrations (version, description) VALUES ($1, $2)',
+                migration.version,
+                migration.description,
+            )
+        current = migration.version
+    return current
+
+
+def _month(d: datetime.datetime) -> tuple[int, int]:
+    if d.tzinfo is not None:
+        d = d.astimezone(datetime.timezone.utc)
+    return d.year, d.month
+
+
+async def ensure_partitions(conn, dates: Iterable[datetime.datetime]) -> None:
+    """Create the monthly `messages` partitions covering `dates` if missing.
+
+    Partitions already created (or seen) by this process are cached, so the
+    common case is a set lookup without touching the database. Inside a
+    transaction (a migration) nothing is cached, since a rollback would
+    drop the partitions again; they are found on the next call instead.
+    """
+    months = {_month(d) for d in dates if d is not None} - _known_partitions
+    cache = not conn.is_in_transaction()
+    for year, month in sorted(months):
+        start = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+        end = datetime.datetime(year + (month == 12), month % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+        name = f'messages_p{year:04d}_{month:02d}'
+        try:
+            await conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        except (asyncpg.DuplicateTableError, asyncpg.UniqueViolationError):
+            # Lost a race with another process creating the same partition.
+            pass
+        if cache:
+            _known_partitions.add((year, month))
+
+
+async def create_staging(conn) -> None:
+    """Create the session-local staging table used by the batch sink."""
+    await conn.execute(_CREATE_STAGING)
+
+
+async def create_media_staging(conn) -> None:
+    """Create the session-local staging table for media rows."""
+    await conn.execute(_CREATE_MEDIA_STAGING)
@@ -0,0 +1,282 @@
+"""Ranked, keyset-paginated search over stored messages.
+
+Three modes, each backed by an index created by the schema migrations:
+
+- `fts`       full-text search on `messages.search_tsv` (GIN). The query
+              uses web-search syntax (`"exact phrase"`, `or`, `-word`) and
+              is parsed with every configured language (by default
+              `russian`, which stems English words too). Ranked by
+              `ts_rank`.
+- `substring` case-insensitive substring match (`ILIKE`) served by the
+              trigram index on `text`; newest first.
+- `fuzzy`     typo-tolerant word match (`pg_trgm` word similarity),
+              ranked by similarity.
+
+Results come best match first (`order='rank'`) or newest first
+(`order='date'`, which searches back in growing date slices and stops once
+a page is full, so common terms stay cheap). Pages continue from a
+`SearchCursor` (the last hit of the previous page) instead of an OFFSET,
+so later pages cost the same as the first. Snippets are built only for the
+hits of the returned page.
+"""
+from __future__ import annotations
+import base64
+import datetime
+import json
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Iterable, Iterator
+
+from .postgres_store import get_pg_pool
+from .schema import search_languages, search_tsquery_sql
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+SEARCH_MODES = ('fts', 'substring', 'fuzzy')
+SEARCH_ORDERS = ('rank', 'date')
+
+# Cumulative sizes of the date slices searched by `order='date'`.
+_SLICE_DAYS = (7, 31, 183, 731)
+
+_HEADLINE_OPTIONS = 'MaxFragments=2, MaxWords=18, MinWords=6, StartSel=[, StopSel=]'
+
+
+@dataclass(frozen=True)
+class SearchCursor:
+    """Position after the last hit of a page."""
+    rank: float
+    date: datetime.datetime
+    entity_id: int
+    id: int
+
+    def encode(self) -> str:
+        """Opaque token for passing a cursor on the command line."""
+        raw = json.dumps([self.rank, self.date.isoformat(), self.entity_id, self.id])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token: str) -> 'SearchCursor':
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            rank, date, entity_id, mid = json.loads(raw)
+            return cls(float(rank), datetime.datetime.fromisoformat(date), int(entity_id), int(mid))
+        except Exception as e:
+            raise ValueError(f'invalid search cursor {token!r}: {e}')
+
+
+@dataclass
+class SearchHit:
+    entity_id: int
+    id: int
+    date: datetime.datetime
+    sender_id: str
+    rank: float
+    snippet: str
+
+
+@dataclass
+class SearchPage:
+    hits: list[SearchHit]
+    # None on the last page
+    next_cursor: SearchCursor | None
+
+
+def _like_pattern(query: str) -> str:
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _snippet(text: str, width: int = 160) -> str:
+    return text if len(text) <= width else text[:width - 1] + '…'
+
+
+def build_search_query(
+    mode: str,
+    languages: Iterable[str],
+    *,
+    order: str = 'rank',
+    entity_ids: list[int] | None = None,
+    since: datetime.datetime | None = None,
+    until: datetime.datetime | None = None,
+    after: SearchCursor | None = None,
+) -> tuple[str, list[Any]]:
+    """SQL for one page; `$1` is the query text and the last parameter the
+    page size. Returns the SQL and the parameters between them."""
+    if mode not in SEARCH_MODES:
+        raise ValueError(f'unknown search mode {mode!r}; expected one of {SEARCH_MODES}')
+    if order not in SEARCH_ORDERS:
+        raise ValueError(f'unknown search order {order!r}; expected one of {SEARCH_ORDERS}')
+    languages = list(languages)
+    args: list[Any] = []
+
+    def arg(value: Any) -> str:
+        args.append(value)
+        return f'${len(args) + 1}'
+
+    if mode == 'fts':
+        tsq = search_tsquery_sql(languages, '$1')
+        match, rank = f'search_tsv @@ {tsq}', f'ts_rank(search_tsv, {tsq})'
+        snippet = f"ts_headline('{languages[0]}'::regconfig, text, {tsq}, '{_HEADLINE_OPTIONS}')"
+    elif mode == 'substring':
+        match, rank, snippet = 'text ILIKE $1', '0::real', 'text'
+    else:
+        match, rank, snippet = '$1 <% text', 'word_similarity($1, text)', 'text'
+
+    # messages marked deleted by reconciliation are kept but not searched
+    where = [match, 'deleted_at IS NULL']
+    if entity_ids is not None:
+        where.append(f'entity_id = ANY({arg(list(entity_ids))}::bigint[])')
+    if since is not None:
+        where.append(f'date >= {arg(since)}')
+    if until is not None:
+        where.append(f'date < {arg(until)}')
+    if order == 'rank':
+        # Ranking needs every match scored; the outer query only adds snippets.
+        if after is not None:
+            where.append(
+                f'({rank}, date, entity_id, id) < '
+                f'({arg(after.rank)}::real, {arg(after.date)}, {arg(after.entity_id)}, {arg(after.id)})'
+            )
+        key, inner_rank, outer_rank = 'rank DESC, date DESC, entity_id DESC, id DESC', f', {rank} AS rank', 'rank'
+    else:
+        # Newest first: matches are only fetched, the rank is computed for the page.
+        if after is not None:
+            where.append(
+                f'(date, entity_id, id) < ({arg(after.date)}, {arg(after.entity_id)}, {arg(after.id)})'
+            )
+        key, inner_rank, outer_rank = 'date DESC, entity_id DESC, id DESC', '', f'{rank} AS rank'
+    # The inner sort key is an expression so the planner cannot walk the date
+    # index backwards filtering every row, which takes forever for rare terms;
+    # it fetches the slice's matches from the search index and sorts them.
+    inner_key = key.replace('date DESC', "(date + interval '0') DESC", 1)
+    columns = 'entity_id, id, date, sender_id, text' + (', search_tsv' if mode == 'fts' else '')
+    limit = f'${len(args) + 2}'
+    sql = f"""
+        SELECT entity_id, id, date, sender_id, {outer_rank}, {snippet} AS snippet
+        FROM (
+            SELECT {columns}{inner_rank}
+            FROM messages
+            WHERE {' AND '.join(where)}
+            ORDER BY {inner_key}
+            LIMIT {limit}
+        ) page
+        ORDER BY {key}
+    """
+    return sql, args
+
+
+async def _newest_date(
+    conn, entity_ids: list[int] | None, since: datetime.datetime | None, until: datetime.datetime | None
+) -> datetime.datetime | None:
+    where, args = ['deleted_at IS NULL'], []
+    if entity_ids is not None:
+        args.append(list(entity_ids))
+        where.append(f'entity_id = ANY(${len(args)}::bigint[])')
+    if since is not None:
+        args.append(since)
+        where.append(f'date >= ${len(args)}')
+    if until is not None:
+        args.append(until)
+        where.append(f'date < ${len(args)}')
+    sql = 'SELECT max(date) FROM messages WHERE ' + ' AND '.join(where)
+    return await conn.fetchval(sql, *args)
+
+
+def _date_slices(
+    since: datetime.datetime | None, until: datetime.datetime
+) -> Iterator[tuple[datetime.datetime | None, datetime.datetime]]:
+    """`[start, end)` ranges walking back from `until`, growing each time and
+    ending with one open-ended range down to `since`."""
+    end = until
+    for days in _SLICE_DAYS:
+        start = until - datetime.timedelta(days=days)
+        if since is not None and start <= since:
+            break
+        yield start, end
+        end = start
+    yield since, end
+
+
+async def search_messages(
+    query: str,
+    *,
+    mode: str = 'fts',
+    order: str | None = None,
+    entity_ids: list[int] | None = None,
+    since: datetime.datetime | None = None,
+    until: datetime.datetime | None = None,
+    limit: int = 20,
+    after: SearchCursor | None = None,
+    pool: AsyncpgPool | None = None,
+) -> SearchPage:
+    """Return one page of messages matching `query`.
+
+    `order='rank'` (the default for `fts` and `fuzzy`) returns the best
+    matches first; every match is scored, so very common terms get slow
+    without an entity or date filter. `order='date'` (always used for
+    `substring`) returns the newest matches first and searches back from
+    `until` in growing date slices, stopping as soon as the page is full.
+    `since`/`until` bound the message date (inclusive / exclusive). Pass
+    the returned `next_cursor` as `after` (with the same order) to get the
+    following page.
+    """
+    query = query.strip()
+    if not query:
+        raise ValueError('empty search query')
+    if limit < 1:
+        raise ValueError('limit must be >= 1')
+    if order is None or mode == 'substring':
+        order = 'date' if mode == 'substring' else 'rank'
+    p = pool or get_pg_pool()
+    if p is None:
+        raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+    text = _like_pattern(query) if mode == 'substring' else query
+    async with p.acquire() as conn:
+        languages = ()
+        if mode == 'fts':
+            languages = await search_languages(conn)
+            if not languages:
+                raise RuntimeError('messages.search_tsv does not exist; run the schema migrations')
+        elif mode == 'fuzzy' and not await conn.fetchval("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"):
+            raise RuntimeError('fuzzy search needs the pg_trgm extension (scripts/search.py --setup-trigram)')
+
+        if order == 'rank':
+            sql, args = build_search_query(
+                mode, languages, entity_ids=entity_ids, since=since, until=until, after=after
+            )
+            rows = await conn.fetch(sql, text, *args, limit + 1)
+        else:
+            upper = until
+            if after is not None:
+                # anything newer than the cursor was returned already
+                cursor_end = after.date + datetime.timedelta(microseconds=1)
+                upper = cursor_end if upper is None else min(upper, cursor_end)
+            # slices are measured back from the newest message in range (an index lookup)
+            newest = await _newest_date(conn, entity_ids, since, upper)
+            rows = []
+            for start, end in _date_slices(since, newest + datetime.timedelta(microseconds=1)) if newest else ():
+                sql, args = build_search_query(
+                    mode, languages, order='date', entity_ids=entity_ids, since=start, until=end, after=after
+                )
+                rows.extend(await conn.fetch(sql, text, *args, limit + 1 - len(rows)))
+                if len(rows) > limit:
+                    break
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    hits = [
+        SearchHit(
+            r['entity_id'], r['id'], r['date'], r['sender_id'], r['rank'],
+            _snippet(r['snippet'] or '') if mode != 'fts' else r['snippet'],
+        )
+        for r in rows
+    ]
+    next_cursor = None
+    if more:
+        last = hits[-1]
+        next_cursor = SearchCursor(last.rank, last.date, last.entity_id, last.id)
+    return SearchPage(hits, next_cursor)
@@ -0,0 +1,393 @@
+"""Local append-only spool for rows that could not be written to Postgres.
+
+When the database is down or too slow, `BatchSink` (given `spool=`) and
+`SpoolSink` append message rows here instead of losing them;
+`replay_spool()` (`scripts/replay_spool.py`) bulk-loads them later and
+deletes each segment once its rows are committed.
+
+A spool is a directory of segment files. Each record is a little-endian
+`u32` payload length and `u32` CRC-32 followed by the row (with its media
+metadata, if any) as compact JSON, flagged when the row came from a run
+that may advance checkpoints (an incremental run storing oldest to
+newest, i.e. a sink with `state`). Rows of newest-first runs (full
+collects, backfills, reconciliation) are not flagged: advancing to their
+ids would hide the older history they have not reached yet.
+Appends are written immediately (a crashed process loses nothing already
+appended) and fsynced in batches, at most every `sync_interval` seconds
+and when a segment is sealed, so a power failure can lose only the last
+unsynced appends. A segment is sealed when it reaches `segment_bytes` or
+the spool is closed; sealing writes a small `.idx` file next to it with
+the record count, the months covered (partitions to create) and the
+highest flagged message id per entity (checkpoints to advance). Only sealed
+segments are replayed. A segment left unsealed by a crashed writer is
+recovered on request: it is cut at the first torn or corrupt record and
+sealed.
+
+Replaying is idempotent (the same merge as `BatchSink`), so a segment
+that was loaded but not yet deleted can safely be replayed again.
+"""
+from __future__ import annotations
+import datetime
+import json
+import os
+import struct
+import time
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+from .. import metrics
+from ..normalize import content_hash
+from .batch_sink import merge_rows
+from .postgres_store import get_pg_pool
+from .schema import UNKNOWN_DATE, ensure_partitions
+from .state_store import PostgresStateStore
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+    from ..normalize import MessageRow, NormalizedMessage
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+DEFAULT_SPOOL_DIR = Path('.spool')
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+# payload length, CRC-32 of the payload
+_HEADER = struct.Struct('<II')
+
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def encode_record(row: tuple, checkpoint: bool = False) -> bytes:
+    """Frame one stored row (the 7-tuple of `batch_sink.MESSAGE_COLUMNS`,
+    optionally followed by the message's media row); `checkpoint` flags
+    rows whose ids may advance the entity's checkpoint."""
+    entity_id, mid, date, sender, text, has_media, h = row[:7]
+    fields = [entity_id, mid, date.isoformat(), sender, text, has_media, h]
+    media = row[7] if len(row) > 7 else None
+    if media is not None or checkpoint:
+        fields.append(media)
+    if checkpoint:
+        fields.append(1)
+    payload = _encode_json(fields).encode('utf-8')
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _decode_record(payload: bytes) -> tuple[tuple, bool]:
+    """The row of a record and its checkpoint flag."""
+    fields = json.loads(payload)
+    entity_id, mid, date, sender, text, has_media, h = fields[:7]
+    media = tuple(fields[7]) if len(fields) > 7 and fields[7] is not None else None
+    row = (entity_id, mid, datetime.datetime.fromisoformat(date), sender, text, has_media, h, media)
+    return row, len(fields) > 8 and bool(fields[8])
+
+
+def _decode(payload: bytes) -> tuple:
+    return _decode_record(payload)[0]
+
+
+def _scan(path: Path) -> Iterator[tuple[int, bytes]]:
+    """Yield `(end offset, payload)` of the intact records of a segment,
+    stopping at the first torn or corrupt one."""
+    pos = 0
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            size, crc = _HEADER.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size or zlib.crc32(payload) != crc:
+                return
+            pos += _HEADER.size + size
+            yield pos, payload
+
+
+def read_segment(path: str | os.PathLike) -> Iterator[tuple]:
+    """Yield the rows stored in a segment file."""
+    for _, payload in _scan(Path(path)):
+        yield _decode(payload)
+
+
+@dataclass
+class SegmentIndex:
+    """What `replay_spool` needs to know about a segment before reading it."""
+    records: int = 0
+    size: int = 0
+    # 'YYYY-MM' months of the message dates
+    months: set[str] = field(default_factory=set)
+    # highest message id per entity, of the rows flagged for checkpoints
+    marks: dict[int, int] = field(default_factory=dict)
+
+    def add(self, row: tuple, size: int, checkpoint: bool = False) -> None:
+        self.records += 1
+        self.size += size
+        date = row[2]
+        if date.tzinfo is not None:
+            date = date.astimezone(datetime.timezone.utc)
+        self.months.add(date.strftime('%Y-%m'))
+        if checkpoint and row[1] > self.marks.get(row[0], 0):
+            self.marks[row[0]] = row[1]
+
+    def month_starts(self) -> list[datetime.datetime]:
+        return [
+            datetime.datetime.strptime(m, '%Y-%m').replace(tzinfo=datetime.timezone.utc) for m in sorted(self.months)
+        ]
+
+    def dump(self) -> str:
+        return json.dumps({
+            'records': self.records,
+            'size': self.size,
+            'months': sorted(self.months),
+            'marks': {str(k): v for k, v in self.marks.items()},
+        })
+
+    @classmethod
+    def load(cls, text: str) -> 'SegmentIndex':
+        raw = json.loads(text)
+        return cls(raw['records'], raw['size'], set(raw['months']), {int(k): v for k, v in raw['marks'].items()})
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Spool:
+    """Writer for a spool directory; use as a context manager or `close()`.
+
+    Several processes may spool into the same directory: segment names
+    carry the creation time and the writer's pid.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike = DEFAULT_SPOOL_DIR,
+        *,
+        segment_bytes: int = 64 * 1024 * 1024,
+        sync_interval: float = 1.0,
+    ) -> None:
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.sync_interval = sync_interval
+        self._file = None
+        self._path: Path | None = None
+        self._index = SegmentIndex()
+        self._dirty = False
+        self._synced = time.monotonic()
+
+    def __enter__(self) -> 'Spool':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def append(self, rows: Iterable[tuple], checkpoint: bool = False) -> int:
+        """Append stored rows; returns how many were written. Pass
+        `checkpoint` only for rows of a run that stores oldest to newest
+        from its checkpoint; replaying advances checkpoints to those."""
+        rows = [r if r[2] is not None else (*r[:2], UNKNOWN_DATE, *r[3:]) for r in rows]
+        if not rows:
+            return 0
+        if self._file is None:
+            self._open()
+        index = self._index
+        chunks = []
+        for row in rows:
+            record = encode_record(row, checkpoint)
+            chunks.append(record)
+            index.add(row, len(record), checkpoint)
+        self._file.write(b''.join(chunks))
+        self._file.flush()
+        self._dirty = True
+        if index.size >= self.segment_bytes:
+            self.seal()
+        elif time.monotonic() - self._synced >= self.sync_interval:
+            self.sync()
+        return len(chunks)
+
+    def sync(self) -> None:
+        """fsync what was appended to the open segment."""
+        if self._file is not None and self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+        self._synced = time.monotonic()
+
+    def seal(self) -> None:
+        """Close the open segment and write its index, making it replayable."""
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        _write_atomic(self._path.with_suffix(INDEX_SUFFIX), self._index.dump())
+        self._file, self._path, self._index = None, None, SegmentIndex()
+
+    def close(self) -> None:
+        self.seal()
+
+    def _open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._path = self.directory / f'{time.time_ns():020d}-{os.getpid()}{SEGMENT_SUFFIX}'
+        self._file = open(self._path, 'ab')
+
+    def segments(self, recover: bool = False) -> list[Path]:
+        """Sealed segments, oldest first.
+
+        With `recover`, unsealed segments (left by a writer that crashed)
+        are truncated to their last intact record and sealed first; no
+        other process may be writing to the directory at that point.
+        """
+        if not self.directory.exists():
+            return []
+        found = []
+        for path in sorted(self.directory.glob('*' + SEGMENT_SUFFIX)):
+            if path == self._path:
+                continue
+            if not path.with_suffix(INDEX_SUFFIX).exists():
+                if not recover:
+                    continue
+                recover_segment(path)
+            found.append(path)
+        return found
+
+
+def recover_segment(path: Path) -> SegmentIndex:
+    """Cut an unsealed segment at its last intact record and seal it."""
+    index = SegmentIndex()
+    valid = 0
+    for end, payload in _scan(path):
+        row, checkpoint = _decode_record(payload)
+        index.add(row, end - valid, checkpoint)
+        valid = end
+    if valid < path.stat().st_size:
+        print(f'Warning: {path}: dropping {path.stat().st_size - valid} bytes after the last intact record')
+        with open(path, 'r+b') as f:
+            f.truncate(valid)
+            os.fsync(f.fileno())
+    _write_atomic(path.with_suffix(INDEX_SUFFIX), index.dump())
+    return index
+
+
+@dataclass
+class SpoolSinkStats:
+    rows: int = 0
+
+    def summary(self) -> str:
+        return f'{self.rows} rows spooled'
+
+
+class SpoolSink:
+    """`store_func` that appends every message to a `Spool`, for runs
+    without a database. Replay the spool into Postgres later; with
+    `checkpoint` (only for runs storing oldest to newest from a
+    checkpoint) the replay also advances the checkpoints."""
+
+    def __init__(self, spool: Spool, checkpoint: bool = False) -> None:
+        self.spool = spool
+        self.checkpoint = checkpoint
+        self.stats = SpoolSinkStats()
+
+    async def __aenter__(self) -> 'SpoolSink':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def __call__(self, m: 'NormalizedMessage') -> None:
+        if m.entity_id is None:
+            raise ValueError(f'SpoolSink: message {m.id!r} has no entity_id')
+        await self.add_rows([m.row()])
+
+    async def add_rows(self, rows: Iterable['MessageRow']) -> None:
+        n = self.spool.append(
+            (
+                (r[0], r[1], r[2] or UNKNOWN_DATE, r[3], r[4], r[5],
+                 content_hash(r[3], r[4], r[5], r[6] and r[6].file_unique_id), r[6] and r[6].row(r[0], r[1]))
+                for r in rows
+            ),
+            self.checkpoint,
+        )
+        self.stats.rows += n
+        metrics.SINK_ROWS_SPOOLED.inc(n, sink='spool')
+
+    async def close(self) -> None:
+        self.spool.close()
+
+
+@dataclass
+class ReplayResult:
+    segments: int = 0
+    rows: int = 0
+    written: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        return (
+            f'{self.segments} segments, {self.rows} rows ({self.written} written) '
+            f'in {elapsed:.1f}s ({rate:.0f} rows/s)'
+        )
+
+
+async def replay_spool(
+    pool: AsyncpgPool | None = None,
+    directory: str | os.PathLike = DEFAULT_SPOOL_DIR,
+    *,
+    recover: bool = False,
+    chunk_size: int = 5000,
+    advance_state: bool = True,
+    keep: bool = False,
+) -> ReplayResult:
+    """Load the sealed segments of a spool into `messages`, oldest first.
+
+    Each chunk of `chunk_size` rows is merged in its own transaction, so
+    memory stays bounded by the chunk size. Once all chunks of a segment
+    are committed its checkpoints (`collection_state`) are advanced, to the
+    rows flagged for it only (see `Spool.append`), and the segment is
+    deleted, unless `keep`.
+    """
+    p = pool or get_pg_pool()
+    if p is None:
+        raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+    state = PostgresStateStore(p) if advance_state else None
+    result = ReplayResult()
+    for path in Spool(directory).segments(recover=recover):
+        index = SegmentIndex.load(path.with_suffix(INDEX_SUFFIX).read_text())
+        count = 0
+        async with p.acquire() as conn:
+            await ensure_partitions(conn, index.month_starts())
+            # A segment can hold the same message more than once (it was
+            # fetched again); a merge may not touch a row twice, so each
+            # chunk is keyed like the sink buffer and the later row wins.
+            chunk: dict[tuple[int, int], tuple] = {}
+            for row in read_segment(path):
+                chunk[(row[0], row[1])] = row
+                count += 1
+                if len(chunk) >= chunk_size:
+                    async with conn.transaction():
+                        result.written += await merge_rows(conn, list(chunk.values()))
+                    chunk = {}
+            if chunk:
+                async with conn.transaction():
+                    result.written += await merge_rows(conn, list(chunk.values()))
+        if count != index.records:
+            # the rows read were merged, which is harmless; keep the segment
+            raise RuntimeError(f'{path}: index lists {index.records} records but {count} are intact')
+        if state is not None:
+            await state.advance(index.marks)
+        result.segments += 1
+        result.rows += count
+        if not keep:
+            path.unlink()
+            path.with_suffix(INDEX_SUFFIX).unlink()
+    return result
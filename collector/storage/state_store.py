@@ -0,0 +1,137 @@
+"""Per-entity collection checkpoints (high-water message ids).
+
+Two interchangeable stores are provided:
+
+- `PostgresStateStore` keeps checkpoints in the `collection_state` table.
+  It is transactional: `BatchSink` advances it inside the same transaction
+  that merges a batch, so a checkpoint never gets ahead of stored rows.
+- `FileStateStore` keeps them in a small JSON file and is used when no
+  database is available. It is advanced after the data was written.
+
+Checkpoints only move forward (`GREATEST`), so replaying an older batch is
+harmless.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Mapping
+
+from .postgres_store import get_pg_pool
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool as AsyncpgPool
+else:
+    class AsyncpgPool:  # runtime fallback for editors that evaluate symbols
+        pass
+
+
+DEFAULT_STATE_PATH = Path('.state') / 'collection_state.json'
+
+_ADVANCE = """
+INSERT INTO collection_state (entity_id, high_water_id)
+SELECT * FROM unnest($1::bigint[], $2::bigint[])
+ON CONFLICT (entity_id) DO UPDATE
+SET high_water_id = GREATEST(collection_state.high_water_id, EXCLUDED.high_water_id),
+    updated_at = now()
+"""
+
+
+class PostgresStateStore:
+    """Checkpoints stored in the `collection_state` table."""
+
+    transactional = True
+
+    def __init__(self, pool: AsyncpgPool | None = None) -> None:
+        self.pool = pool
+
+    def _pool(self) -> AsyncpgPool:
+        p = self.pool or get_pg_pool()
+        if p is None:
+            raise RuntimeError('Postgres pool not initialized; call init_pg_pool(dsn) or pass pool=')
+        return p
+
+    async def get(self, entity_id: int) -> int | None:
+        return await self._pool().fetchval(
+            'SELECT high_water_id FROM collection_state WHERE entity_id = $1', entity_id
+        )
+
+    async def get_many(self, entity_ids: Iterable[int]) -> dict[int, int]:
+        rows = await self._pool().fetch(
+            'SELECT entity_id, high_water_id FROM collection_state WHERE entity_id = ANY($1::bigint[])',
+            list(entity_ids),
+        )
+        return {r['entity_id']: r['high_water_id'] for r in rows}
+
+    async def advance(self, marks: Mapping[int, int], conn=None) -> None:
+        """Raise the checkpoints in `marks`; uses `conn` (and so its
+        transaction) when given."""
+        if not marks:
+            return
+        args = (list(marks.keys()), list(marks.values()))
+        if conn is not None:
+            await conn.execute(_ADVANCE, *args)
+        else:
+            await self._pool().execute(_ADVANCE, *args)
+
+
+class FileStateStore:
+    """Checkpoints stored in a local JSON file (written atomically)."""
+
+    transactional = False
+
+    def __init__(self, path: str | os.PathLike = DEFAULT_STATE_PATH) -> None:
+        self.path = Path(path)
+        self._lock = asyncio.Lock()
+        self._marks: dict[int, int] | None = None
+
+    def _load(self) -> dict[int, int]:
+        if self._marks is None:
+            self._marks = {}
+            if self.path.exists():
+                try:
+                    raw = json.loads(self.path.read_text())
+                    self._marks = {int(k): int(v) for k, v in raw.items()}
+                except Exception as e:
+                    print(f'Warning: failed to read {self.path}:', e)
+        return self._marks
+
+    async def get(self, entity_id: int) -> int | None:
+        return self._load().get(entity_id)
+
+    async def get_many(self, entity_ids: Iterable[int]) -> dict[int, int]:
+        marks = self._load()
+        return {e: marks[e] for e in entity_ids if e in marks}
+
+    async def advance(self, marks: Mapping[int, int], conn=None) -> None:
+        if not marks:
+            return
+        async with self._lock:
+            current = self._load()
+            for entity_id, mid in marks.items():
+                if mid > current.get(entity_id, 0):
+                    current[entity_id] = mid
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+            tmp.write_text(json.dumps({str(k): v for k, v in sorted(current.items())}, indent=2))
+            os.replace(tmp, self.path)
+
+
+StateStore = PostgresStateStore | FileStateStore
+
+
+def open_state_store(pool: AsyncpgPool | None = None, path: str | os.PathLike = DEFAULT_STATE_PATH) -> StateStore:
+    """Return a Postgres-backed store when a pool is available, else a file store."""
+    if pool is not None or get_pg_pool() is not None:
+        return PostgresStateStore(pool)
+    return FileStateStore(path)
+
+
+def high_water_marks(rows: Iterable[tuple[int, int]]) -> dict[int, int]:
+    """Return the highest message id per entity from `(entity_id, id)` pairs."""
+    marks: dict[int, int] = {}
+    for entity_id, mid in rows:
+        if mid > marks.get(entity_id, 0):
+            marks[entity_id] = mid
+    return marks
@@ -1,11 +1,44 @@
 from __future__ import annotations
-from typing import Callable, Awaitable, List, cast, AsyncIterator
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, cast, AsyncIterator
 import asyncio
+import time
 from telethon.errors import FloodWaitError
 from telethon import TelegramClient
 from telethon.tl.custom.message import Message
+from telethon.utils import get_peer_id
+from . import metrics
 from .type_annotations import Entity
 
+if TYPE_CHECKING:
+    from .ratelimit import RateLimiter
+
+# Telegram returns at most 100 messages per history request.
+MAX_PAGE_SIZE = 100
+
+
+@dataclass
+class StreamStats:
+    """Counters filled in by `stream_messages` while it runs."""
+    messages: int = 0
+    pages: int = 0
+    flood_waits: int = 0
+    flood_wait_seconds: float = 0.0
+    # time spent waiting for Telegram (excludes time the consumer held a message)
+    fetch_seconds: float = 0.0
+    # id of the last message yielded; the cursor a resumed stream starts from
+    last_id: int | None = None
+
+    def add(self, other: 'StreamStats') -> None:
+        """Fold the counters of `other` into this instance."""
+        self.messages += other.messages
+        self.pages += other.pages
+        self.flood_waits += other.flood_waits
+        self.flood_wait_seconds += other.flood_wait_seconds
+        self.fetch_seconds += other.fetch_seconds
+        if other.last_id is not None:
+            self.last_id = other.last_id
+
 
 async def stream_messages(
     client: TelegramClient,
@@ -13,33 +46,99 @@ async def stream_messages(
     *,
     resume_after_id: int | None = None,
     limit: int | None = None,
+    offset_id: int = 0,
+    min_id: int = 0,
+    max_id: int = 0,
+    page_size: int = MAX_PAGE_SIZE,
+    stats: StreamStats | None = None,
+    max_flood_wait: float | None = None,
+    rate_limiter: 'RateLimiter | None' = None,
 ) -> AsyncIterator[Message]:
     """Async generator yielding `Message` objects newest->oldest.
 
-    This generator handles `FloodWaitError` by sleeping and resuming.
+    With `resume_after_id` (an incremental run from a checkpoint) only
+    newer messages are requested: the id is passed to Telegram as `min_id`
+    so the server does the filtering, and messages come oldest->newest so
+    everything up to the last stored message is a gap-free prefix.
+
+    History is fetched one page (one request) at a time with an explicit
+    cursor. On `FloodWaitError` the generator sleeps and continues from the
+    last yielded message, so nothing is fetched or yielded twice and at
+    most `limit` messages are yielded in total. `offset_id` starts the
+    cursor somewhere other than the newest (or, when resuming, the oldest)
+    message; `max_id` excludes ids at or above it and `min_id` ids at or
+    below it. Pass a `StreamStats` to observe page and flood-wait counts. Waits longer than
+    `max_flood_wait` seconds are counted and re-raised instead of slept, so
+    the caller can move the work elsewhere and resume from `last_id`.
+    With a `rate_limiter`, one unit is acquired before every request, so
+    several streams can share a global request budget.
+
     It does not perform any storage; callers should handle persistence.
     """
+    if stats is None:
+        stats = StreamStats()
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    reverse = resume_after_id is not None
+    min_id = max(min_id, resume_after_id or 0)
+    cursor = offset_id
     count = 0
     try:
-        async for m in client.iter_messages(entity):
-            m = cast(Message, m)
-
-            mid = getattr(m, "id", None)
-            if resume_after_id is not None and mid is not None and mid <= resume_after_id:
-                break
-
-            yield m
-
-            count += 1
-            if limit is not None and count >= limit:
-                break
-
-    except FloodWaitError as e:
-        wait = int(getattr(e, 'seconds', 0)) or 60
-        print(f'FloodWaitError: sleeping for {wait}s before resuming')
-        await asyncio.sleep(wait + 1)
-        # resume and yield remaining messages
-        async for m in stream_messages(
-            client, entity, resume_after_id=resume_after_id, limit=(None if limit is None else max(0, limit - count))
-        ):
-            yield m
+        label = get_peer_id(entity)
+    except Exception:
+        label = str(entity)
+
+    while limit is None or count < limit:
+        want = page_size if limit is None else min(page_size, limit - count)
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        if reverse:
+            # Telethon starts a reverse walk at max(offset_id, min_id) and
+            # stops at `max_id` locally.
+            page = client.iter_messages(
+                entity, limit=want, offset_id=cursor, min_id=min_id, max_id=max_id, reverse=True
+            )
+        else:
+            # `offset_id` and `max_id` are both exclusive upper bounds here;
+            # pass the tighter one as the offset.
+            upper = min(x for x in (cursor, max_id) if x) if (cursor or max_id) else 0
+            page = client.iter_messages(entity, limit=want, offset_id=upper, min_id=min_id)
+
+        got = 0
+        waited = 0.0
+        it = page.__aiter__()
+        try:
+            while True:
+                t = time.perf_counter()
+                try:
+                    m = cast(Message, await it.__anext__())
+                except StopAsyncIteration:
+                    break
+                finally:
+                    waited += time.perf_counter() - t
+                got += 1
+                count += 1
+                cursor = m.id
+                stats.messages += 1
+                stats.last_id = m.id
+                yield m
+        except FloodWaitError as e:
+            wait = max(0, int(e.seconds))
+            stats.flood_waits += 1
+            stats.fetch_seconds += waited
+            metrics.FLOOD_WAITS.inc()
+            metrics.FLOOD_WAIT_SECONDS.inc(wait)
+            if max_flood_wait is not None and wait > max_flood_wait:
+                raise
+            stats.flood_wait_seconds += wait + 1
+            print(f'FloodWaitError: sleeping for {wait}s before resuming after id {cursor}')
+            await asyncio.sleep(wait + 1)
+            continue
+        finally:
+            # also counts a page the consumer stopped reading part-way
+            metrics.MESSAGES_FETCHED.inc(got, entity=label)
+
+        stats.pages += 1
+        stats.fetch_seconds += waited
+        metrics.PAGE_FETCH_SECONDS.observe(waited)
+        if got < want:
+            break
@@ -0,0 +1,155 @@
+"""Long-running tail of the configured targets.
+
+Instead of polling every channel, `tail_targets` subscribes to new-message
+and edit events for the given entities and hands each message to the sink
+as it arrives. Events are queued by the Telethon handlers and processed in
+arrival order by a single consumer task, so the sink sees messages in the
+same order a normal incremental run would.
+
+Updates can be missed (while disconnected, or when Telegram drops them),
+so the tail repairs gaps through `stream_messages`:
+
+- When a channel message arrives whose id is not the successor of the
+  last one seen for that channel, the missing range is fetched (bounded by
+  `min_id`/`max_id`) before the new message is stored. Deleted messages
+  also leave holes, so such a fetch may legitimately return nothing.
+- When the client reconnects, every entity is caught up from the last id
+  seen for it.
+- With a `state` store, the tail starts by catching up from the stored
+  checkpoints.
+"""
+from __future__ import annotations
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable
+
+from telethon import TelegramClient, events
+from telethon.tl import types
+from telethon.utils import get_peer_id
+
+from .consumer import process_message
+from .storage import print_store
+from .storage.state_store import StateStore
+from .stream import stream_messages
+from .type_annotations import Entity
+
+
+@dataclass
+class TailStats:
+    new: int = 0
+    edited: int = 0
+    skipped: int = 0
+    failed: int = 0
+    gaps: int = 0
+    backfilled: int = 0
+    reconnects: int = 0
+
+    def summary(self) -> str:
+        return (
+            f'{self.new} new, {self.edited} edited, {self.skipped} skipped, {self.failed} failed, '
+            f'{self.gaps} gaps ({self.backfilled} messages backfilled), {self.reconnects} reconnects'
+        )
+
+
+# Queue item asking the consumer to catch every entity up (after a reconnect).
+_CATCH_UP = object()
+
+
+async def tail_targets(
+    client: TelegramClient,
+    entities: Iterable[Entity],
+    store_func: Callable[[Any], Awaitable[None]] = print_store,
+    *,
+    state: StateStore | None = None,
+    stop: asyncio.Event | None = None,
+    watchdog_interval: float = 5.0,
+    stats: TailStats | None = None,
+) -> TailStats:
+    """Stream new and edited messages of `entities` into `store_func`.
+
+    Runs until `stop` is set or the task is cancelled.
+    """
+    if stats is None:
+        stats = TailStats()
+    by_id: dict[int, Entity] = {get_peer_id(e): e for e in entities}
+    last_seen: dict[int, int] = {}
+    if state is not None:
+        last_seen.update(await state.get_many(by_id))
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def on_new(event) -> None:
+        queue.put_nowait(('new', event.message))
+
+    async def on_edit(event) -> None:
+        queue.put_nowait(('edit', event.message))
+
+    async def backfill(entity_id: int, after_id: int, before_id: int = 0) -> None:
+        """Store messages of `entity_id` with after_id < id < before_id."""
+        async for m in stream_messages(client, by_id[entity_id], resume_after_id=after_id, max_id=before_id):
+            outcome = await process_message(m, store_func)
+            if outcome == 'ok':
+                stats.backfilled += 1
+            elif outcome == 'failed':
+                stats.failed += 1
+            last_seen[entity_id] = max(last_seen.get(entity_id, 0), m.id)
+
+    async def catch_up() -> None:
+        for entity_id, after_id in list(last_seen.items()):
+            await backfill(entity_id, after_id)
+
+    async def consume() -> None:
+        await catch_up()
+        while True:
+            item = await queue.get()
+            if item is _CATCH_UP:
+                await catch_up()
+                continue
+            kind, m = item
+            entity_id = m.chat_id
+            if kind == 'edit':
+                stats.edited += 1
+            else:
+                stats.new += 1
+                last = last_seen.get(entity_id)
+                # Only channel ids are sequential per chat; elsewhere ids are
+                # shared across the account and holes are normal.
+                if last is not None and m.id > last + 1 and isinstance(m.peer_id, types.PeerChannel):
+                    stats.gaps += 1
+                    await backfill(entity_id, last, m.id)
+                last_seen[entity_id] = max(last_seen.get(entity_id, 0), m.id)
+            outcome = await process_message(m, store_func)
+            if outcome == 'skipped':
+                stats.skipped += 1
+            elif outcome == 'failed':
+                stats.failed += 1
+
+    async def watchdog() -> None:
+        connected = client.is_connected()
+        while True:
+            await asyncio.sleep(watchdog_interval)
+            now = client.is_connected()
+            if now and not connected:
+                stats.reconnects += 1
+                queue.put_nowait(_CATCH_UP)
+            connected = now
+
+    chats = list(by_id.values())
+    new_filter = events.NewMessage(chats=chats)
+    edit_filter = events.MessageEdited(chats=chats)
+    client.add_event_handler(on_new, new_filter)
+    client.add_event_handler(on_edit, edit_filter)
+    tasks = [asyncio.create_task(consume()), asyncio.create_task(watchdog())]
+    if stop is not None:
+        tasks.append(asyncio.create_task(stop.wait()))
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for t in done:
+            if t.exception() is not None:
+                raise t.exception()
+    finally:
+        client.remove_event_handler(on_new, new_filter)
+        client.remove_event_handler(on_edit, edit_filter)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return stats
@@ -0,0 +1,267 @@
+"""Run collection jobs from the Postgres queue (`storage.job_store`).
+
+Any number of workers, in one process or on many hosts, share one
+`collection_jobs` table. Each worker claims the most urgent ready job,
+runs it and reports the outcome:
+
+- `fetch` jobs collect the target incrementally through
+  `consume_messages` (option `limit` caps the messages per run);
+- `backfill` jobs run `backfill` (options `segments`, `concurrency`), which
+  resumes from the plan saved in `progress`.
+
+While a job runs its lease is renewed every `heartbeat` seconds; if the
+lease was lost anyway (the worker stalled and another one took the job
+over) the job is cancelled here. Errors retry the job with exponential
+backoff until it runs out of attempts. A flood wait longer than
+`max_flood_wait` puts the job back without using an attempt, due when the
+wait ends, and this worker claims nothing until then: flood waits apply to
+the whole account.
+"""
+from __future__ import annotations
+import asyncio
+import os
+import random
+import socket
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+from .backfill import backfill
+from .consumer import consume_messages
+from .entity_cache import EntityCache
+from .ratelimit import RateLimiter
+from .resolve import resolve
+from .storage.backfill_store import BackfillStore
+from .storage.job_store import Job, JobQueue
+from .storage.state_store import StateStore
+
+
+@dataclass
+class WorkerStats:
+    """Counters of one `run_worker` call."""
+    claimed: int = 0
+    done: int = 0
+    retried: int = 0
+    rescheduled: int = 0
+    failed: int = 0
+    lost: int = 0
+    messages: int = 0
+
+    def summary(self) -> str:
+        return (
+            f'{self.claimed} jobs claimed: {self.done} done, {self.retried} retried, '
+            f'{self.rescheduled} rescheduled, {self.failed} failed, {self.lost} leases lost; '
+            f'{self.messages} messages'
+        )
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def retry_delay(attempt: int, base: float = 30.0, cap: float = 3600.0) -> float:
+    """Backoff before retrying a job that failed on its `attempt`-th run:
+    `base` doubling per attempt up to `cap`, with jitter so jobs that
+    failed together do not retry together."""
+    delay = min(cap, base * 2 ** max(0, attempt - 1))
+    return delay * random.uniform(0.75, 1.25)
+
+
+class UnresolvedTarget(Exception):
+    """The job's target does not resolve to an entity; retrying will not help."""
+
+
+async def run_job(
+    client: TelegramClient,
+    job: Job,
+    store_func: Callable[[Any], Awaitable[None]],
+    *,
+    state: StateStore | None = None,
+    progress: BackfillStore | None = None,
+    entity_cache: EntityCache | None = None,
+    max_flood_wait: float | None = 30.0,
+    rate_limiter: RateLimiter | None = None,
+) -> int:
+    """Run one job and return the number of messages stored.
+
+    Raises `UnresolvedTarget` when the target cannot be resolved and
+    whatever the collection raised otherwise. Buffered rows are flushed
+    before it returns, so a completed job's messages are stored.
+    """
+    entity = await resolve(client, job.target, cache=entity_cache)
+    if entity is None:
+        raise UnresolvedTarget(f'could not resolve target {job.target!r}')
+    if job.kind == 'fetch':
+        count = await consume_messages(
+            client,
+            entity,
+            store_func,
+            limit=job.options.get('limit'),
+            state=state,
+            max_flood_wait=max_flood_wait,
+            raise_errors=True,
+        )
+    elif job.kind == 'backfill':
+        if progress is None:
+            raise RuntimeError('backfill jobs need a progress store')
+        result = await backfill(
+            client,
+            entity,
+            store_func,
+            progress=progress,
+            segments=job.options.get('segments', 8),
+            concurrency=job.options.get('concurrency', 4),
+            rate_limiter=rate_limiter,
+        )
+        if not result.done:
+            raise RuntimeError(f'backfill incomplete: {result.summary()}')
+        count = result.messages
+    else:
+        raise ValueError(f'unknown job kind {job.kind!r}')
+    flush = getattr(store_func, 'flush', None)
+    if flush is not None:
+        await flush()
+    return count
+
+
+async def run_worker(
+    client: TelegramClient,
+    queue: JobQueue,
+    store_func: Callable[[Any], Awaitable[None]],
+    *,
+    worker_id: str | None = None,
+    kinds: Iterable[str] | None = None,
+    concurrency: int = 1,
+    state: StateStore | None = None,
+    progress: BackfillStore | None = None,
+    entity_cache: EntityCache | None = None,
+    lease: float = 120.0,
+    heartbeat: float | None = None,
+    poll_interval: float = 5.0,
+    max_flood_wait: float | None = 30.0,
+    rate_limiter: RateLimiter | None = None,
+    retry_base: float = 30.0,
+    exit_when_idle: bool = False,
+    stats: WorkerStats | None = None,
+) -> WorkerStats:
+    """Claim and run jobs from `queue` until cancelled.
+
+    Up to `concurrency` jobs run at once on `client`. With `exit_when_idle`
+    it returns once no job is ready instead of polling every
+    `poll_interval` seconds. When cancelled, running jobs are put back in
+    the queue (without using an attempt) so another worker can take them
+    at once.
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be >= 1')
+    worker_id = worker_id or default_worker_id()
+    kinds = list(kinds) if kinds is not None else None
+    heartbeat = heartbeat or lease / 3
+    if stats is None:
+        stats = WorkerStats()
+    # flood waits apply to the whole account: claim nothing until this time
+    paused_until = 0.0
+
+    async def keep_lease(job: Job, task: asyncio.Task, lost: asyncio.Event) -> None:
+        while True:
+            await asyncio.sleep(heartbeat)
+            try:
+                held = await queue.heartbeat(job, lease)
+            except Exception as e:
+                # the lease may still be valid; try again at the next beat
+                print(f'Warning: heartbeat for job {job.id} failed: {e!r}')
+                continue
+            if not held:
+                lost.set()
+                task.cancel()
+                return
+
+    async def run(job: Job) -> None:
+        nonlocal paused_until
+        label = f'Job {job.id} ({job.kind} {job.target})'
+        task = asyncio.create_task(run_job(
+            client,
+            job,
+            store_func,
+            state=state,
+            progress=progress,
+            entity_cache=entity_cache,
+            max_flood_wait=max_flood_wait,
+            rate_limiter=rate_limiter,
+        ))
+        lost = asyncio.Event()
+        keeper = asyncio.create_task(keep_lease(job, task, lost))
+        try:
+            messages = await task
+        except asyncio.CancelledError:
+            if lost.is_set():
+                print(f'{label}: lease lost to another worker')
+                stats.lost += 1
+                return
+            # shutting down: hand the job back right away
+            await asyncio.gather(task, return_exceptions=True)
+            await queue.reschedule(job, 0, 'worker stopped')
+            raise
+        except FloodWaitError as e:
+            wait = max(0, int(e.seconds))
+            paused_until = max(paused_until, time.monotonic() + wait)
+            if await queue.reschedule(job, wait + 1, f'flood wait {wait}s'):
+                stats.rescheduled += 1
+            print(f'{label}: flood wait {wait}s, rescheduled')
+            return
+        except UnresolvedTarget as e:
+            if await queue.fail(job, str(e)):
+                stats.failed += 1
+            print(f'{label}: failed: {e}')
+            return
+        except Exception as e:
+            if job.last_attempt:
+                stats.failed += 1
+                print(f'{label}: failed after {job.attempts} attempts: {e!r}')
+            else:
+                stats.retried += 1
+                print(f'{label}: attempt {job.attempts} failed: {e!r}')
+            await queue.retry(job, repr(e), retry_delay(job.attempts, retry_base))
+            return
+        finally:
+            keeper.cancel()
+            await asyncio.gather(keeper, return_exceptions=True)
+        stats.messages += messages
+        if await queue.complete(job, messages):
+            stats.done += 1
+            print(f'{label}: done, {messages} messages')
+        else:
+            stats.lost += 1
+            print(f'{label}: finished after its lease was lost, {messages} messages')
+
+    async def slot() -> None:
+        while True:
+            pause = paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            try:
+                job = await queue.claim(worker_id, kinds=kinds, lease=lease)
+                if job is not None:
+                    stats.claimed += 1
+                    await run(job)
+                    continue
+            except Exception as e:
+                # the database is unreachable; expired leases return the job later
+                print(f'Warning: job queue error: {e!r}')
+            else:
+                if exit_when_idle:
+                    return
+            await asyncio.sleep(poll_interval)
+
+    slots = [asyncio.create_task(slot()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*slots)
+    finally:
+        # Slots only end by returning or by being cancelled with the gather;
+        # wait for them to hand their jobs back, without cancelling again.
+        await asyncio.gather(*slots, return_exceptions=True)
+    return stats
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Send a job to a running `collectord.py` and print its progress and result.
+
+Only uses the standard library, so it starts in milliseconds; the daemon
+holds the Telegram client and the database pool.
+
+Usage:
+    .venv/bin/python collectorctl.py collect @channel --limit 1000
+    .venv/bin/python collectorctl.py backfill @bigchannel --segments 8 --detach
+    .venv/bin/python collectorctl.py reconcile @channel --last 500
+    .venv/bin/python collectorctl.py tail
+    .venv/bin/python collectorctl.py status
+    .venv/bin/python collectorctl.py cancel 3
+"""
+from __future__ import annotations
+import argparse
+import json
+import socket
+import sys
+
+# Same default as `collector.daemon.DEFAULT_SOCKET_PATH` (not imported, to
+# keep this client free of the collector's dependencies).
+DEFAULT_SOCKET_PATH = '.state/collector.sock'
+
+
+def format_job(job: dict) -> str:
+    line = f'job {job["id"]} {job["op"]}'
+    if job.get('target'):
+        line += f' {job["target"]}'
+    line += f': {job["status"]} {job["elapsed"]:.1f}s'
+    progress = job.get('progress')
+    if progress:
+        line += ', ' + ', '.join(f'{v} {k}' for k, v in progress.items())
+    if job.get('result'):
+        line += f' -> {job["result"].get("summary")}'
+    if job.get('error'):
+        line += f' ({job["error"]})'
+    return line
+
+
+def request(path: str, payload: dict) -> int:
+    """Send `payload` and print the replies; returns the exit code."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except OSError as e:
+            print(f'Cannot connect to the daemon at {path}: {e} (is collectord.py running?)')
+            return 2
+        s.sendall(json.dumps(payload).encode() + b'\n')
+        code = 0
+        # `accepted` is the last reply only for detached jobs and tails
+        last = ('accepted',) if payload.get('detach') or payload['op'] == 'tail' else ()
+        finished = False
+        for line in s.makefile('r', encoding='utf-8'):
+            reply = json.loads(line)
+            event = reply.pop('event')
+            finished = event not in ('accepted', 'progress') or event in last
+            if event == 'error':
+                print('Error:', reply['error'])
+                code = 1
+            elif event in ('status', 'shutdown'):
+                print(f'uptime {reply["uptime"]:.0f}s, {reply["running"]} jobs running; sink: {reply["sink"]}')
+                for job in reply['jobs']:
+                    print(' ', format_job(job))
+            else:
+                print(format_job(reply['job']))
+                if event == 'done' and reply['job']['status'] != 'done':
+                    code = 1
+        if not finished:
+            print('Error: the daemon closed the connection before answering')
+            return 1
+        return code
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Control a running collector daemon')
+    p.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='Unix socket of the daemon')
+    sub = p.add_subparsers(dest='op', required=True)
+
+    c = sub.add_parser('collect', help='collect a target (incrementally from its checkpoint)')
+    c.add_argument('target')
+    c.add_argument('--limit', type=int, help='maximum number of messages')
+    c.add_argument('--full', action='store_true', help='ignore the stored checkpoint')
+    b = sub.add_parser('backfill', help='backfill the full history of a target')
+    b.add_argument('target')
+    b.add_argument('--segments', type=int, default=8)
+    b.add_argument('--concurrency', type=int, default=4)
+    b.add_argument('--restart', action='store_true', help='discard saved progress and plan again')
+    r = sub.add_parser('reconcile', help='find edited and deleted messages in a recent window')
+    r.add_argument('target')
+    window = r.add_mutually_exclusive_group(required=True)
+    window.add_argument('--last', type=int, help='re-check the newest N messages')
+    window.add_argument('--days', type=float, help='re-check the messages of the last D days')
+    t = sub.add_parser('tail', help='start tailing targets (default: config.json) until cancelled')
+    t.add_argument('targets', nargs='*')
+    for job_parser in (c, b, r):
+        job_parser.add_argument('--detach', action='store_true', help='return once the job is accepted')
+    sub.add_parser('status', help='show running and recent jobs')
+    x = sub.add_parser('cancel', help='cancel a job')
+    x.add_argument('job', type=int)
+    sub.add_parser('shutdown', help='stop the daemon')
+    args = p.parse_args()
+
+    payload: dict = {'op': args.op}
+    if args.op == 'collect':
+        payload.update(target=args.target, limit=args.limit, incremental=not args.full)
+    elif args.op == 'backfill':
+        payload.update(target=args.target, segments=args.segments, concurrency=args.concurrency,
+                       restart=args.restart)
+    elif args.op == 'reconcile':
+        payload.update(target=args.target, last=args.last, days=args.days)
+    elif args.op == 'tail':
+        payload.update(targets=args.targets)
+    elif args.op == 'cancel':
+        payload.update(job=args.job)
+    if getattr(args, 'detach', False):
+        payload['detach'] = True
+    sys.exit(request(args.socket, payload))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Run the collector as a daemon that takes jobs on a local Unix socket.
+
+Connects the client and the Postgres pool once and keeps them warm; send
+jobs with `collectorctl.py`. Stop it with Ctrl+C or `collectorctl.py
+shutdown`; running jobs are cancelled and buffered messages flushed.
+
+Usage:
+    .venv/bin/python collectord.py --pg-dsn "postgresql://..."
+    .venv/bin/python collectorctl.py collect @channel
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+
+import os
+import collector
+from collector.daemon import DEFAULT_SOCKET_PATH
+
+
+async def main(
+    session: str = 'session',
+    pg_dsn: str | None = None,
+    socket_path: str = str(DEFAULT_SOCKET_PATH),
+    max_flood_wait: float = 30.0,
+    rate: float = 5.0,
+    metrics_port: int | None = None,
+    spool_dir: str = '.spool',
+    archive_raw: bool = False,
+) -> int:
+    # Prefer explicit PG DSN (CLI) then environment variable `PG_DSN`.
+    if not pg_dsn:
+        pg_dsn = os.getenv('PG_DSN')
+    if not pg_dsn:
+        print('PG_DSN not set (pass --pg-dsn or set PG_DSN env)')
+        return 2
+
+    api_id, api_hash = collector.get_api_credentials()
+    async with collector.serve_metrics(metrics_port), collector.create_client(session, api_id, api_hash) as client:
+        async with collector.pg_pool_context(pg_dsn) as pool:
+            state = collector.open_state_store(pool)
+            # batches go to the local spool while the database is unavailable
+            with collector.Spool(spool_dir) as spool, collector.EntityCache.for_session(session) as cache:
+                # Only the tail (oldest to newest) may advance checkpoints
+                # with every batch; see CollectorDaemon.
+                async with collector.BatchSink(
+                    pool, spool=spool, write_timeout=30.0, archive_raw=archive_raw
+                ) as sink, collector.BatchSink(
+                    pool, state=state, flush_interval=0.5, spool=spool, write_timeout=30.0, archive_raw=archive_raw
+                ) as tail_sink:
+                    daemon = collector.CollectorDaemon(
+                        client,
+                        sink,
+                        tail_sink=tail_sink,
+                        pool=pool,
+                        state=state,
+                        progress=collector.open_backfill_store(pool),
+                        entity_cache=cache,
+                        rate_limiter=collector.RateLimiter(rate),
+                        max_flood_wait=max_flood_wait,
+                    )
+                    try:
+                        await daemon.serve(socket_path)
+                    except asyncio.CancelledError:
+                        pass
+            print('Sink:', sink.stats.summary())
+    print(collector.metrics.format_summary())
+    return 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Run the collector daemon')
+    p.add_argument('--session', default='session', help='session filename prefix')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN to write messages (overrides PG_DSN env)')
+    p.add_argument('--socket', dest='socket_path', default=str(DEFAULT_SOCKET_PATH),
+                   help='Unix socket to accept jobs on')
+    p.add_argument('--max-flood-wait', type=float, default=30.0,
+                   help='fail a job instead of sleeping through longer flood waits')
+    p.add_argument('--rate', type=float, default=5.0, help='limit on backfill/reconcile requests per second')
+    p.add_argument('--archive-raw', action='store_true',
+                   help="also archive each message's raw payload, compressed (see storage.raw_archive)")
+    p.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port while running')
+    p.add_argument('--spool-dir', default='.spool',
+                   help='where to spool messages while Postgres is unavailable (see scripts/replay_spool.py)')
+    args = p.parse_args()
+    try:
+        raise SystemExit(asyncio.run(main(
+            session=args.session,
+            pg_dsn=args.pg_dsn,
+            socket_path=args.socket_path,
+            max_flood_wait=args.max_flood_wait,
+            rate=args.rate,
+            metrics_port=args.metrics_port,
+            spool_dir=args.spool_dir,
+            archive_raw=args.archive_raw,
+        )))
+    except KeyboardInterrupt:
+        raise SystemExit(0)
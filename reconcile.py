@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Re-check recent messages of targets for edits and deletions.
+
+Re-fetches a window per target (the newest `--last` messages or the last
+`--days` days), stores the messages that changed and marks the ones
+deleted on the server. Needs Postgres, since it compares with the stored
+rows. Targets default to every entry of `config.json`.
+
+Usage:
+    .venv/Scripts/python reconcile.py --last 500 --pg-dsn "postgresql://..."
+    .venv/Scripts/python reconcile.py @channel --days 3
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+
+import os
+import collector
+
+
+async def main(
+    targets: list[str],
+    session: str = 'session',
+    pg_dsn: str | None = None,
+    last: int | None = None,
+    days: float | None = None,
+    rate: float = 5.0,
+    metrics_json: str | None = None,
+) -> int:
+    targets = targets or collector.load_config()
+    if not targets:
+        print('No targets given or in config.json')
+        return 2
+    # Prefer explicit PG DSN (CLI) then environment variable `PG_DSN`.
+    if not pg_dsn:
+        pg_dsn = os.getenv('PG_DSN')
+    if not pg_dsn:
+        print('Reconciliation compares with stored messages; pass --pg-dsn or set PG_DSN')
+        return 2
+
+    api_id, api_hash = collector.get_api_credentials()
+    failed = 0
+    results = []
+    async with collector.create_client(session, api_id, api_hash) as client, \
+            collector.pg_pool_context(pg_dsn) as pool:
+        limiter = collector.RateLimiter(rate)
+        # no checkpoint store: the window is read newest first
+        async with collector.BatchSink(pool) as sink:
+            with collector.EntityCache.for_session(session) as cache:
+                for t in targets:
+                    entity = await collector.resolve(client, t, cache=cache)
+                    if entity is None:
+                        print('Could not resolve target:', t)
+                        failed += 1
+                        continue
+                    try:
+                        result = await collector.reconcile(
+                            client, entity, sink, last=last, days=days, pool=pool, rate_limiter=limiter
+                        )
+                    except Exception as e:
+                        print(f'{t}: reconciliation failed: {e!r}')
+                        failed += 1
+                        continue
+                    print(result.summary())
+                    results.append(result)
+        print('Sink:', sink.stats.summary())
+    edited = sum(r.edited for r in results)
+    deleted = sum(r.deleted for r in results)
+    print(f'{len(results)}/{len(targets)} targets reconciled: {edited} edited, {deleted} deleted')
+    if metrics_json:
+        collector.metrics.write_snapshot(metrics_json)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Find edited and deleted messages in a recent window')
+    p.add_argument('targets', nargs='*', help='channel usernames or numeric ids (default: config.json)')
+    window = p.add_mutually_exclusive_group(required=True)
+    window.add_argument('--last', type=int, help='re-check the newest N messages of each target')
+    window.add_argument('--days', type=float, help='re-check the messages of the last D days')
+    p.add_argument('--session', default='session', help='session filename prefix')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN (overrides PG_DSN env)')
+    p.add_argument('--rate', type=float, default=5.0, help='limit on Telegram requests per second')
+    p.add_argument('--metrics-json', help='write the end-of-run metrics snapshot to this JSON file')
+    args = p.parse_args()
+    raise SystemExit(asyncio.run(main(
+        args.targets,
+        session=args.session,
+        pg_dsn=args.pg_dsn,
+        last=args.last,
+        days=args.days,
+        rate=args.rate,
+        metrics_json=args.metrics_json,
+    )))
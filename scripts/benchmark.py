@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""Offline benchmark of the collection path (no Telegram account needed).
+
+A fake client serves synthetic messages through `iter_messages` /
+`get_entity` the way Telethon does: one `iter_messages` call is split into
+"server pages" of `--page-size` messages, each costing `--latency` seconds,
+and every `--flood-every`-th request raises `FloodWaitError`. Messages go
+through `consume_messages` (`--mode pipeline`: `run_pipeline`; `--mode
+batch`: pages through `process_batch` / `normalize_batch`) into one of the
+sinks:
+
+- `null`      discard normalized messages
+- `print`     `print_store` (output sent to /dev/null)
+- `postgres`  `BatchSink` (needs `--pg-dsn` / `PG_DSN`)
+- `pg-rows`   row-at-a-time `postgres_store` (needs a DSN)
+
+Postgres runs write to the `messages` table under a synthetic entity id
+whose rows are deleted before the run.
+
+`--mode normalize` skips the sinks and measures only the CPU time and
+retained memory per message of `normalize_message` and `normalize_batch`.
+
+Per-message latency runs from the moment the fake client produces a
+message until it is stored: for `BatchSink` that is the end of the flush
+that wrote it. The result is one JSON object on stdout (and appended to
+`--output` as a JSON line), so runs can be compared with `jq` or a diff.
+
+Usage:
+  python scripts/benchmark.py --messages 20000 --sink null
+  python scripts/benchmark.py --messages 20000 --sink postgres --latency 0.05 --flood-every 50
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Ensure project root is on sys.path so imports work when running from `scripts/`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import PeerChannel
+
+import collector
+from collector.consumer import process_batch
+from collector.normalize import normalize_batch, normalize_message
+from collector.stream import MAX_PAGE_SIZE
+
+
+# Marked ids of channels are -100<channel id>.
+_CHANNEL_ID = 1_999_999_999
+ENTITY_ID = -1_000_000_000_000 - _CHANNEL_ID
+_EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+_TEXT = ('lorem ipsum dolor sit amet, consectetur adipiscing elit; ' * 200)
+
+
+class FakeMessage:
+    """The subset of `telethon.tl.custom.Message` the collector reads."""
+    __slots__ = ('id', 'chat_id', 'peer_id', 'sender_id', 'date', 'text', 'media', 'created')
+
+    def __init__(self, mid: int, text: str, media: bool) -> None:
+        self.id = mid
+        self.chat_id = ENTITY_ID
+        self.peer_id = PeerChannel(_CHANNEL_ID)
+        self.sender_id = ENTITY_ID
+        self.date = _EPOCH + datetime.timedelta(seconds=mid * 37)
+        self.text = text
+        self.media = object() if media else None
+        self.created = 0.0
+
+
+class FakeClient:
+    """Serves `total` synthetic messages of one channel."""
+
+    def __init__(
+        self,
+        total: int,
+        *,
+        page_size: int = 100,
+        latency: float = 0.0,
+        text_mean: int = 200,
+        text_dist: str = 'lognormal',
+        media_ratio: float = 0.2,
+        flood_every: int = 0,
+        flood_seconds: int = 1,
+        seed: int = 0,
+    ) -> None:
+        self.total = total
+        self.page_size = max(1, page_size)
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.requests = 0
+        # Messages are generated up front so the fake costs nothing per message.
+        rng = random.Random(seed)
+        self._texts = [self._text(rng, text_dist, text_mean) for _ in range(min(total, 4096))]
+        self._media = [rng.random() < media_ratio for _ in range(min(total, 4096))]
+        # creation time of messages handed out and not yet stored, by id
+        self.created: dict[int, float] = {}
+
+    @staticmethod
+    def _text(rng: random.Random, dist: str, mean: int) -> str:
+        if dist == 'fixed':
+            n = mean
+        elif dist == 'uniform':
+            n = rng.randint(0, 2 * mean)
+        else:
+            n = int(rng.lognormvariate(0, 1) * mean / 1.6487)  # E[lognormal(0, 1)] = e^0.5
+        return (_TEXT * (n // len(_TEXT) + 1))[:n]
+
+    async def get_entity(self, target: Any) -> PeerChannel:
+        return PeerChannel(_CHANNEL_ID)
+
+    async def iter_messages(
+        self, entity, limit=None, offset_id=0, min_id=0, max_id=0, reverse=False, **kwargs
+    ):
+        if reverse:
+            start = max(offset_id, min_id) + 1
+            stop = min(max_id, self.total + 1) if max_id else self.total + 1
+            ids = range(start, stop)
+        else:
+            top = min(x for x in (offset_id, max_id, self.total + 1) if x) - 1
+            ids = range(top, min_id, -1)
+        if limit is not None:
+            ids = ids[:limit]
+        for i in range(0, len(ids), self.page_size):
+            self.requests += 1
+            if self.flood_every and self.requests % self.flood_every == 0:
+                raise FloodWaitError(request=None, capture=self.flood_seconds)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            for mid in ids[i:i + self.page_size]:
+                k = mid % len(self._texts)
+                m = FakeMessage(mid, self._texts[k], self._media[k])
+                m.created = time.perf_counter()
+                self.created[mid] = m.created
+                yield m
+
+
+class NullSink:
+    async def __call__(self, m: Any) -> None:
+        pass
+
+    async def add_rows(self, rows) -> None:
+        pass
+
+
+class TimedSink:
+    """Wraps a sink and records per-message latency until the write landed.
+
+    Sinks with a `stats.flushes` counter (`BatchSink`) only count a message
+    as stored once a flush has completed after it was handed over.
+    """
+
+    def __init__(self, inner, client: FakeClient) -> None:
+        self.inner = inner
+        self.client = client
+        self.pending: list[float] = []
+        self.latencies: list[float] = []
+        stats = getattr(inner, 'stats', None)
+        self._flushes = getattr(stats, 'flushes', None)
+        # only offer the row fast path when the wrapped sink has it
+        if hasattr(inner, 'add_rows'):
+            self.add_rows = self._add_rows
+
+    def drain(self) -> None:
+        now = time.perf_counter()
+        self.latencies.extend(now - t for t in self.pending)
+        self.pending.clear()
+
+    async def __call__(self, m: Any) -> None:
+        self.pending.append(self.client.created.pop(m.id, time.perf_counter()))
+        await self.inner(m)
+        self._check()
+
+    async def _add_rows(self, rows) -> None:
+        created = self.client.created
+        now = time.perf_counter()
+        self.pending.extend(created.pop(r[1], now) for r in rows)
+        await self.inner.add_rows(rows)
+        self._check()
+
+    def _check(self) -> None:
+        if self._flushes is None:
+            self.drain()
+        elif self.inner.stats.flushes != self._flushes:
+            self._flushes = self.inner.stats.flushes
+            self.drain()
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def peak_rss_kb() -> int | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+async def run_once(client: FakeClient, sink: Any, mode: str, limit: int) -> dict[str, Any]:
+    entity = await client.get_entity(ENTITY_ID)
+    timed = TimedSink(sink, client)
+    stream = collector.StreamStats()
+    started = time.perf_counter()
+    if mode == 'pipeline':
+        pstats = await collector.run_pipeline(client, entity, timed, limit=limit)
+        stored, stream = pstats.stored, pstats.stream
+    elif mode == 'batch':
+        stored = 0
+        page: list = []
+        async for m in collector.stream_messages(client, entity, limit=limit, stats=stream):
+            page.append(m)
+            if len(page) >= MAX_PAGE_SIZE:
+                stored += await process_batch(page, timed)
+                page = []
+        if page:
+            stored += await process_batch(page, timed)
+    else:
+        stored = await collector.consume_messages(client, entity, timed, limit=limit, stats=stream)
+    close = getattr(sink, 'close', None)
+    if close is not None:
+        await close()
+    timed.drain()
+    elapsed = time.perf_counter() - started
+    p50, p99 = percentile(timed.latencies, 0.5), percentile(timed.latencies, 0.99)
+    return {
+        'messages': stored,
+        'elapsed_s': round(elapsed, 4),
+        'msgs_per_sec': round(stored / elapsed, 1) if elapsed > 0 else None,
+        'latency_ms': {
+            'p50': None if p50 is None else round(p50 * 1000, 3),
+            'p99': None if p99 is None else round(p99 * 1000, 3),
+        },
+        'requests': client.requests,
+        'pages': stream.pages,
+        'flood_waits': stream.flood_waits,
+        'flood_wait_seconds': stream.flood_wait_seconds,
+    }
+
+
+async def run_normalize(client: FakeClient, limit: int) -> dict[str, Any]:
+    entity = await client.get_entity(ENTITY_ID)
+    messages = [m async for m in client.iter_messages(entity, limit=limit)]
+    result: dict[str, Any] = {'messages': len(messages)}
+    for name, fn in (
+        ('normalize_message', lambda: [normalize_message(m) for m in messages]),
+        ('normalize_batch', lambda: normalize_batch(messages)),
+    ):
+        best = None
+        for _ in range(3):
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        tracemalloc.start()
+        kept = fn()
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        result[name] = {
+            'us_per_msg': round(best / len(messages) * 1e6, 3) if messages else None,
+            'retained_bytes_per_msg': round(retained / len(messages), 1) if messages else None,
+        }
+    return result
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    client = FakeClient(
+        args.messages,
+        page_size=args.page_size,
+        latency=args.latency,
+        text_mean=args.text_mean,
+        text_dist=args.text_dist,
+        media_ratio=args.media_ratio,
+        flood_every=args.flood_every,
+        flood_seconds=args.flood_seconds,
+        seed=args.seed,
+    )
+    devnull = open(os.devnull, 'w')
+    try:
+        if args.mode == 'normalize':
+            with contextlib.redirect_stdout(devnull):
+                result = await run_normalize(client, args.messages)
+        elif args.sink in ('postgres', 'pg-rows'):
+            dsn = args.pg_dsn or os.getenv('PG_DSN')
+            if not dsn:
+                raise SystemExit('--sink postgres/pg-rows needs --pg-dsn or PG_DSN')
+            async with collector.pg_pool_context(dsn) as pool:
+                await pool.execute('DELETE FROM messages WHERE entity_id = $1', ENTITY_ID)
+                if args.sink == 'postgres':
+                    sink = collector.BatchSink(pool, batch_size=args.batch_size)
+                else:
+                    sink = collector.postgres_store
+                with contextlib.redirect_stdout(devnull):
+                    result = await run_once(client, sink, args.mode, args.messages)
+                result['rows_in_db'] = await pool.fetchval(
+                    'SELECT count(*) FROM messages WHERE entity_id = $1', ENTITY_ID
+                )
+        else:
+            sink = collector.print_store if args.sink == 'print' else NullSink()
+            with contextlib.redirect_stdout(devnull):
+                result = await run_once(client, sink, args.mode, args.messages)
+    finally:
+        devnull.close()
+
+    result['peak_rss_kb'] = peak_rss_kb()
+    result['config'] = {
+        k: v for k, v in vars(args).items() if k not in ('pg_dsn', 'output')
+    }
+    result['python'] = platform.python_version()
+    result['timestamp'] = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+    return result
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Benchmark the collector against a fake Telegram client')
+    p.add_argument('--messages', type=int, default=10000, help='number of synthetic messages')
+    p.add_argument('--mode', choices=('consume', 'pipeline', 'batch', 'normalize'), default='consume')
+    p.add_argument('--sink', choices=('null', 'print', 'postgres', 'pg-rows'), default='null')
+    p.add_argument('--page-size', type=int, default=100, help='messages per fake server request')
+    p.add_argument('--latency', type=float, default=0.0, help='seconds per fake server request')
+    p.add_argument('--text-mean', type=int, default=200, help='mean text length in characters')
+    p.add_argument('--text-dist', choices=('fixed', 'uniform', 'lognormal'), default='lognormal')
+    p.add_argument('--media-ratio', type=float, default=0.2, help='fraction of messages with media')
+    p.add_argument('--flood-every', type=int, default=0, help='raise FloodWaitError every N requests (0: never)')
+    p.add_argument('--flood-seconds', type=int, default=1, help='seconds requested by injected flood waits')
+    p.add_argument('--batch-size', type=int, default=500, help='BatchSink batch size (postgres sink)')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN (overrides PG_DSN env)')
+    p.add_argument('-o', '--output', help='append the JSON result to this file (one line per run)')
+    args = p.parse_args()
+
+    result = asyncio.run(main(args))
+    line = json.dumps(result, sort_keys=True)
+    print(line)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
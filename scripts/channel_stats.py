@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Print channel activity from the `channel_stats_hourly` aggregates.
+
+Daily (or hourly) message, media and text-length totals, or a weekday x
+hour posting heatmap, read from the aggregates the sinks keep current, so
+it stays fast however large the archive grows. `--rebuild` recomputes
+the aggregates from `messages` first.
+
+Usage:
+  python scripts/channel_stats.py -1001234567890 --days 30
+  python scripts/channel_stats.py -1001234567890 --days 90 --heatmap --tz Europe/Moscow
+  python scripts/channel_stats.py --rebuild --days 7
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path so imports work when running from `scripts/`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import collector
+from collector.storage.channel_stats import channel_activity, posting_heatmap, rebuild_channel_stats
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+async def main(args: argparse.Namespace) -> int:
+    dsn = args.pg_dsn or os.getenv('PG_DSN')
+    if not dsn:
+        print('PG_DSN not set (pass --pg-dsn or set PG_DSN env)')
+        return 2
+    since = None
+    if args.days:
+        since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=args.days)
+    async with collector.pg_pool_context(dsn) as pool:
+        if args.rebuild:
+            async with pool.acquire() as conn:
+                written = await rebuild_channel_stats(conn, entity_ids=args.entity, since=since)
+            print(f'Rebuilt {written} hourly rows')
+            if not args.entity:
+                return 0
+        if args.heatmap:
+            grid = await posting_heatmap(args.entity, since=since, tz=args.tz, pool=pool)
+            print('     ' + ''.join(f'{h:>5}' for h in range(24)))
+            for name, row in zip(_DAYS, grid):
+                print(f'{name:<5}' + ''.join(f'{n:>5}' for n in row))
+            return 0
+        rows = await channel_activity(args.entity, since=since, bucket=args.by, tz=args.tz, pool=pool)
+    fmt = '%Y-%m-%d' if args.by == 'day' else '%Y-%m-%d %H:00'
+    print(f'{"entity":>16}  {"period":<16} {"messages":>8} {"media":>6} {"avg chars":>9}')
+    for r in rows:
+        print(f'{r.entity_id:>16}  {r.period.strftime(fmt):<16} {r.messages:>8} {r.media:>6} {r.avg_chars:>9.0f}')
+    return 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Print channel activity from the hourly aggregates')
+    p.add_argument('entity', type=int, nargs='*', help='entity ids as stored in messages.entity_id (default: all)')
+    p.add_argument('--days', type=int, default=30, help='only the last N days (0: everything)')
+    p.add_argument('--by', choices=('day', 'hour'), default='day', help='period of each row')
+    p.add_argument('--tz', default='UTC', help='time zone of days and hours, e.g. Europe/Moscow')
+    p.add_argument('--heatmap', action='store_true', help='print messages per weekday and hour instead')
+    p.add_argument('--rebuild', action='store_true', help='recompute the aggregates of the range from messages first')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN (overrides PG_DSN env)')
+    args = p.parse_args()
+    args.entity = args.entity or None
+    raise SystemExit(asyncio.run(main(args)))
@@ -13,7 +13,7 @@ async def main():
             return
         row = await conn.fetchval('SELECT COUNT(*) FROM messages')
         print('rows in messages:', row)
-        sample = await conn.fetch('SELECT id, date, sender_id, has_media FROM messages ORDER BY date DESC LIMIT 3')
+        sample = await conn.fetch('SELECT entity_id, id, date, sender_id, has_media FROM messages ORDER BY date DESC LIMIT 3')
         if sample:
             print('latest rows:')
             for s in sample:
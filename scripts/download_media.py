@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Download the media files recorded by the collectors.
+
+Files listed in `message_media` that are not in `media_files` yet are
+downloaded once each into `media/` (named by the file's unique id, so a
+file forwarded to many channels is stored once) and recorded in
+`media_files`. Stop it at any time; the next run continues with what is
+left.
+
+Usage:
+  python scripts/download_media.py --kind photo --max-size 20 --concurrency 4 --bandwidth 2
+  python scripts/download_media.py --entity -1001234567890 --limit 100
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path so imports work when running from `scripts/`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import collector
+from collector.media import MEDIA_KINDS
+
+
+async def main(args: argparse.Namespace) -> int:
+    dsn = args.pg_dsn or os.getenv('PG_DSN')
+    if not dsn:
+        print('PG_DSN not set (pass --pg-dsn or set PG_DSN env)')
+        return 2
+    api_id, api_hash = collector.get_api_credentials()
+    async with collector.pg_pool_context(dsn) as pool:
+        async with collector.create_client(args.session, api_id, api_hash) as client:
+            stats = await collector.download_media(
+                client,
+                store=collector.MediaStore(args.media_dir),
+                pool=pool,
+                entity_ids=args.entity,
+                kinds=args.kind,
+                max_size=int(args.max_size * 1024 * 1024) if args.max_size else None,
+                limit=args.limit,
+                concurrency=args.concurrency,
+                bandwidth=args.bandwidth * 1024 * 1024 if args.bandwidth else None,
+            )
+    print('Downloaded:', stats.summary())
+    return 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Download recorded media files')
+    p.add_argument('--session', default='session', help='session filename prefix')
+    p.add_argument('--entity', type=int, action='append', help='only media of this entity id (repeatable)')
+    p.add_argument('--kind', choices=MEDIA_KINDS, action='append', help='only this kind of media (repeatable)')
+    p.add_argument('--max-size', type=float, help='skip files larger than this many MB')
+    p.add_argument('--limit', type=int, help='download at most this many files')
+    p.add_argument('--concurrency', type=int, default=4, help='files downloaded at the same time')
+    p.add_argument('--bandwidth', type=float, help='total download rate limit in MB/s')
+    p.add_argument('--media-dir', default='media', help='where downloaded files are stored')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN (overrides PG_DSN env)')
+    raise SystemExit(asyncio.run(main(p.parse_args())))
@@ -3,6 +3,9 @@
 
 Produces a JSON object with a single key `targets` whose value is a list of
 usernames (when available) or numeric ids for each dialog the account can see.
+The same dialog sweep also fills the session's entity cache
+(`.sessions/<session>.entities.json`), so later collection runs can resolve
+these targets without any requests.
 
 Usage:
   python scripts/export_targets.py [-o OUTPUT.json] [--session NAME] [--limit N]
@@ -39,6 +42,7 @@ async def gather_targets(output: str, session: str = 'session', limit: int | Non
         return 2
 
     targets: list[str | int] = []
+    cache = collector.EntityCache.for_session(session)
 
     async with collector.create_client(session, api_id, api_hash) as client:
         if limit is None:
@@ -47,6 +51,7 @@ async def gather_targets(output: str, session: str = 'session', limit: int | Non
             dialogs = [d async for d in client.iter_dialogs(limit=float(limit))]
         for d in dialogs:
             e: Entity = d.entity
+            cache.add(e)
             username = getattr(e, 'username', None)
             if username:
                 targets.append(username)
@@ -55,6 +60,7 @@ async def gather_targets(output: str, session: str = 'session', limit: int | Non
                 if eid is not None:
                     targets.append(eid)
 
+    cache.save()
     payload = {'targets': targets}
     p = Path(output)
     p.write_text(json.dumps(payload, ensure_ascii=False, indent=2))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Print a channel's recent history in the LLM context format.
+
+One line per message, `[YYYY-MM-DD HH:MM] sender: text`, oldest first.
+Formatted days are cached in `.cache/context/`, so running this again (or
+with a longer window) only reads the days that changed.
+
+Usage:
+  python scripts/load_context.py -1001234567890 --days 30 --budget 200000 -o context.txt
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path so imports work when running from `scripts/`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import collector
+from analyzer import ContextCache, load_context
+
+
+async def main(args: argparse.Namespace) -> int:
+    dsn = args.pg_dsn or os.getenv('PG_DSN')
+    if not dsn:
+        print('PG_DSN not set (pass --pg-dsn or set PG_DSN env)')
+        return 2
+    async with collector.pg_pool_context(dsn) as pool:
+        ctx = await load_context(
+            args.entity,
+            args.days,
+            token_budget=args.budget,
+            until=args.until,
+            max_message_chars=args.max_chars,
+            pool=pool,
+            cache=ContextCache(args.cache_dir),
+        )
+    if args.output:
+        Path(args.output).write_text(ctx.text + '\n', encoding='utf-8')
+    else:
+        print(ctx.text)
+    print('Context:', ctx.summary(), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description="Format a channel's recent messages for an LLM prompt")
+    p.add_argument('entity', type=int, help='entity id as stored in messages.entity_id')
+    p.add_argument('--days', type=int, default=30, help='number of UTC days, ending with --until')
+    p.add_argument('--until', type=datetime.date.fromisoformat, help='last day to include (default today)')
+    p.add_argument('--budget', type=int, help='approximate token budget; older messages are dropped first')
+    p.add_argument('--max-chars', type=int, default=1000, help='truncate messages longer than this')
+    p.add_argument('--cache-dir', default=str(Path('.cache') / 'context'), help='formatted day cache')
+    p.add_argument('-o', '--output', help='write the context to this file instead of stdout')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN (overrides PG_DSN env)')
+    raise SystemExit(asyncio.run(main(p.parse_args())))
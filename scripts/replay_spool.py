@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Load spooled messages into Postgres and delete the loaded segments.
+
+The collectors spool messages to `.spool/` when Postgres is unavailable or
+slow. This script merges every sealed segment into `messages` (the same
+idempotent upsert the collectors use) and advances the collection
+checkpoints of rows spooled by incremental runs; running it twice is
+harmless.
+
+`--recover` also loads segments left unsealed by a collector that crashed.
+Only use it while no collector is writing to the spool directory.
+
+Usage:
+  python scripts/replay_spool.py [--spool-dir .spool] [--recover] [--keep]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path so imports work when running from `scripts/`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import collector
+
+
+async def main(args: argparse.Namespace) -> int:
+    dsn = args.pg_dsn or os.getenv('PG_DSN')
+    if not dsn:
+        print('PG_DSN not set (pass --pg-dsn or set PG_DSN env)')
+        return 2
+    async with collector.pg_pool_context(dsn) as pool:
+        result = await collector.replay_spool(
+            pool,
+            args.spool_dir,
+            recover=args.recover,
+            chunk_size=args.chunk_size,
+            advance_state=not args.no_state,
+            keep=args.keep,
+        )
+    print('Replay:', result.summary())
+    return 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Load spooled messages into Postgres')
+    p.add_argument('--spool-dir', default='.spool', help='spool directory written by the collectors')
+    p.add_argument('--recover', action='store_true',
+                   help='also load unsealed segments of crashed collectors (no collector may be running)')
+    p.add_argument('--keep', action='store_true', help='keep segments after loading them')
+    p.add_argument('--no-state', action='store_true', help='do not advance collection checkpoints')
+    p.add_argument('--chunk-size', type=int, default=5000, help='rows merged per transaction')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN (overrides PG_DSN env)')
+    raise SystemExit(asyncio.run(main(p.parse_args())))
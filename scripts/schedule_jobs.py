@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Queue collection jobs for the workers (see worker.py).
+
+Queues one job per target (the targets in `config.json` unless given on
+the command line). Targets that already have an open job of the same kind
+are skipped, so it is safe to run from cron, or with `--every` as a
+long-running scheduler.
+
+Usage:
+  python scripts/schedule_jobs.py --every 600
+  python scripts/schedule_jobs.py --kind backfill --priority 10 --segments 16 @bigchannel
+  python scripts/schedule_jobs.py --status
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path so imports work when running from `scripts/`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import collector
+from collector.storage.job_store import JOB_KINDS, JOB_STATUSES
+
+
+async def print_status(queue: collector.JobQueue) -> None:
+    counts = await queue.counts()
+    for kind in JOB_KINDS:
+        line = ', '.join(f'{counts.get((kind, s), 0)} {s}' for s in JOB_STATUSES)
+        print(f'{kind}: {line}')
+
+
+async def main(args: argparse.Namespace) -> int:
+    dsn = args.pg_dsn or os.getenv('PG_DSN')
+    if not dsn:
+        print('PG_DSN not set (pass --pg-dsn or set PG_DSN env)')
+        return 2
+    async with collector.pg_pool_context(dsn) as pool:
+        queue = collector.JobQueue(pool)
+        if args.status:
+            await print_status(queue)
+            return 0
+        if args.prune_days is not None:
+            pruned = await queue.prune(datetime.timedelta(days=args.prune_days))
+            print(f'Deleted {pruned} finished jobs')
+            return 0
+
+        targets = args.targets or collector.load_config()
+        if not targets:
+            print('No targets given and none in config.json')
+            return 2
+        options = {}
+        if args.kind == 'fetch' and args.limit:
+            options['limit'] = args.limit
+        if args.kind == 'backfill':
+            options.update(segments=args.segments, concurrency=args.concurrency)
+        while True:
+            queued = await queue.enqueue(
+                args.kind, targets, priority=args.priority, options=options, max_attempts=args.max_attempts
+            )
+            print(f'Queued {queued} {args.kind} jobs ({len(targets) - queued} already open)')
+            if not args.every:
+                return 0
+            await asyncio.sleep(args.every)
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Queue collection jobs for the workers')
+    p.add_argument('targets', nargs='*', help='channel usernames or numeric ids (default: config.json)')
+    p.add_argument('--kind', choices=JOB_KINDS, default='fetch', help='incremental fetch or full backfill')
+    p.add_argument('--priority', type=int, default=0, help='higher priorities are claimed first')
+    p.add_argument('--limit', type=int, help='fetch jobs: messages per run')
+    p.add_argument('--segments', type=int, default=8, help='backfill jobs: number of id ranges')
+    p.add_argument('--concurrency', type=int, default=4, help='backfill jobs: segments fetched at the same time')
+    p.add_argument('--max-attempts', type=int, default=5, help='give a job up after this many failed runs')
+    p.add_argument('--every', type=float, help='keep running and queue the targets again every this many seconds')
+    p.add_argument('--status', action='store_true', help='print the number of jobs per kind and status and exit')
+    p.add_argument('--prune-days', type=float, help='delete jobs finished more than this many days ago and exit')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN (overrides PG_DSN env)')
+    try:
+        raise SystemExit(asyncio.run(main(p.parse_args())))
+    except KeyboardInterrupt:
+        raise SystemExit(0)
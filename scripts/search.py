@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Search collected messages.
+
+Modes (`--mode`):
+  fts        full-text, web-search syntax ("exact phrase", or, -word); default
+  substring  case-insensitive substring
+  fuzzy      typo-tolerant word match (needs the pg_trgm extension)
+
+Results are printed best match first, or newest first with `--order date`
+(the fast choice for very common terms). When there are more, the command
+to get the next page is printed (`--after TOKEN`, used with the same
+options).
+
+Usage:
+  python scripts/search.py "выборы OR elections" --entity -1001234567890 --since 2026-01-01
+  python scripts/search.py "t.me/" --mode substring --limit 50
+  python scripts/search.py --set-languages russian,english,ukrainian
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path so imports work when running from `scripts/`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import collector
+from collector.storage.schema import ensure_trigram_index, search_languages, set_search_languages
+from collector.storage.search import SEARCH_MODES, SEARCH_ORDERS, SearchCursor, search_messages
+
+
+def parse_date(value: str) -> datetime.datetime:
+    """ISO date or datetime; naive values are taken as UTC."""
+    d = datetime.datetime.fromisoformat(value)
+    return d if d.tzinfo is not None else d.replace(tzinfo=datetime.timezone.utc)
+
+
+async def main(args: argparse.Namespace) -> int:
+    dsn = args.pg_dsn or os.getenv('PG_DSN')
+    if not dsn:
+        print('PG_DSN not set (pass --pg-dsn or set PG_DSN env)')
+        return 2
+    async with collector.pg_pool_context(dsn) as pool:
+        if args.set_languages or args.setup_trigram:
+            async with pool.acquire() as conn:
+                if args.set_languages:
+                    languages = [lang.strip() for lang in args.set_languages.split(',') if lang.strip()]
+                    print(f'Rebuilding the search column for {", ".join(languages)} (rewrites the table)...')
+                    await set_search_languages(conn, languages)
+                if args.setup_trigram and await ensure_trigram_index(conn):
+                    print('Trigram index is in place')
+                print('Search languages:', ', '.join(await search_languages(conn)))
+            return 0
+        if not args.query:
+            print('No query given')
+            return 2
+
+        page = await search_messages(
+            args.query,
+            mode=args.mode,
+            order=args.order,
+            entity_ids=args.entity,
+            since=args.since,
+            until=args.until,
+            limit=args.limit,
+            after=SearchCursor.decode(args.after) if args.after else None,
+            pool=pool,
+        )
+    for h in page.hits:
+        if args.json:
+            print(json.dumps({
+                'entity_id': h.entity_id, 'id': h.id, 'date': h.date.isoformat(),
+                'sender_id': h.sender_id, 'rank': h.rank, 'snippet': h.snippet,
+            }, ensure_ascii=False))
+        else:
+            print(f'{h.date:%Y-%m-%d %H:%M}  {h.entity_id}/{h.id}  {h.snippet}')
+    if page.next_cursor is not None:
+        print(f'More results: --after {page.next_cursor.encode()}', file=sys.stderr)
+    elif not page.hits:
+        print('No matches', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Search collected messages')
+    p.add_argument('query', nargs='?', help='search query')
+    p.add_argument('--mode', choices=SEARCH_MODES, default='fts')
+    p.add_argument('--order', choices=SEARCH_ORDERS,
+                   help='rank (best match first; default for fts and fuzzy) or date (newest first)')
+    p.add_argument('--entity', type=int, action='append', help='only this entity id (repeatable)')
+    p.add_argument('--since', type=parse_date, help='messages sent at or after this date')
+    p.add_argument('--until', type=parse_date, help='messages sent before this date')
+    p.add_argument('--limit', type=int, default=20, help='results per page')
+    p.add_argument('--after', metavar='TOKEN', help='continue after the page that printed this token')
+    p.add_argument('--json', action='store_true', help='print one JSON object per hit')
+    p.add_argument('--set-languages', metavar='LANGS',
+                   help='rebuild the full-text column for these comma-separated text search configurations')
+    p.add_argument('--setup-trigram', action='store_true',
+                   help='create pg_trgm and the trigram index (after installing the extension)')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN (overrides PG_DSN env)')
+    raise SystemExit(asyncio.run(main(p.parse_args())))
@@ -0,0 +1,75 @@
+"""A fake Telegram client serving several channels of synthetic messages."""
+import datetime
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import PeerChannel
+from telethon.utils import get_peer_id
+
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Message:
+    """The subset of `telethon.tl.custom.Message` the collector reads."""
+
+    def __init__(self, channel_id, mid, text=None, media=None):
+        self.id = mid
+        self.peer_id = PeerChannel(channel_id)
+        self.chat_id = get_peer_id(self.peer_id)
+        self.sender_id = self.chat_id
+        self.date = EPOCH + datetime.timedelta(minutes=mid)
+        self.text = f'message {mid}' if text is None else text
+        self.media = media
+        self.edit_date = None
+
+
+class ChannelsClient:
+    """Serves channels named by username, each with messages 1..n.
+
+    `channels` maps a username to `(channel id, message count)`.
+    `flood_at` maps a message id to the seconds of a `FloodWaitError`
+    raised (once) just before that message would be yielded.
+    """
+
+    def __init__(self, channels, *, page_size=100, flood_at=None):
+        self.channels = {name: (cid, n) for name, (cid, n) in channels.items()}
+        self.by_id = {cid: n for cid, n in self.channels.values()}
+        self.page_size = page_size
+        self.flood_at = dict(flood_at or {})
+        self.deleted = set()
+        self.requests = []
+
+    async def get_entity(self, target):
+        if isinstance(target, int):
+            for cid, _ in self.channels.values():
+                if target in (cid, get_peer_id(PeerChannel(cid))):
+                    return PeerChannel(cid)
+            raise ValueError(f'no channel with id {target}')
+        found = self.channels.get(str(target).lstrip('@'))
+        if found is None:
+            raise ValueError(f'no channel {target!r}')
+        return PeerChannel(found[0])
+
+    async def iter_messages(self, entity, limit=None, offset_id=0, min_id=0, max_id=0, reverse=False, **kwargs):
+        cid = entity.channel_id
+        total = self.by_id[cid]
+        self.requests.append((cid, offset_id, min_id, reverse))
+        if reverse:
+            start = max(offset_id, min_id) + 1
+            stop = min(max_id, total + 1) if max_id else total + 1
+            ids = range(start, stop)
+        else:
+            top = min(x for x in (offset_id, max_id, total + 1) if x) - 1
+            ids = range(top, min_id, -1)
+        if limit is not None:
+            ids = ids[:limit]
+        for mid in ids:
+            seconds = self.flood_at.pop(mid, None)
+            if seconds is not None:
+                raise FloodWaitError(request=None, capture=seconds)
+            if (cid, mid) not in self.deleted:
+                yield Message(cid, mid)
+
+    async def get_messages(self, entity, ids):
+        cid = entity.channel_id
+        total = self.by_id[cid]
+        return [Message(cid, i) if 0 < i <= total and (cid, i) not in self.deleted else None for i in ids]
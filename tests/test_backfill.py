@@ -0,0 +1,74 @@
+"""Range-split backfill: segment cursors, checkpoints and resume."""
+import asyncio
+
+from telethon.tl.types import PeerChannel
+
+from collector.backfill import backfill, plan_segments
+from collector.storage.backfill_store import FileBackfillStore, Segment
+from scripts.benchmark import ENTITY_ID, FakeClient, _CHANNEL_ID
+
+
+class RowSink:
+    """Buffers rows like `BatchSink`; fails `add_rows` for pages holding `fail_id`."""
+
+    def __init__(self, fail_id=None):
+        self.fail_id = fail_id
+        self.pending = []
+        self.stored = set()
+
+    async def add_rows(self, rows):
+        if any(r[1] == self.fail_id for r in rows):
+            raise ConnectionError('database down')
+        self.pending.extend(r[1] for r in rows)
+
+    async def flush(self):
+        self.stored.update(self.pending)
+        self.pending = []
+
+    async def __call__(self, m):
+        raise AssertionError('pages go through add_rows')
+
+
+def test_plan_segments_covers_ids_newest_first():
+    plan = plan_segments(10_500, 4)
+    assert plan[0].high_id == 10_500 and plan[-1].low_id == 0
+    assert all(a.low_id == b.high_id for a, b in zip(plan, plan[1:]))
+    assert plan_segments(1500, 8) == [Segment(750, 1500), Segment(0, 750)]
+    assert plan_segments(0, 8) == []
+
+
+def test_backfill_stores_every_message_once(tmp_path):
+    sink = RowSink()
+    progress = FileBackfillStore(tmp_path / 'segments.json')
+    result = asyncio.run(backfill(
+        FakeClient(2500), PeerChannel(_CHANNEL_ID), sink, progress=progress, segments=3, checkpoint_every=200,
+    ))
+    assert result.done and not result.resumed
+    assert (result.top_id, result.messages, result.failed) == (2500, 2500, 0)
+    assert sink.stored == set(range(1, 2501))
+    assert all(s.done for s in asyncio.run(FileBackfillStore(progress.path).load(ENTITY_ID)))
+
+
+def test_failed_page_keeps_cursor_above_it_and_resumes(tmp_path):
+    path = tmp_path / 'segments.json'
+    sink = RowSink(fail_id=1450)
+    result = asyncio.run(backfill(
+        FakeClient(2000), PeerChannel(_CHANNEL_ID), sink,
+        progress=FileBackfillStore(path), segments=2, checkpoint_every=100,
+    ))
+    assert not result.done
+    assert (result.completed, result.failed) == (1, 100)
+    assert '100 failed' in result.summary()
+
+    # The page 1401..1500 was never stored, so the upper segment resumes above it.
+    upper = asyncio.run(FileBackfillStore(path).load(ENTITY_ID))[0]
+    assert (upper.cursor_id, upper.done) == (1501, False)
+    assert 1450 not in sink.stored
+
+    sink.fail_id = None
+    result = asyncio.run(backfill(
+        FakeClient(2000), PeerChannel(_CHANNEL_ID), sink, progress=FileBackfillStore(path), segments=2,
+    ))
+    assert result.done and result.resumed
+    assert result.messages == 500
+    assert sink.stored == set(range(1, 2001))
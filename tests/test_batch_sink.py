@@ -0,0 +1,206 @@
+"""BatchSink buffering, merging and checkpoints, against a fake pool."""
+import asyncio
+import datetime
+
+import pytest
+
+from collector.normalize import NormalizedMessage
+from collector.storage import batch_sink
+from collector.storage.batch_sink import BatchSink
+from collector.storage.state_store import FileStateStore
+
+DATE = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class _Ctx:
+    def __init__(self, value=None):
+        self.value = value
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class Conn:
+    def transaction(self):
+        return _Ctx()
+
+
+class Pool:
+    def __init__(self):
+        self.conn = Conn()
+
+    def acquire(self):
+        return _Ctx(self.conn)
+
+
+class Database:
+    """Records the batches handed to `merge_rows`; every row counts as
+    written. While `down` is set, merges fail."""
+
+    def __init__(self):
+        self.batches = []
+        self.down = False
+
+    async def merge_rows(self, conn, rows, written_keys=None):
+        if self.down:
+            raise ConnectionError('database down')
+        self.batches.append([(r[1], r[4]) for r in rows])
+        if written_keys is not None:
+            written_keys.update((r[0], r[1]) for r in rows)
+        return len(rows)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    async def ensure_partitions(conn, dates):
+        pass
+
+    db = Database()
+    monkeypatch.setattr(batch_sink, 'asyncpg', object())
+    monkeypatch.setattr(batch_sink, 'merge_rows', db.merge_rows)
+    monkeypatch.setattr(batch_sink, 'ensure_partitions', ensure_partitions)
+    return db
+
+
+def _msg(mid, text='t', entity_id=-1001):
+    return NormalizedMessage(mid, 'sender', DATE, text, False, entity_id)
+
+
+def test_flushes_full_batches_and_the_rest_on_close(db):
+    async def run():
+        async with BatchSink(Pool(), batch_size=3, flush_interval=0) as sink:
+            for i in range(1, 8):
+                await sink(_msg(i))
+        return sink
+
+    sink = asyncio.run(run())
+    assert db.batches == [[(1, 't'), (2, 't'), (3, 't')], [(4, 't'), (5, 't'), (6, 't')], [(7, 't')]]
+    assert (sink.stats.rows, sink.stats.written, sink.stats.flushes) == (7, 7, 3)
+
+
+def test_same_key_collapses_in_a_batch_last_wins(db):
+    async def run():
+        async with BatchSink(Pool(), batch_size=10, flush_interval=0) as sink:
+            await sink(_msg(1, 'old'))
+            await sink(_msg(2))
+            await sink(_msg(1, 'new'))
+            await sink(_msg(1, 'other entity', entity_id=-1002))
+
+    asyncio.run(run())
+    assert db.batches == [[(1, 'new'), (2, 't'), (1, 'other entity')]]
+
+
+def test_failed_flush_keeps_rows_buffered(db):
+    async def run():
+        sink = BatchSink(Pool(), batch_size=10, flush_interval=0)
+        await sink(_msg(1, 'a'))
+        db.down = True
+        with pytest.raises(ConnectionError):
+            await sink.flush()
+        assert len(sink) == 1
+        # a newer row for the same key wins over the restored one
+        await sink(_msg(1, 'b'))
+        db.down = False
+        assert await sink.flush() == 1
+        await sink.close()
+
+    asyncio.run(run())
+    assert db.batches == [[(1, 'b')]]
+
+
+def test_flush_interval_writes_partial_batches(db):
+    async def run():
+        sink = BatchSink(Pool(), batch_size=100, flush_interval=0.01)
+        await sink(_msg(1))
+        await asyncio.sleep(0.05)
+        assert db.batches == [[(1, 't')]]
+        await sink.close()
+
+    asyncio.run(run())
+
+
+def test_closed_sink_rejects_messages(db):
+    async def run():
+        sink = BatchSink(Pool(), flush_interval=0)
+        await sink.close()
+        with pytest.raises(RuntimeError):
+            await sink(_msg(1))
+
+    asyncio.run(run())
+
+
+def test_state_advances_with_each_written_batch(db, tmp_path):
+    state = FileStateStore(tmp_path / 'state.json')
+
+    async def run():
+        async with BatchSink(Pool(), batch_size=2, flush_interval=0, state=state) as sink:
+            await sink(_msg(5))
+            await sink(_msg(6))
+            assert await state.get(-1001) == 6
+            await sink(_msg(7, entity_id=-1002))
+            db.down = True
+            with pytest.raises(ConnectionError):
+                await sink.flush()
+            # a batch that was not written does not move the checkpoint
+            assert await state.get(-1002) is None
+            db.down = False
+
+    asyncio.run(run())
+    assert asyncio.run(FileStateStore(state.path).get_many([-1001, -1002])) == {-1001: 6, -1002: 7}
+
+
+def test_unchanged_messages_are_skipped_by_the_hash_lru(db):
+    async def run():
+        async with BatchSink(Pool(), batch_size=2, flush_interval=0, cache_size=2) as sink:
+            for m in (_msg(1), _msg(2)):
+                await sink(m)
+            # unchanged: dropped before buffering
+            await sink(_msg(1))
+            # edited: written again
+            await sink(_msg(2, 'edited'))
+            await sink(_msg(3))
+            await sink.flush()
+            # 1 was evicted by 2 and 3 (cache_size=2), so it is sent again
+            await sink(_msg(1))
+            await sink(_msg(3))
+        return sink
+
+    sink = asyncio.run(run())
+    assert db.batches == [[(1, 't'), (2, 't')], [(2, 'edited'), (3, 't')], [(1, 't')]]
+    assert sink.stats.unchanged == 2
+
+
+def test_reverted_edit_in_the_buffer_still_replaces_it(db):
+    async def run():
+        async with BatchSink(Pool(), batch_size=10, flush_interval=0) as sink:
+            await sink(_msg(1))
+            await sink.flush()
+            await sink(_msg(1, 'edited'))
+            await sink(_msg(1))
+
+    asyncio.run(run())
+    assert db.batches == [[(1, 't')], [(1, 't')]]
+
+
+def test_skipped_messages_still_advance_the_checkpoint(db, tmp_path):
+    state = FileStateStore(tmp_path / 'state.json')
+    pool = Pool()
+    stored = _msg(7)
+
+    async def fetch(sql, *args):
+        return [{'entity_id': -1001, 'id': 7, 'content_hash': stored.content_hash()}]
+
+    pool.fetch = fetch
+
+    async def run():
+        async with BatchSink(pool, flush_interval=0, state=state) as sink:
+            assert await sink.warm_cache() == 1
+            await sink(_msg(7))
+        return sink
+
+    sink = asyncio.run(run())
+    assert (sink.stats.unchanged, db.batches) == (1, [])
+    assert asyncio.run(state.get(-1001)) == 7
@@ -0,0 +1,47 @@
+"""The offline benchmark harness runs every mode end to end on the fake client."""
+import asyncio
+
+import pytest
+
+from collector import stream
+from scripts.benchmark import FakeClient, NullSink, percentile, run_normalize, run_once
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    async def sleep(seconds):
+        pass
+
+    monkeypatch.setattr(stream.asyncio, 'sleep', sleep)
+
+
+@pytest.mark.parametrize('mode', ['consume', 'pipeline', 'batch'])
+def test_run_once_stores_every_message_through_flood_waits(mode):
+    client = FakeClient(1050, page_size=100, flood_every=4, media_ratio=0.5)
+    result = asyncio.run(run_once(client, NullSink(), mode, 1050))
+    assert result['messages'] == 1050
+    assert result['flood_waits'] >= 2
+    assert result['latency_ms']['p50'] is not None
+
+
+def test_fake_client_pages_like_telethon():
+    client = FakeClient(250, page_size=100)
+
+    async def ids(**kwargs):
+        return [m.id async for m in client.iter_messages(None, **kwargs)]
+
+    assert asyncio.run(ids(limit=3)) == [250, 249, 248]
+    assert asyncio.run(ids(offset_id=10, min_id=5)) == [9, 8, 7, 6]
+    assert asyncio.run(ids(min_id=247, reverse=True)) == [248, 249, 250]
+    assert client.requests == 3
+    # one request per server page of `page_size` messages
+    assert len(asyncio.run(ids())) == 250
+    assert client.requests == 6
+
+
+def test_normalize_mode_and_percentile():
+    result = asyncio.run(run_normalize(FakeClient(200), 200))
+    assert result['messages'] == 200
+    assert result['normalize_batch']['us_per_msg'] > 0
+    assert percentile([], 0.5) is None
+    assert percentile([3.0, 1.0, 2.0], 0.99) == 3.0
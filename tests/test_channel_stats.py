@@ -0,0 +1,91 @@
+"""Hourly channel aggregates: rebuild ranges and the read helpers."""
+import asyncio
+import datetime
+
+import pytest
+
+from collector.storage.channel_stats import (
+    ChannelActivity,
+    channel_activity,
+    posting_heatmap,
+    rebuild_channel_stats,
+)
+
+UTC = datetime.timezone.utc
+
+
+class Transaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class Conn:
+    """Records statements; an INSERT reports `inserted` rows."""
+
+    def __init__(self, inserted=0, rows=()):
+        self.inserted = inserted
+        self.rows = list(rows)
+        self.executed = []
+
+    def transaction(self):
+        return Transaction()
+
+    async def execute(self, sql, *args):
+        self.executed.append((' '.join(sql.split()), args))
+        return f'INSERT 0 {self.inserted}' if sql.lstrip().startswith('INSERT') else 'DELETE 3'
+
+    async def fetch(self, sql, *args):
+        self.executed.append((' '.join(sql.split()), args))
+        return self.rows
+
+
+def test_rebuild_rounds_the_range_to_whole_hours():
+    conn = Conn(inserted=5)
+    since = datetime.datetime(2024, 3, 1, 10, 45, 12)
+    until = datetime.datetime(2024, 3, 1, 16, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+    assert asyncio.run(rebuild_channel_stats(conn, entity_ids=[7], since=since, until=until)) == 5
+
+    lock, delete, insert = conn.executed
+    assert lock[0].startswith('LOCK TABLE channel_stats_hourly')
+    hours = (datetime.datetime(2024, 3, 1, 10, tzinfo=UTC), datetime.datetime(2024, 3, 1, 13, tzinfo=UTC))
+    assert delete == (
+        'DELETE FROM channel_stats_hourly WHERE true AND entity_id = ANY($1::bigint[]) AND hour >= $2 AND hour < $3',
+        ([7], *hours),
+    )
+    # messages are selected over the same whole hours the delete cleared
+    assert 'date >= $2 AND date < $3' in insert[0]
+    assert insert[1] == ([7], *hours)
+
+
+def test_rebuild_without_a_range_covers_everything():
+    conn = Conn()
+    asyncio.run(rebuild_channel_stats(conn))
+    assert conn.executed[1] == ('DELETE FROM channel_stats_hourly WHERE true', ())
+
+
+def test_channel_activity_maps_rows():
+    day = datetime.datetime(2024, 3, 1)
+    conn = Conn(rows=[{'entity_id': 7, 'period': day, 'messages': 4, 'media': 1, 'text_chars': 90}])
+    activity = asyncio.run(channel_activity([7], bucket='hour', tz='Europe/Berlin', pool=conn))
+    assert activity == [ChannelActivity(7, day, 4, 1, 90)]
+    assert activity[0].avg_chars == 22.5
+    sql, args = conn.executed[0]
+    assert "date_trunc('hour', hour AT TIME ZONE $2)" in sql
+    assert args == ([7], 'Europe/Berlin')
+    assert ChannelActivity(7, day, 0, 0, 0).avg_chars == 0.0
+
+
+def test_channel_activity_rejects_other_buckets():
+    with pytest.raises(ValueError):
+        asyncio.run(channel_activity(bucket='week', pool=Conn()))
+
+
+def test_posting_heatmap_places_counts_by_weekday_and_hour():
+    conn = Conn(rows=[{'dow': 1, 'h': 0, 'messages': 3}, {'dow': 7, 'h': 23, 'messages': 8}])
+    grid = asyncio.run(posting_heatmap(pool=conn))
+    assert len(grid) == 7 and all(len(row) == 24 for row in grid)
+    assert grid[0][0] == 3 and grid[6][23] == 8
+    assert sum(map(sum, grid)) == 11
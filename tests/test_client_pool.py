@@ -0,0 +1,50 @@
+"""Account choice of `ClientPool` and moving targets away from flood waits."""
+import asyncio
+
+from collector.client_pool import Account, ClientPool
+from collector.engine import collect_with_pool
+from tests.fakes import ChannelsClient
+
+TARGETS = [f'channel{i}' for i in range(200)]
+
+
+def _pool(*sessions, clients=None):
+    clients = clients or {}
+    return ClientPool([Account(s, clients.get(s)) for s in sessions], max_flood_wait=30)
+
+
+def test_preferred_account_is_stable_and_only_removed_targets_move():
+    three = _pool('a', 'b', 'c')
+    before = {t: three.preferred(t).session for t in TARGETS}
+    assert set(before.values()) == {'a', 'b', 'c'}
+    two = _pool('a', 'b')
+    for t in TARGETS:
+        if before[t] != 'c':
+            assert two.preferred(t).session == before[t]
+
+
+def test_flooded_account_hands_targets_to_least_busy():
+    pool = _pool('a', 'b', 'c')
+    target = next(t for t in TARGETS if pool.preferred(t).session == 'a')
+    a, b, c = pool.accounts
+    b.active = 3
+    pool.flood(a, 600)
+    assert asyncio.run(pool.acquire(target)) is c
+    assert pool.should_move(a) and not pool.should_move(c)
+
+
+def test_target_continues_on_another_account_after_long_flood_wait():
+    channels = {'news': (1, 300)}
+    clients = {'a': ChannelsClient(channels), 'b': ChannelsClient(channels)}
+    pool = _pool('a', 'b', clients=clients)
+    first = pool.preferred('news').session
+    clients[first].flood_at[150] = 600
+    seen = []
+
+    async def sink(m):
+        seen.append(m.id)
+
+    [result] = asyncio.run(collect_with_pool(pool, ['news'], sink))
+    assert seen == list(range(300, 0, -1))
+    assert result.status == 'ok' and result.accounts[0] == first and len(result.accounts) == 2
+    assert result.stream.flood_waits == 1
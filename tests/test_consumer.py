@@ -0,0 +1,94 @@
+"""consume_messages checkpoints: flushed first, never past a failed store."""
+import asyncio
+
+from telethon.tl.types import PeerChannel
+
+from collector.consumer import consume_messages
+from collector.storage.state_store import FileStateStore
+from scripts.benchmark import ENTITY_ID, FakeClient, _CHANNEL_ID
+from tests.fakes import ChannelsClient
+
+
+class MemoryState:
+    def __init__(self, marks=None):
+        self.marks = dict(marks or {})
+        self.events = []
+
+    async def get(self, entity_id):
+        return self.marks.get(entity_id)
+
+    async def advance(self, marks):
+        self.events.append(('advance', dict(marks)))
+        for k, v in marks.items():
+            self.marks[k] = max(self.marks.get(k, 0), v)
+
+
+class BufferingSink:
+    def __init__(self, state):
+        self.state_events = state.events
+        self.pending = []
+        self.stored = []
+
+    async def __call__(self, item):
+        self.pending.append(item.id)
+
+    async def flush(self):
+        self.state_events.append(('flush', len(self.pending)))
+        self.stored += self.pending
+        self.pending = []
+
+
+class FailingSink(BufferingSink):
+    def __init__(self, state, fail_ids):
+        super().__init__(state)
+        self.fail_ids = set(fail_ids)
+
+    async def __call__(self, item):
+        if item.id in self.fail_ids:
+            raise ConnectionError('database down')
+        await super().__call__(item)
+
+
+def run(state, sink, total=300):
+    return asyncio.run(consume_messages(FakeClient(total), PeerChannel(_CHANNEL_ID), sink, state=state))
+
+
+def test_first_run_advances_to_newest_after_flush():
+    state = MemoryState()
+    sink = BufferingSink(state)
+    assert run(state, sink) == 300
+    assert state.events == [('flush', 300), ('advance', {ENTITY_ID: 300})]
+
+
+def test_resumed_run_stops_checkpoint_below_failed_message():
+    state = MemoryState({ENTITY_ID: 100})
+    sink = FailingSink(state, {150})
+    assert run(state, sink) == 199
+    assert state.marks[ENTITY_ID] == 149
+
+
+def test_first_run_with_failure_leaves_no_checkpoint():
+    # Without a checkpoint messages arrive newest first: everything stored
+    # before the failure is newer than the failed message.
+    state = MemoryState()
+    sink = FailingSink(state, {150})
+    assert run(state, sink) == 299
+    assert state.marks == {} and state.events == []
+
+
+def test_resumed_run_asks_the_server_for_newer_messages_only():
+    client = ChannelsClient({'a': (1, 250)}, page_size=100)
+    state = MemoryState({-1000000000001: 120})
+    sink = BufferingSink(state)
+    assert asyncio.run(consume_messages(client, PeerChannel(1), sink, state=state)) == 130
+    assert client.requests[0] == (1, 0, 120, True)
+    assert sink.stored == list(range(121, 251))
+
+
+def test_file_state_store_only_moves_forward(tmp_path):
+    path = tmp_path / 'state.json'
+    store = FileStateStore(path)
+    asyncio.run(store.advance({-1001: 50, -1002: 7}))
+    asyncio.run(store.advance({-1001: 40, -1002: 9}))
+    reopened = FileStateStore(path)
+    assert asyncio.run(reopened.get_many([-1001, -1002, -1003])) == {-1001: 50, -1002: 9}
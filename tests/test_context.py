@@ -0,0 +1,116 @@
+"""Context loader: formatting, token budget and the per-day block cache."""
+import asyncio
+import datetime
+
+from analyzer.context import ContextCache, estimate_tokens, format_message, load_context
+
+UTC = datetime.timezone.utc
+ENTITY_ID = 7
+UNTIL = datetime.date(2024, 3, 10)
+
+
+def _at(day, hour):
+    return datetime.datetime(2024, 3, day, hour, tzinfo=UTC)
+
+
+class Conn:
+    """Serves `messages` rows to the page query; `changed` are the days
+    reported as updated since the previous load."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.changed = []
+        self.pages = 0
+
+    async def fetchval(self, sql, settle):
+        return _at(11, 0)
+
+    async def fetch(self, sql, *args):
+        if 'DISTINCT' in sql:
+            return [(d,) for d in self.changed]
+        self.pages += 1
+        entity_id, lower, cur_date, cur_id, limit = args
+        rows = sorted(
+            (r for r in self.rows if r['date'] >= lower and (r['date'], r['id']) < (cur_date, cur_id)),
+            key=lambda r: (r['date'], r['id']), reverse=True,
+        )
+        return rows[:limit]
+
+
+class Pool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def _row(mid, date, text, has_media=False):
+    return {'id': mid, 'date': date, 'sender_id': '100', 'text': text, 'has_media': has_media}
+
+
+ROWS = [
+    _row(1, _at(8, 9), 'hello \n  world'),
+    _row(2, _at(9, 12), None, has_media=True),
+    _row(3, _at(9, 13), '   '),
+    _row(4, _at(10, 8), 'x' * 50),
+    _row(5, _at(10, 10), 'latest'),
+]
+
+
+def _load(conn, cache, **kw):
+    return asyncio.run(load_context(ENTITY_ID, 3, until=UNTIL, pool=Pool(conn), cache=cache, **kw))
+
+
+def test_format_message():
+    date = datetime.datetime(2024, 3, 1, 12, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+    assert format_message(date, 'bob', ' a\n b ', False, 100) == '[2024-03-01 09:30] bob: a b'
+    assert format_message(date, None, 'abcdef', False, 4) == '[2024-03-01 09:30] ?: abc…'
+    assert format_message(date, 'bob', '', True, 100) == '[2024-03-01 09:30] bob: <media>'
+    assert format_message(date, 'bob', None, False, 100) is None
+    assert estimate_tokens('abcd') == 1 and estimate_tokens('абв') == 2
+
+
+def test_load_formats_days_oldest_first_and_caches_them(tmp_path):
+    cache = ContextCache(tmp_path)
+    conn = Conn(list(ROWS))
+    ctx = _load(conn, cache, max_message_chars=20)
+    assert ctx.text.splitlines() == [
+        '[2024-03-08 09:00] 100: hello world',
+        '[2024-03-09 12:00] 100: <media>',
+        '[2024-03-10 08:00] 100: ' + 'x' * 19 + '…',
+        '[2024-03-10 10:00] 100: latest',
+    ]
+    assert (ctx.messages, ctx.oldest, ctx.truncated) == (4, datetime.date(2024, 3, 8), False)
+    assert (ctx.days_cached, ctx.days_read) == (0, 3)
+
+    # a second load reads nothing; a changed day is read again on its own
+    again = _load(conn, cache, max_message_chars=20)
+    assert (again.text, again.days_cached, again.days_read) == (ctx.text, 3, 0)
+    conn.rows.append(_row(6, _at(9, 15), 'late edit'))
+    conn.changed = [datetime.date(2024, 3, 9)]
+    changed = _load(conn, cache, max_message_chars=20)
+    assert (changed.messages, changed.days_cached, changed.days_read) == (5, 2, 1)
+
+    # blocks formatted for another message length are not reused
+    assert _load(conn, cache, max_message_chars=1000).days_cached == 0
+
+
+def test_token_budget_keeps_the_newest_lines(tmp_path):
+    cache = ContextCache(tmp_path)
+    newest = '[2024-03-10 10:00] 100: latest'
+    ctx = _load(Conn(list(ROWS)), cache, token_budget=estimate_tokens(newest) + 1)
+    assert ctx.text == newest
+    assert (ctx.messages, ctx.oldest, ctx.truncated) == (1, UNTIL, True)
+    assert (ctx.days_cached, ctx.days_read) == (0, 1)
+    assert 'truncated at the token budget' in ctx.summary()
+
+    # only the day that was read completely went into the cache
+    full = _load(Conn(list(ROWS)), cache)
+    assert (full.days_cached, full.days_read) == (1, 2)
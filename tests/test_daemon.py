@@ -0,0 +1,193 @@
+"""Daemon protocol: newline-delimited JSON over a Unix socket."""
+import asyncio
+import json
+
+import pytest
+
+import collectorctl
+from collector import daemon as daemon_mod
+from collector.daemon import CollectorDaemon
+
+
+class FakeSink:
+    def __init__(self):
+        self.flushes = 0
+        self.stats = self
+
+    def summary(self):
+        return 'fake sink'
+
+    async def flush(self):
+        self.flushes += 1
+
+
+@pytest.fixture
+def fake_collector(monkeypatch):
+    """Targets resolve unless named 'unknown' or 'broken'; collect jobs
+    take a moment and store `limit` messages. Returns the collect calls."""
+    calls = []
+
+    async def resolve(client, target, cache=None):
+        await asyncio.sleep(0.01)
+        if target == 'broken':
+            raise ConnectionError('resolver down')
+        return None if target == 'unknown' else target
+
+    async def consume_messages(client, entity, sink, *, limit=None, state=None, **kw):
+        calls.append((entity, limit))
+        await asyncio.sleep(0.05)
+        return limit or 0
+
+    monkeypatch.setattr(daemon_mod, 'resolve', resolve)
+    monkeypatch.setattr(daemon_mod, 'get_peer_id', lambda e: -1000 - len(e))
+    monkeypatch.setattr(daemon_mod, 'consume_messages', consume_messages)
+    return calls
+
+
+async def _request(path, payload):
+    reader, writer = await asyncio.open_unix_connection(str(path))
+    writer.write(json.dumps(payload).encode() + b'\n')
+    await writer.drain()
+    replies = [json.loads(line) async for line in reader]
+    writer.close()
+    return replies
+
+
+async def _serve(path, **kw):
+    d = CollectorDaemon(None, FakeSink(), progress_interval=0.02, **kw)
+    task = asyncio.create_task(d.serve(path))
+    for _ in range(100):
+        if path.exists():
+            break
+        await asyncio.sleep(0.01)
+    return d, task
+
+
+def test_collect_job_reports_progress_and_result(tmp_path, fake_collector):
+    path = tmp_path / 'd.sock'
+
+    async def run():
+        d, task = await _serve(path)
+        replies = await _request(path, {'op': 'collect', 'target': '@chan', 'limit': 5})
+        status, = await _request(path, {'op': 'status'})
+        shutdown, = await _request(path, {'op': 'shutdown'})
+        await asyncio.wait_for(task, 5)
+        return d, replies, status, shutdown
+
+    d, replies, status, shutdown = asyncio.run(run())
+    events = [r['event'] for r in replies]
+    assert events[0] == 'accepted' and events[-1] == 'done'
+    assert set(events[1:-1]) <= {'progress'}
+    job = replies[-1]['job']
+    assert (job['id'], job['status'], job['result']['messages']) == (1, 'done', 5)
+    assert status['running'] == 0 and [j['id'] for j in status['jobs']] == [1]
+    assert shutdown['event'] == 'shutdown'
+    assert not path.exists()
+    assert d.sink.flushes >= 2
+    assert fake_collector == [('@chan', 5)]
+
+
+def test_concurrent_requests_get_distinct_ids_and_share_duplicates(tmp_path, fake_collector):
+    path = tmp_path / 'd.sock'
+
+    async def run():
+        d, task = await _serve(path)
+        replies = await asyncio.gather(
+            _request(path, {'op': 'collect', 'target': 'a', 'detach': True}),
+            _request(path, {'op': 'collect', 'target': 'a', 'detach': True}),
+            _request(path, {'op': 'collect', 'target': 'b', 'detach': True}),
+        )
+        await asyncio.sleep(0.1)
+        d.stop()
+        await asyncio.wait_for(task, 5)
+        return replies
+
+    replies = asyncio.run(run())
+    ids = [r[0]['job']['id'] for r in replies]
+    assert [len(r) for r in replies] == [1, 1, 1]
+    assert ids[0] == ids[1] and ids[2] != ids[0]
+    assert sorted(fake_collector) == [('a', None), ('b', None)]
+
+
+@pytest.mark.parametrize('payload, message', [
+    ({'op': 'collect', 'target': 'unknown'}, "could not resolve target 'unknown'"),
+    ({'op': 'collect', 'target': 'broken'}, "could not resolve target 'broken'"),
+    ({'op': 'collect'}, 'collect needs a target'),
+    ({'op': 'cancel', 'job': 7}, 'no job 7'),
+    ({'op': 'frobnicate'}, "unknown op 'frobnicate'"),
+])
+def test_request_errors_are_answered(tmp_path, fake_collector, payload, message):
+    path = tmp_path / 'd.sock'
+
+    async def run():
+        d, task = await _serve(path)
+        replies = await _request(path, payload)
+        d.stop()
+        await asyncio.wait_for(task, 5)
+        return replies
+
+    reply, = asyncio.run(run())
+    assert reply['event'] == 'error'
+    assert reply['error'].startswith(message)
+
+
+def test_ctl_exit_codes(tmp_path, fake_collector, capsys):
+    path = tmp_path / 'd.sock'
+
+    async def run():
+        d, task = await _serve(path)
+        ok = await asyncio.to_thread(collectorctl.request, str(path), {'op': 'collect', 'target': 'x', 'limit': 2})
+        bad = await asyncio.to_thread(collectorctl.request, str(path), {'op': 'collect', 'target': 'unknown'})
+        d.stop()
+        await asyncio.wait_for(task, 5)
+        return ok, bad
+
+    assert asyncio.run(run()) == (0, 1)
+    assert collectorctl.request(str(tmp_path / 'none.sock'), {'op': 'status'}) == 2
+
+
+def test_ctl_fails_when_the_daemon_hangs_up(tmp_path):
+    path = tmp_path / 'd.sock'
+
+    async def run():
+        async def hang_up(reader, writer):
+            await reader.readline()
+            writer.close()
+        server = await asyncio.start_unix_server(hang_up, str(path))
+        async with server:
+            return await asyncio.to_thread(collectorctl.request, str(path), {'op': 'collect', 'target': 'x'})
+
+    assert asyncio.run(run()) == 1
+
+
+def test_jobs_can_fail_or_be_cancelled(tmp_path, fake_collector, monkeypatch):
+    path = tmp_path / 'd.sock'
+
+    async def consume_messages(client, entity, sink, **kw):
+        if entity == 'crash':
+            raise ConnectionError('database down')
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(daemon_mod, 'consume_messages', consume_messages)
+
+    async def run():
+        d, task = await _serve(path)
+        failed = await _request(path, {'op': 'collect', 'target': 'crash'})
+        accepted, = await _request(path, {'op': 'collect', 'target': 'slow', 'detach': True})
+        cancelled, = await _request(path, {'op': 'cancel', 'job': accepted['job']['id']})
+        await asyncio.sleep(0.05)
+        status, = await _request(path, {'op': 'status'})
+        bad, = await _request(path, 'not an object')
+        d.stop()
+        await asyncio.wait_for(task, 5)
+        return failed, cancelled, status, bad
+
+    failed, cancelled, status, bad = asyncio.run(run())
+    # the request is answered even though the collection failed
+    assert failed[-1]['event'] == 'done'
+    assert failed[-1]['job']['status'] == 'failed'
+    assert failed[-1]['job']['error'] == "ConnectionError('database down')"
+    assert cancelled['event'] == 'cancelled'
+    assert [j['status'] for j in status['jobs']] == ['failed', 'cancelled']
+    assert status['running'] == 0
+    assert bad == {'event': 'error', 'error': 'bad request: expected a JSON object'}
@@ -0,0 +1,56 @@
+"""Entity cache keys and persistence."""
+import asyncio
+import time
+
+from telethon.tl import types
+
+from collector.entity_cache import EntityCache, target_key
+from collector.resolve import resolve
+
+
+def _channel(channel_id=1234, username='Alpha'):
+    return types.Channel(
+        channel_id, 'Alpha', types.ChatPhotoEmpty(), None, access_hash=99, username=username,
+    )
+
+
+def test_target_key():
+    assert target_key('@Alpha ') == 'alpha'
+    assert target_key(' -1001234') == '-1001234'
+    assert target_key(42) == '42'
+
+
+def test_add_keys_by_marked_id_username_and_targets(tmp_path):
+    path = tmp_path / 's.entities.json'
+    with EntityCache(path) as cache:
+        cache.add(_channel(), 'https_alias')
+    cache = EntityCache(path)
+    peer, fresh = cache.lookup('@alpha')
+    assert (peer, fresh) == (types.InputPeerChannel(1234, 99), True)
+    assert cache.lookup('-1000000001234')[0] == peer
+    assert cache.lookup('https_alias')[0] == peer
+    # bare ids of users, chats and channels overlap
+    assert cache.lookup('1234') == (None, False)
+
+
+def test_stale_entries_are_not_fresh(tmp_path, monkeypatch):
+    cache = EntityCache(tmp_path / 'c.json', ttl=60)
+    cache.add(_channel(username=None))
+    monkeypatch.setattr(time, 'time', lambda: 1e12)
+    assert cache.lookup('-1000000001234') == (types.InputPeerChannel(1234, 99), False)
+
+
+def test_resolve_answers_cached_targets_without_requests(tmp_path):
+    class Client:
+        calls = 0
+
+        async def get_entity(self, target):
+            Client.calls += 1
+            return _channel()
+
+    cache = EntityCache(tmp_path / 'c.json')
+    first = asyncio.run(resolve(Client(), '@Alpha', cache=cache))
+    again = asyncio.run(resolve(Client(), 'alpha', cache=cache))
+    assert Client.calls == 1
+    assert again == types.InputPeerChannel(first.id, first.access_hash)
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,135 @@
+"""Media metadata: extraction from TL objects and the `message_media` merge."""
+import asyncio
+import datetime
+import hashlib
+from types import SimpleNamespace
+
+from telethon.tl import types
+
+from collector import downloader
+from collector.downloader import MediaStore
+from collector.media import MediaInfo, extract_media
+from collector.storage import batch_sink
+from collector.storage.batch_sink import merge_rows
+
+DATE = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def test_extract_photo_takes_largest_size():
+    photo = types.Photo(7, 1, b'', DATE, [
+        types.PhotoSize('m', 320, 240, 1000),
+        types.PhotoSizeProgressive('y', 1280, 960, [2000, 9000]),
+    ], 2)
+    info = extract_media(types.MessageMediaPhoto(photo=photo))
+    assert info == MediaInfo('photo', 'photo-7', None, 9000, 'image/jpeg', 1280, 960)
+
+
+def test_extract_document_kinds():
+    video = types.Document(9, 1, b'', DATE, 'video/mp4', 5000, 2, [
+        types.DocumentAttributeVideo(12.5, 640, 360),
+        types.DocumentAttributeFilename('clip.mp4'),
+    ])
+    info = extract_media(types.MessageMediaDocument(document=video))
+    assert (info.kind, info.file_unique_id, info.size, info.duration, info.file_name) == (
+        'video', 'document-9', 5000, 12.5, 'clip.mp4',
+    )
+    voice = types.Document(10, 1, b'', DATE, 'audio/ogg', 100, 2, [types.DocumentAttributeAudio(3, voice=True)])
+    assert extract_media(types.MessageMediaDocument(document=voice)).kind == 'voice'
+    assert extract_media(types.MessageMediaDice(4, '🎲')).kind == 'dice'
+    assert extract_media(None) is None
+
+
+class MergeConn:
+    """Records the statements `merge_rows` runs; every staged message counts as written."""
+
+    def __init__(self):
+        self.staged = []
+        self.media = []
+        self.deleted = []
+
+    async def execute(self, sql, *args):
+        if 'DELETE FROM message_media' in sql:
+            self.deleted += list(zip(*args))
+            return f'DELETE {len(args[0])}'
+        return 'INSERT 0 0'
+
+    async def copy_records_to_table(self, table, records, columns):
+        (self.staged if table == 'messages_staging' else self.media).extend(records)
+
+    async def fetch(self, sql):
+        return [{'entity_id': r[0], 'id': r[1]} for r in self.staged if r[1] != 3]
+
+
+def test_merge_rows_clears_media_of_changed_messages_without_media(monkeypatch):
+    async def create_staging(conn):
+        pass
+
+    monkeypatch.setattr(batch_sink, 'create_staging', create_staging)
+    monkeypatch.setattr('collector.storage.media_store.create_media_staging', create_staging)
+    photo = MediaInfo('photo', 'photo-1').row(-100, 1)
+    rows = [
+        (-100, 1, DATE, 's', 'a', True, 11, photo),
+        (-100, 2, DATE, 's', 'edited, photo removed', False, 12, None),
+        # unchanged (not written): its media row is left alone
+        (-100, 3, DATE, 's', 'c', False, 13, None),
+    ]
+    conn = MergeConn()
+    assert asyncio.run(merge_rows(conn, rows)) == 2
+    assert conn.media == [photo]
+    assert conn.deleted == [(-100, 2)]
+
+
+def _photo_message(mid, photo_id):
+    photo = types.Photo(photo_id, 1, b'', DATE, [types.PhotoSize('x', 10, 10, 4)], 2)
+    return SimpleNamespace(id=mid, media=types.MessageMediaPhoto(photo=photo))
+
+
+class Pool:
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class MediaClient:
+    """Message 1 lost its photo in an edit, 2 still carries photo 7, 3 was deleted."""
+
+    def __init__(self):
+        self.messages = {1: SimpleNamespace(id=1, media=None), 2: _photo_message(2, 7)}
+
+    async def get_input_entity(self, entity_id):
+        return entity_id
+
+    async def get_messages(self, peer, ids):
+        return [self.messages.get(i) for i in ids]
+
+    async def download_media(self, m, file):
+        await file.write(b'jpeg')
+        return file
+
+
+def test_download_falls_back_to_another_message_with_the_file(tmp_path, monkeypatch):
+    recorded = []
+
+    async def pending_media(conn, **kwargs):
+        return [
+            {'file_unique_id': 'photo-7', 'entity_ids': [-1001, -1001], 'message_ids': [1, 2]},
+            {'file_unique_id': 'photo-8', 'entity_ids': [-1001], 'message_ids': [3]},
+        ]
+
+    async def record_media_file(conn, *args):
+        recorded.append(args)
+
+    monkeypatch.setattr(downloader, 'pending_media', pending_media)
+    monkeypatch.setattr(downloader, 'record_media_file', record_media_file)
+    stats = asyncio.run(downloader.download_media(
+        MediaClient(), store=MediaStore(tmp_path), pool=Pool(), concurrency=2,
+    ))
+    assert (stats.files, stats.bytes, stats.missing, stats.failed) == (1, 4, 1, 0)
+    path = '-7/photo-7.jpg'
+    assert recorded == [('photo-7', path, 4, hashlib.sha256(b'jpeg').hexdigest())]
+    assert (tmp_path / path).read_bytes() == b'jpeg'
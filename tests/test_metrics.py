@@ -0,0 +1,75 @@
+"""Metric rendering in the Prometheus text format, and the collector's counters."""
+import asyncio
+
+import pytest
+from telethon.tl.types import PeerChannel
+
+from collector import metrics
+from collector.consumer import consume_messages
+from collector.metrics import Counter, Histogram, Registry, start_metrics_server
+from tests.fakes import ChannelsClient
+
+
+def test_counter_and_histogram_render():
+    registry = Registry()
+    fetched = registry.register(Counter('fetched_total', 'Fetched', ('entity',)))
+    fetch = registry.register(Histogram('fetch_seconds', 'Fetch time', buckets=(0.1, 1.0)))
+    fetched.inc(entity=-1001)
+    fetched.inc(2, entity='a"b')
+    for v in (0.05, 0.5, 0.5, 3.0):
+        fetch.observe(v)
+    assert registry.render().splitlines() == [
+        '# HELP fetched_total Fetched',
+        '# TYPE fetched_total counter',
+        'fetched_total{entity="-1001"} 1',
+        'fetched_total{entity="a\\"b"} 2',
+        '# HELP fetch_seconds Fetch time',
+        '# TYPE fetch_seconds histogram',
+        'fetch_seconds_bucket{le="0.1"} 1',
+        'fetch_seconds_bucket{le="1"} 3',
+        'fetch_seconds_bucket{le="+Inf"} 4',
+        'fetch_seconds_sum 4.05',
+        'fetch_seconds_count 4',
+    ]
+    assert registry.snapshot()['fetch_seconds'] == {'all': {'count': 4, 'avg': 1.0125, 'max': 3.0}}
+    with pytest.raises(ValueError):
+        fetched.inc(sink='x')
+    with pytest.raises(ValueError):
+        registry.register(Counter('fetched_total', 'again'))
+
+
+def test_collection_updates_the_counters():
+    metrics.REGISTRY.reset()
+
+    async def sink(m):
+        pass
+
+    asyncio.run(consume_messages(ChannelsClient({'a': (1, 150)}), PeerChannel(1), sink))
+    entity = '-1000000000001'
+    assert metrics.MESSAGES_FETCHED.values == {(entity,): 150}
+    assert metrics.MESSAGES_STORED.values == {(entity,): 150}
+    assert metrics.PAGE_FETCH_SECONDS.snapshot()['all']['count'] == 2
+    assert 'messages: 150 fetched, 150 normalized, 0 skipped, 150 stored' in metrics.format_summary()
+    metrics.REGISTRY.reset()
+
+
+def test_metrics_endpoint():
+    registry = Registry()
+    registry.register(Counter('up_total', 'Up')).inc()
+
+    async def get(path):
+        server = await start_metrics_server(0, registry=registry)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: x\r\n\r\n'.encode())
+            response = await reader.read()
+            writer.close()
+            return response
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    ok = asyncio.run(get('/metrics'))
+    assert ok.startswith(b'HTTP/1.1 200 OK') and ok.endswith(b'up_total 1\n')
+    assert asyncio.run(get('/other')).startswith(b'HTTP/1.1 404')
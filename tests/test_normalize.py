@@ -0,0 +1,99 @@
+"""`normalize_batch` must produce exactly what `normalize_message` does."""
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+from collector.consumer import process_batch
+from collector.normalize import content_hash, normalize_batch, normalize_message
+
+UTC = datetime.timezone.utc
+
+
+def _msg(mid, **kw):
+    fields = dict(
+        id=mid, chat_id=-1001, sender_id=-1001, date=datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=UTC),
+        text=f'message {mid}', media=None,
+    )
+    fields.update(kw)
+    return SimpleNamespace(**fields)
+
+
+MESSAGES = [
+    _msg(1),
+    _msg(2, text='two\nlines'),
+    _msg(3, text=None),
+    _msg('4', chat_id='-1002', sender_id=77),
+    _msg(5, date='2024-01-02T03:04:05+00:00'),
+    _msg(6, date='not a date'),
+    _msg(7, media=object()),
+    # invalid: no id, no chat, no sender
+    _msg(None),
+    _msg(8, chat_id=None),
+    _msg(9, sender_id=None),
+    _msg('x'),
+]
+
+
+def _expected():
+    rows, errors = [], []
+    for m in MESSAGES:
+        try:
+            rows.append(normalize_message(m))
+        except ValueError as e:
+            errors.append((m, str(e)))
+    return rows, errors
+
+
+def test_batch_matches_single_messages():
+    expected, expected_errors = _expected()
+    errors = []
+    rows = normalize_batch(MESSAGES, on_error=lambda m, e: errors.append((m, str(e))))
+    assert rows == [n.row() for n in expected]
+    assert errors == expected_errors
+    assert len(rows) == 7
+
+
+def test_coercions():
+    rows = normalize_batch(MESSAGES, on_error=None)
+    by_id = {r[1]: r for r in rows}
+    assert by_id[2][4] == 'two lines'
+    assert by_id[3][4] == ''
+    assert by_id[4][:2] == (-1002, 4) and by_id[4][3] == '77'
+    assert by_id[5][2] == datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=UTC)
+    assert by_id[6][2] is None
+    assert by_id[7][5] is True and by_id[7][6] is not None
+
+
+def test_content_hash_covers_the_attached_file():
+    base = content_hash('1', 'text', True)
+    assert content_hash('1', 'text', True, None) == base
+    assert content_hash('1', 'text', True, 'AQAD1') != base
+    assert content_hash('1', 'text', True, 'AQAD1') != content_hash('1', 'text', True, 'AQAD2')
+    assert content_hash('1', 'text', False) != content_hash('1', 'text', True)
+
+
+def test_process_batch_row_path_matches_message_path():
+    class RowSink:
+        def __init__(self):
+            self.rows = []
+
+        async def add_rows(self, rows):
+            self.rows.extend(rows)
+
+        async def __call__(self, m):
+            raise AssertionError('pages go through add_rows')
+
+    messages = []
+
+    async def message_sink(m):
+        messages.append(m)
+
+    sink = RowSink()
+    assert asyncio.run(process_batch(MESSAGES, sink)) == 7
+    assert asyncio.run(process_batch(MESSAGES, message_sink)) == 7
+    assert sink.rows == [m.row() for m in messages]
+
+
+def test_normalized_message_has_no_instance_dict():
+    m = normalize_message(MESSAGES[0])
+    assert not hasattr(m, '__dict__')
@@ -0,0 +1,105 @@
+"""Staged pipeline: every message reaches the sink; checkpoints follow flushes."""
+import asyncio
+
+import pytest
+from telethon.tl.types import PeerChannel
+
+from collector.pipeline import run_pipeline
+from scripts.benchmark import ENTITY_ID, FakeClient, FakeMessage, _CHANNEL_ID
+
+
+class MemoryState:
+    def __init__(self, marks=None):
+        self.marks = dict(marks or {})
+        self.events = []
+
+    async def get(self, entity_id):
+        return self.marks.get(entity_id)
+
+    async def advance(self, marks):
+        self.events.append(('advance', dict(marks)))
+        for k, v in marks.items():
+            self.marks[k] = max(self.marks.get(k, 0), v)
+
+
+class BufferingSink:
+    def __init__(self, state):
+        self.state_events = state.events
+        self.pending = []
+        self.stored = []
+
+    async def __call__(self, item):
+        self.pending.append(item.id)
+
+    async def flush(self):
+        self.state_events.append(('flush', len(self.pending)))
+        self.stored += self.pending
+        self.pending = []
+
+
+def test_pipeline_stores_every_message_in_order():
+    state = MemoryState()
+    sink = BufferingSink(state)
+    stats = asyncio.run(run_pipeline(
+        FakeClient(250), PeerChannel(_CHANNEL_ID), sink, fetch_queue_size=10, store_queue_size=10,
+    ))
+    assert (stats.stored, stats.skipped) == (250, 0)
+    assert sink.pending == list(range(250, 0, -1))
+    assert stats.stream.pages == 3
+
+
+def test_pipeline_flushes_before_advancing_checkpoint():
+    state = MemoryState({ENTITY_ID: 100})
+    sink = BufferingSink(state)
+    stats = asyncio.run(run_pipeline(FakeClient(180), PeerChannel(_CHANNEL_ID), sink, state=state))
+    assert stats.stored == 80
+    assert state.events == [('flush', 80), ('advance', {ENTITY_ID: 180})]
+    assert sink.stored == list(range(101, 181))
+
+
+class RawMessage(FakeMessage):
+    __slots__ = ()
+
+    def __bytes__(self):
+        return b'tl:%d' % self.id
+
+
+class RawClient(FakeClient):
+    async def iter_messages(self, *args, **kwargs):
+        async for m in super().iter_messages(*args, **kwargs):
+            yield RawMessage(m.id, m.text, m.media is not None)
+
+
+class ArchivingSink:
+    archive_raw = True
+
+    def __init__(self):
+        self.raw = {}
+
+    async def __call__(self, item):
+        self.raw[item.id] = item.raw
+
+
+def test_pipeline_attaches_raw_payloads_for_archiving_sinks():
+    sink = ArchivingSink()
+    asyncio.run(run_pipeline(RawClient(5), PeerChannel(_CHANNEL_ID), sink))
+    assert sink.raw == {i: b'tl:%d' % i for i in range(1, 6)}
+
+    sink.archive_raw = False
+    sink.raw.clear()
+    asyncio.run(run_pipeline(RawClient(5), PeerChannel(_CHANNEL_ID), sink))
+    assert set(sink.raw.values()) == {None}
+
+
+def test_sink_error_cancels_the_pipeline_and_is_raised():
+    state = MemoryState()
+
+    class Broken(BufferingSink):
+        async def __call__(self, item):
+            raise ConnectionError('database down')
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run_pipeline(FakeClient(5000), PeerChannel(_CHANNEL_ID), Broken(state), state=state))
+    assert state.events == []
+    with pytest.raises(ValueError):
+        asyncio.run(run_pipeline(FakeClient(1), PeerChannel(_CHANNEL_ID), Broken(state), sink_workers=0))
@@ -0,0 +1,73 @@
+"""`plan_sync` ordering from one dialogs sweep."""
+import asyncio
+from types import SimpleNamespace
+
+from telethon.tl import types
+
+from collector import planner
+from collector.entity_cache import EntityCache
+from collector.planner import plan_sync
+from collector.storage.state_store import FileStateStore
+
+
+def _dialog(peer, username, top):
+    entity = SimpleNamespace(id=abs(peer) % 10**10, username=username, peer=peer)
+    return SimpleNamespace(entity=entity, dialog=SimpleNamespace(top_message=top), message=None)
+
+
+class FakeClient:
+    def __init__(self, dialogs):
+        self.dialogs = dialogs
+
+    async def iter_dialogs(self, limit=None):
+        for d in self.dialogs[:limit]:
+            yield d
+
+
+def test_plan_orders_by_lag_and_skips_up_to_date(tmp_path, monkeypatch):
+    monkeypatch.setattr(planner, 'get_peer_id', lambda e: e.peer)
+    client = FakeClient([
+        _dialog(-1001, 'alpha', 105),
+        _dialog(-1002, 'beta', 40),
+        _dialog(-1003, 'gamma', 90),
+        _dialog(-1004, None, 7),
+    ])
+    state = FileStateStore(tmp_path / 'state.json')
+    asyncio.run(state.advance({-1001: 100, -1002: 40, -1003: 40}))
+
+    targets = ['@alpha', 'beta', 'missing', 'Gamma', '-1004', 'alpha', '-1001', 'other']
+    plan = asyncio.run(plan_sync(client, targets, state))
+
+    # most behind first; unknown targets last, in their original order
+    assert plan.targets == ['Gamma', '-1004', '@alpha', 'missing', 'other']
+    assert [p.lag for p in plan.due] == [50, 7, 5, None, None]
+    assert [p.target for p in plan.skipped] == ['beta']
+    assert plan.dialogs == 4
+
+
+def test_plan_respects_dialog_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(planner, 'get_peer_id', lambda e: e.peer)
+    client = FakeClient([_dialog(-1001, 'alpha', 5), _dialog(-1002, 'beta', 5)])
+    plan = asyncio.run(plan_sync(client, ['alpha', 'beta'], FileStateStore(tmp_path / 's.json'), limit=1))
+    assert [(p.target, p.lag) for p in plan.due] == [('alpha', 5), ('beta', None)]
+
+
+def test_plan_does_not_match_bare_ids(tmp_path, monkeypatch):
+    monkeypatch.setattr(planner, 'get_peer_id', lambda e: e.peer)
+    client = FakeClient([_dialog(-1001, 'alpha', 5)])
+    plan = asyncio.run(plan_sync(client, ['1001', '-1001'], FileStateStore(tmp_path / 's.json')))
+    assert [(p.target, p.entity_id) for p in plan.due] == [('-1001', -1001), ('1001', None)]
+
+
+def test_plan_fills_entity_cache_and_reads_top_from_last_message(tmp_path):
+    channel = types.Channel(1234, 'Alpha', types.ChatPhotoEmpty(), None, access_hash=99, username='alpha')
+    # dialogs without `top_message` fall back to the id of their last message
+    client = FakeClient([SimpleNamespace(entity=channel, dialog=SimpleNamespace(), message=SimpleNamespace(id=12))])
+    state = FileStateStore(tmp_path / 's.json')
+    asyncio.run(state.advance({-1000000001234: 4}))
+    cache = EntityCache(tmp_path / 's.entities.json')
+
+    plan = asyncio.run(plan_sync(client, ['alpha'], state, entity_cache=cache))
+    assert [(p.entity_id, p.top_id, p.lag) for p in plan.due] == [(-1000000001234, 12, 8)]
+    assert cache.lookup('@alpha')[0] == types.InputPeerChannel(1234, 99)
+    assert plan.summary().startswith('1 targets due (0 not in dialogs), 0 up to date; ~8 new message ids; 1 dialogs')
@@ -0,0 +1,135 @@
+"""Raw archive blocks: one compressed block per entity, read back by slice."""
+import asyncio
+import datetime
+import zlib
+
+from collector.storage import raw_archive
+from collector.storage.raw_archive import RawArchive, archived_keys, write_raw
+
+
+class FakeConn:
+    """Just enough of an asyncpg connection for `write_raw` and `RawArchive`."""
+
+    def __init__(self):
+        self.blocks = {}
+        self.index = {}
+        self.block_reads = 0
+
+    async def fetchval(self, sql, entity_id, layer, codec, messages, raw_bytes, data):
+        block_id = len(self.blocks) + 1
+        self.blocks[block_id] = dict(entity_id=entity_id, codec=codec, messages=messages, raw_bytes=raw_bytes, data=data)
+        return block_id
+
+    async def execute(self, sql, entity_id, block_id, ids, starts, lengths):
+        for mid, start, length in zip(ids, starts, lengths):
+            self.index[(entity_id, mid)] = (block_id, start, length)
+
+    async def fetch(self, sql, *args):
+        if 'FROM message_raw_blocks' in sql:
+            self.block_reads += 1
+            return [{'id': b, 'codec': self.blocks[b]['codec'], 'data': self.blocks[b]['data']} for b in args[0]]
+        if 'JOIN message_raw' in sql:
+            return [{'entity_id': e, 'id': i} for e, i in zip(*args) if (e, i) in self.index]
+        entity_id, ids = args
+        return [
+            {'id': mid, 'block_id': b, 'start': s, 'length': n}
+            for (e, mid), (b, s, n) in self.index.items() if e == entity_id and mid in ids
+        ]
+
+    def cursor(self, sql, entity_id, *bounds):
+        rows = sorted(
+            ((b, s, mid, n) for (e, mid), (b, s, n) in self.index.items() if e == entity_id),
+        )
+
+        async def gen():
+            for b, s, mid, n in rows:
+                yield {'id': mid, 'block_id': b, 'start': s, 'length': n}
+        return gen()
+
+    def transaction(self):
+        return _Ctx(None)
+
+
+class _Ctx:
+    def __init__(self, value):
+        self.value = value
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return _Ctx(self.conn)
+
+
+PAYLOADS = {
+    (-1001, 3): b'third' * 20,
+    (-1001, 1): b'first' * 20,
+    (-1002, 1): b'other entity',
+    (-1001, 2): b'',
+}
+
+
+def test_write_raw_one_block_per_entity():
+    conn = FakeConn()
+    done = asyncio.run(write_raw(conn, PAYLOADS))
+    assert (done.messages, done.blocks) == (4, 2)
+    assert done.raw_bytes == sum(len(p) for p in PAYLOADS.values())
+    assert done.stored_bytes == sum(len(b['data']) for b in conn.blocks.values())
+    block = conn.blocks[conn.index[(-1001, 1)][0]]
+    assert block['codec'] == raw_archive.CODEC and block['messages'] == 3
+    # payloads are stored back to back in id order
+    assert zlib.decompress(block['data']) == PAYLOADS[(-1001, 1)] + PAYLOADS[(-1001, 2)] + PAYLOADS[(-1001, 3)]
+    assert [conn.index[(-1001, i)][1] for i in (1, 2, 3)] == [0, 100, 100]
+
+
+def test_archive_reads_slices_and_caches_blocks():
+    conn = FakeConn()
+    asyncio.run(write_raw(conn, PAYLOADS))
+    archive = RawArchive(FakePool(conn))
+
+    got = asyncio.run(archive.payloads(-1001, [1, 2, 3, 99]))
+    assert got == {1: PAYLOADS[(-1001, 1)], 2: b'', 3: PAYLOADS[(-1001, 3)]}
+    assert asyncio.run(archive.payloads(-1002, [1])) == {1: b'other entity'}
+    reads = conn.block_reads
+    asyncio.run(archive.payloads(-1001, [3]))
+    assert conn.block_reads == reads
+
+    async def walk():
+        return [(r.id, r.payload) async for r in archive.iter_entity(-1001)]
+    assert asyncio.run(walk()) == [(mid, PAYLOADS[(-1001, mid)]) for mid in (1, 2, 3)]
+
+
+def test_block_cache_is_bounded():
+    archive = RawArchive(FakePool(FakeConn()), cache_blocks=2)
+    for b in range(1, 5):
+        archive._remember(b, b'x')
+    assert list(archive._blocks) == [3, 4]
+
+
+def test_archived_keys():
+    conn = FakeConn()
+    asyncio.run(write_raw(conn, PAYLOADS))
+    keys = [(-1001, 1), (-1001, 7), (-1002, 1), (-1003, 1)]
+    assert asyncio.run(archived_keys(conn, keys)) == {(-1001, 1), (-1002, 1)}
+    assert asyncio.run(archived_keys(conn, [])) == set()
+
+
+def test_payload_decodes_back_to_message():
+    from telethon.tl import types
+
+    m = types.Message(
+        id=42, peer_id=types.PeerChannel(1234), date=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        message='hello', views=17, forwards=2,
+    )
+    payload = raw_archive.raw_payload(m)
+    decoded = raw_archive.decode_payload(payload)
+    assert (decoded.id, decoded.message, decoded.views) == (42, 'hello', 17)
+    assert raw_archive.raw_payload(object()) is None
@@ -0,0 +1,90 @@
+"""Edit and deletion reconciliation against a window of recent history."""
+import asyncio
+import sys
+
+import pytest
+from telethon.tl.types import PeerChannel
+
+from collector.normalize import content_hash, normalize_batch
+from collector.reconcile import reconcile
+from tests.fakes import ChannelsClient, Message
+
+# `collector.reconcile` is also the name of the re-exported function
+reconcile_module = sys.modules['collector.reconcile']
+
+CHANNEL_ID = 1
+ENTITY_ID = -1000000000001
+
+
+class RowSink:
+    archive_raw = False
+
+    def __init__(self):
+        self.rows = []
+
+    async def add_rows(self, rows):
+        self.rows.extend(rows)
+
+
+def _stored(ids):
+    rows = normalize_batch([Message(CHANNEL_ID, mid) for mid in ids])
+    return {r[1]: (r[2], content_hash(r[3], r[4], r[5], r[6] and r[6].file_unique_id)) for r in rows}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Messages 101..300 stored, except 299; 250 stored with an older text."""
+    stored = _stored(mid for mid in range(101, 301) if mid != 299)
+    stored[250] = (stored[250][0], 0)
+    marked = []
+
+    async def stored_window(entity_id, *, min_id=None, since=None, pool=None):
+        assert entity_id == ENTITY_ID
+        return {mid: v for mid, v in stored.items() if min_id is None or mid >= min_id}
+
+    async def mark_deleted(entity_id, keys, *, pool=None):
+        keys = list(keys)
+        marked.extend(keys)
+        return len(keys)
+
+    monkeypatch.setattr(reconcile_module, 'stored_window', stored_window)
+    monkeypatch.setattr(reconcile_module, 'mark_deleted', mark_deleted)
+    return stored, marked
+
+
+def test_reconcile_stores_changes_and_marks_deletions(store):
+    stored, marked = store
+    client = ChannelsClient({'news': (CHANNEL_ID, 300)})
+    client.deleted = {(CHANNEL_ID, 120), (CHANNEL_ID, 130)}
+    sink = RowSink()
+    result = asyncio.run(reconcile(client, PeerChannel(CHANNEL_ID), sink, last=200))
+
+    assert (result.fetched, result.stored) == (198, 199)
+    assert (result.edited, result.new) == (1, 1)
+    # only the edited and the new message are written
+    assert [r[1] for r in sink.rows] == [299, 250]
+    assert (result.candidates, result.deleted) == (2, 2)
+    assert marked == [(120, stored[120][0]), (130, stored[130][0])]
+
+
+def test_missing_message_still_on_the_server_is_not_deleted(store, monkeypatch):
+    _, marked = store
+    client = ChannelsClient({'news': (CHANNEL_ID, 300)})
+    client.deleted = {(CHANNEL_ID, 120)}
+
+    # 120 comes back when asked for by id, e.g. it was only hidden from the scan
+    async def get_messages(entity, ids):
+        return [Message(CHANNEL_ID, mid) for mid in ids]
+
+    monkeypatch.setattr(client, 'get_messages', get_messages)
+    result = asyncio.run(reconcile(client, PeerChannel(CHANNEL_ID), RowSink(), last=200))
+    assert (result.candidates, result.deleted) == (1, 0)
+    assert marked == []
+
+
+def test_reconcile_needs_exactly_one_window():
+    client = ChannelsClient({'news': (CHANNEL_ID, 10)})
+    with pytest.raises(ValueError):
+        asyncio.run(reconcile(client, PeerChannel(CHANNEL_ID), RowSink()))
+    with pytest.raises(ValueError):
+        asyncio.run(reconcile(client, PeerChannel(CHANNEL_ID), RowSink(), last=10, days=1))
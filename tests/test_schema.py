@@ -0,0 +1,52 @@
+"""Monthly partitions of `messages` and the per-process partition cache."""
+import asyncio
+import datetime
+
+import pytest
+
+from collector.storage import schema
+from collector.storage.schema import ensure_partitions
+
+
+class Conn:
+    def __init__(self, in_transaction=False):
+        self.in_transaction = in_transaction
+        self.created = []
+
+    def is_in_transaction(self):
+        return self.in_transaction
+
+    async def execute(self, sql):
+        self.created.append(sql.split()[5])
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(schema, '_known_partitions', set())
+
+
+def _d(year, month, day=1):
+    return datetime.datetime(year, month, day, tzinfo=datetime.timezone.utc)
+
+
+def test_creates_each_month_once_per_process():
+    conn = Conn()
+    asyncio.run(ensure_partitions(conn, [_d(2024, 12, 31), _d(2024, 1, 5), None, _d(2024, 12, 1)]))
+    assert conn.created == ['messages_p2024_01', 'messages_p2024_12']
+    asyncio.run(ensure_partitions(conn, [_d(2024, 12, 20), _d(2025, 1, 1)]))
+    assert conn.created[2:] == ['messages_p2025_01']
+
+
+def test_month_is_taken_in_utc():
+    conn = Conn()
+    east = datetime.timezone(datetime.timedelta(hours=3))
+    asyncio.run(ensure_partitions(conn, [datetime.datetime(2024, 3, 1, 1, tzinfo=east)]))
+    assert conn.created == ['messages_p2024_02']
+
+
+def test_partitions_created_in_a_transaction_are_not_cached():
+    # the transaction may still roll back and take the partition with it
+    asyncio.run(ensure_partitions(Conn(in_transaction=True), [_d(2024, 5)]))
+    conn = Conn()
+    asyncio.run(ensure_partitions(conn, [_d(2024, 5)]))
+    assert conn.created == ['messages_p2024_05']
@@ -0,0 +1,71 @@
+"""Search cursors and the date slices search pages walk through."""
+import datetime
+
+import pytest
+
+from collector.storage.search import SearchCursor, _SLICE_DAYS, _date_slices, _like_pattern, build_search_query
+
+UTC = datetime.timezone.utc
+UNTIL = datetime.datetime(2025, 6, 1, tzinfo=UTC)
+
+
+def test_cursor_roundtrip():
+    cursor = SearchCursor(0.125, datetime.datetime(2024, 5, 6, 7, 8, 9, 123456, tzinfo=UTC), -1001234567890, 42)
+    token = cursor.encode()
+    assert '=' not in token
+    assert SearchCursor.decode(token) == cursor
+
+
+@pytest.mark.parametrize('token', ['', 'not-base64!', 'WzEsMl0'])
+def test_cursor_decode_rejects_garbage(token):
+    with pytest.raises(ValueError):
+        SearchCursor.decode(token)
+
+
+def _check_contiguous(slices, since):
+    assert slices[0][1] == UNTIL
+    for (start, _), (_, end) in zip(slices, slices[1:]):
+        assert start == end
+    assert slices[-1][0] == since
+
+
+def test_slices_without_lower_bound():
+    slices = list(_date_slices(None, UNTIL))
+    assert len(slices) == len(_SLICE_DAYS) + 1
+    assert [UNTIL - s for s, _ in slices[:-1]] == [datetime.timedelta(days=d) for d in _SLICE_DAYS]
+    _check_contiguous(slices, None)
+
+
+def test_slices_stop_at_since():
+    since = UNTIL - datetime.timedelta(days=10)
+    slices = list(_date_slices(since, UNTIL))
+    assert slices == [(UNTIL - datetime.timedelta(days=7), UNTIL), (since, UNTIL - datetime.timedelta(days=7))]
+
+
+def test_single_slice_for_short_ranges():
+    since = UNTIL - datetime.timedelta(days=1)
+    assert list(_date_slices(since, UNTIL)) == [(since, UNTIL)]
+
+
+def test_like_pattern_escapes_wildcards():
+    assert _like_pattern('50%_off\\') == '%50\\%\\_off\\\\%'
+
+
+def test_query_parameters_are_numbered_after_the_text():
+    after = SearchCursor(0.5, UNTIL, -1001, 7)
+    sql, args = build_search_query('fuzzy', (), entity_ids=[-1001], since=UNTIL, after=after)
+    assert args == [[-1001], UNTIL, 0.5, UNTIL, -1001, 7]
+    assert 'entity_id = ANY($2::bigint[])' in sql and 'date >= $3' in sql
+    assert '($4::real, $5, $6, $7)' in sql and 'LIMIT $8' in sql
+    assert 'deleted_at IS NULL' in sql
+
+    sql, args = build_search_query('substring', (), order='date', after=after)
+    assert args == [UNTIL, -1001, 7]
+    assert '(date, entity_id, id) < ($2, $3, $4)' in sql and 'LIMIT $5' in sql
+
+
+@pytest.mark.parametrize('kwargs', [{'mode': 'regex'}, {'mode': 'fts', 'order': 'oldest'}])
+def test_unknown_modes_and_orders_are_rejected(kwargs):
+    mode = kwargs.pop('mode')
+    with pytest.raises(ValueError):
+        build_search_query(mode, ('simple',), **kwargs)
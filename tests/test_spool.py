@@ -0,0 +1,153 @@
+"""Spool record framing and crash recovery."""
+import asyncio
+import datetime
+
+from collector.storage import spool as spool_mod
+from collector.storage.spool import (
+    INDEX_SUFFIX, Spool, SegmentIndex, _decode, _decode_record, _scan, encode_record, read_segment, recover_segment,
+)
+
+UTC = datetime.timezone.utc
+MEDIA = (-1001, 11, 'photo', 'AQADuniq', 'file-id', 1234, 'image/jpeg', 800, 600, None, None)
+
+
+def _row(mid, media=None, entity_id=-1001):
+    date = datetime.datetime(2024, 3, 1, 12, 0, mid % 60, tzinfo=UTC)
+    return (entity_id, mid, date, '-1001', f'text {mid} – ünïcode', media is not None, mid * 7919, media)
+
+
+def _write(path, rows, checkpoint=False):
+    with open(path, 'wb') as f:
+        for r in rows:
+            f.write(encode_record(r, checkpoint))
+
+
+def _scan_bytes(tmp_path, data):
+    path = tmp_path / 'x.seg'
+    path.write_bytes(data)
+    return list(_scan(path))
+
+
+def test_encode_decode_roundtrip(tmp_path):
+    for row in (_row(10), _row(11, MEDIA)):
+        for checkpoint in (False, True):
+            record = encode_record(row, checkpoint)
+            (end, payload), = _scan_bytes(tmp_path, record)
+            assert end == len(record)
+            assert _decode_record(payload) == (row, checkpoint)
+            assert _decode(payload) == row
+
+
+def test_encode_without_media_column(tmp_path):
+    row = _row(12)[:7]
+    (_, payload), = _scan_bytes(tmp_path, encode_record(row))
+    assert _decode(payload) == (*row, None)
+
+
+def test_scan_stops_at_torn_record(tmp_path):
+    path = tmp_path / 'a.seg'
+    rows = [_row(i) for i in range(1, 4)]
+    _write(path, rows)
+    size = path.stat().st_size
+    with open(path, 'ab') as f:
+        f.write(encode_record(_row(4))[:-3])
+    assert [r[1] for r in read_segment(path)] == [1, 2, 3]
+    assert list(_scan(path))[-1][0] == size
+
+
+def test_scan_stops_at_corrupt_record(tmp_path):
+    path = tmp_path / 'a.seg'
+    first = encode_record(_row(1))
+    second = bytearray(encode_record(_row(2)))
+    second[-1] ^= 0xFF
+    path.write_bytes(first + bytes(second) + encode_record(_row(3)))
+    assert [r[1] for r in read_segment(path)] == [1]
+
+
+def test_recover_segment_truncates_and_seals(tmp_path):
+    path = tmp_path / 'a.seg'
+    _write(path, [_row(5), _row(9, MEDIA), _row(3, entity_id=-1002)], checkpoint=True)
+    with open(path, 'ab') as f:
+        # a row of a newest-first run must not move the checkpoint
+        f.write(encode_record(_row(50)))
+    valid = path.stat().st_size
+    with open(path, 'ab') as f:
+        f.write(b'\x10\x00\x00\x00garbage')
+
+    index = recover_segment(path)
+    assert path.stat().st_size == valid
+    assert index.records == 4
+    assert index.size == valid
+    assert index.marks == {-1001: 9, -1002: 3}
+    assert index.months == {'2024-03'}
+    assert SegmentIndex.load(path.with_suffix(INDEX_SUFFIX).read_text()) == index
+
+
+def test_spool_seals_and_recovers_unsealed_segments(tmp_path):
+    with Spool(tmp_path) as spool:
+        assert spool.append([_row(1), _row(2, MEDIA)]) == 2
+        # the open segment is not replayable yet
+        assert spool.segments() == []
+    sealed, = Spool(tmp_path).segments()
+    assert [r[1] for r in read_segment(sealed)] == [1, 2]
+
+    # a writer that crashed leaves a segment without an index
+    crashed = tmp_path / '99999999999999999999-1.seg'
+    _write(crashed, [_row(7)])
+    assert Spool(tmp_path).segments() == [sealed]
+    assert Spool(tmp_path).segments(recover=True) == [sealed, crashed]
+    assert crashed.with_suffix(INDEX_SUFFIX).exists()
+
+
+class _Conn:
+    def transaction(self):
+        return _Ctx(None)
+
+
+class _Ctx:
+    def __init__(self, value):
+        self.value = value
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _Pool:
+    def acquire(self):
+        return _Ctx(_Conn())
+
+
+def test_replay_advances_only_flagged_checkpoints(tmp_path, monkeypatch):
+    merged, advanced = [], []
+
+    async def merge_rows(conn, rows):
+        merged.extend(r[1] for r in rows)
+        return len(rows)
+
+    async def ensure_partitions(conn, dates):
+        pass
+
+    class StateStore:
+        def __init__(self, pool):
+            pass
+
+        async def advance(self, marks, conn=None):
+            advanced.append(dict(marks))
+
+    monkeypatch.setattr(spool_mod, 'merge_rows', merge_rows)
+    monkeypatch.setattr(spool_mod, 'ensure_partitions', ensure_partitions)
+    monkeypatch.setattr(spool_mod, 'PostgresStateStore', StateStore)
+
+    with Spool(tmp_path) as spool:
+        # a newest-first run (e.g. a backfill) and an incremental run
+        spool.append([_row(90), _row(80)])
+        spool.append([_row(3, entity_id=-1002), _row(4, entity_id=-1002)], checkpoint=True)
+    result = asyncio.run(spool_mod.replay_spool(_Pool(), tmp_path))
+
+    assert (result.segments, result.rows) == (1, 4)
+    assert sorted(merged) == [3, 4, 80, 90]
+    assert advanced == [{-1002: 4}]
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,64 @@
+"""Cursor paging of `stream_messages` and resumption after flood waits."""
+import asyncio
+
+import pytest
+from telethon.errors import FloodWaitError
+from telethon.tl.types import PeerChannel
+
+from collector import stream
+from collector.stream import StreamStats, stream_messages
+from tests.fakes import ChannelsClient
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(stream.asyncio, 'sleep', sleep)
+    return slept
+
+
+async def _ids(client, **kwargs):
+    return [m.id async for m in stream_messages(client, PeerChannel(1), **kwargs)]
+
+
+def test_flood_wait_resumes_after_last_yielded_message(sleeps):
+    client = ChannelsClient({'a': (1, 300)}, flood_at={150: 3, 20: 0})
+    stats = StreamStats()
+    ids = asyncio.run(_ids(client, stats=stats))
+    assert ids == list(range(300, 0, -1))
+    # the server's wait plus a second; a zero wait still backs off
+    assert sleeps == [4, 1]
+    assert (stats.flood_waits, stats.flood_wait_seconds, stats.last_id) == (2, 5, 1)
+    # the retried pages start from the cursor, not from the top
+    assert [r[1] for r in client.requests] == [0, 201, 151, 51, 21]
+
+
+def test_limit_holds_across_flood_waits(sleeps):
+    client = ChannelsClient({'a': (1, 300)}, flood_at={250: 1})
+    assert asyncio.run(_ids(client, limit=120)) == list(range(300, 180, -1))
+
+
+def test_incremental_stream_walks_oldest_first(sleeps):
+    client = ChannelsClient({'a': (1, 300)}, flood_at={260: 1})
+    assert asyncio.run(_ids(client, resume_after_id=180)) == list(range(181, 301))
+    assert client.requests[0] == (1, 0, 180, True)
+
+
+def test_long_flood_wait_is_raised_with_a_resumable_cursor(sleeps):
+    client = ChannelsClient({'a': (1, 300)}, flood_at={150: 600})
+    stats = StreamStats()
+
+    async def run():
+        seen = []
+        with pytest.raises(FloodWaitError):
+            async for m in stream_messages(client, PeerChannel(1), stats=stats, max_flood_wait=30):
+                seen.append(m.id)
+        seen += await _ids(client, offset_id=stats.last_id)
+        return seen
+
+    assert asyncio.run(run()) == list(range(300, 0, -1))
+    assert sleeps == [] and stats.flood_waits == 1
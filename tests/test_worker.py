@@ -0,0 +1,75 @@
+"""Retry backoff of the job worker, and how claimed jobs end."""
+import asyncio
+
+import pytest
+
+from collector import worker
+from collector.storage.job_store import Job
+from collector.worker import retry_delay, run_worker
+from tests.fakes import ChannelsClient
+
+
+def test_retry_delay_doubles_up_to_cap(monkeypatch):
+    monkeypatch.setattr(worker.random, 'uniform', lambda a, b: 1.0)
+    assert [retry_delay(n, base=30.0, cap=3600.0) for n in range(0, 10)] == [
+        30.0, 30.0, 60.0, 120.0, 240.0, 480.0, 960.0, 1920.0, 3600.0, 3600.0,
+    ]
+
+
+@pytest.mark.parametrize('attempt', [1, 3, 20])
+def test_retry_delay_jitter_bounds(attempt):
+    nominal = min(3600.0, 30.0 * 2 ** (attempt - 1))
+    for _ in range(200):
+        assert 0.75 * nominal <= retry_delay(attempt) <= 1.25 * nominal
+
+
+class FakeQueue:
+    """Hands out `jobs` once each and records how every one ended."""
+
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.outcomes = {}
+
+    async def claim(self, worker, *, kinds=None, lease=60.0):
+        if not self.jobs:
+            return None
+        job = self.jobs.pop(0)
+        job.attempts += 1
+        return job
+
+    async def heartbeat(self, job, lease=60.0):
+        return True
+
+    async def complete(self, job, messages=0):
+        self.outcomes[job.target] = ('done', messages)
+        return True
+
+    async def retry(self, job, error, delay, messages=0):
+        self.outcomes[job.target] = ('retry', error)
+        return True
+
+    async def reschedule(self, job, delay, reason=None, messages=0):
+        self.outcomes[job.target] = ('rescheduled', delay)
+        return True
+
+    async def fail(self, job, error, messages=0):
+        self.outcomes[job.target] = ('failed', error)
+        return True
+
+
+def test_worker_runs_jobs_to_their_outcomes():
+    # a flood wait longer than `max_flood_wait` goes back to the queue
+    client = ChannelsClient({'news': (1, 30), 'busy': (2, 500), 'broken': (3, 10)}, flood_at={450: 1})
+    jobs = [Job(i, 'fetch', t) for i, t in enumerate(['news', 'busy', 'nobody', 'broken'], 1)]
+
+    async def sink(m):
+        if m.entity_id == -1000000000003:
+            raise ConnectionError('database down')
+
+    queue = FakeQueue(jobs)
+    stats = asyncio.run(run_worker(client, queue, sink, exit_when_idle=True, retry_base=0, max_flood_wait=0.5))
+    assert queue.outcomes['news'] == ('done', 30)
+    assert queue.outcomes['busy'] == ('rescheduled', 2)
+    assert queue.outcomes['nobody'][0] == 'failed'
+    assert queue.outcomes['broken'] == ('retry', "ConnectionError('database down')")
+    assert (stats.claimed, stats.done, stats.rescheduled, stats.failed, stats.retried) == (4, 1, 1, 1, 1)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Run collection jobs from the `collection_jobs` queue in Postgres.
+
+Start as many workers as you like, on any host that reaches the database;
+each claims ready jobs (queued with scripts/schedule_jobs.py) and runs
+them on its own account. Stop one at any time (Ctrl+C): its running jobs
+go back to the queue for the others.
+
+Usage:
+    .venv/Scripts/python worker.py --concurrency 4 --pg-dsn "postgresql://..."
+    .venv/Scripts/python worker.py --session second --kind backfill --once
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+
+import os
+import collector
+from collector.storage.job_store import JOB_KINDS
+
+
+async def main(
+    session: str = 'session',
+    pg_dsn: str | None = None,
+    kinds: list[str] | None = None,
+    concurrency: int = 1,
+    lease: float = 120.0,
+    max_flood_wait: float = 30.0,
+    rate: float = 5.0,
+    once: bool = False,
+    worker_id: str | None = None,
+    metrics_port: int | None = None,
+    metrics_json: str | None = None,
+    spool_dir: str = '.spool',
+) -> int:
+    # Prefer explicit PG DSN (CLI) then environment variable `PG_DSN`.
+    if not pg_dsn:
+        pg_dsn = os.getenv('PG_DSN')
+    if not pg_dsn:
+        print('PG_DSN not set (pass --pg-dsn or set PG_DSN env)')
+        return 2
+
+    api_id, api_hash = collector.get_api_credentials()
+    stats = collector.WorkerStats()
+    async with collector.serve_metrics(metrics_port), collector.create_client(session, api_id, api_hash) as client:
+        async with collector.pg_pool_context(pg_dsn) as pool:
+            state = collector.open_state_store(pool)
+            # batches go to the local spool while the database is unavailable
+            with collector.Spool(spool_dir) as spool, collector.EntityCache.for_session(session) as cache:
+                # Backfill jobs walk newest first, so the sink must not advance
+                # checkpoints; fetch jobs advance them once their rows are flushed.
+                async with collector.BatchSink(pool, spool=spool, write_timeout=30.0) as sink:
+                    try:
+                        await collector.run_worker(
+                            client,
+                            collector.JobQueue(pool),
+                            sink,
+                            worker_id=worker_id,
+                            kinds=kinds,
+                            concurrency=concurrency,
+                            state=state,
+                            progress=collector.open_backfill_store(pool),
+                            entity_cache=cache,
+                            lease=lease,
+                            max_flood_wait=max_flood_wait,
+                            rate_limiter=collector.RateLimiter(rate),
+                            exit_when_idle=once,
+                            stats=stats,
+                        )
+                    except asyncio.CancelledError:
+                        pass
+            print('Sink:', sink.stats.summary())
+    print('Worker:', stats.summary())
+    print(collector.metrics.format_summary())
+    if metrics_json:
+        collector.metrics.write_snapshot(metrics_json)
+    return 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Run collection jobs from the Postgres job queue')
+    p.add_argument('--session', default='session', help='session filename prefix')
+    p.add_argument('--pg-dsn', dest='pg_dsn', help='Postgres DSN of the queue and messages (overrides PG_DSN env)')
+    p.add_argument('--kind', choices=JOB_KINDS, action='append', help='only run jobs of this kind (repeatable)')
+    p.add_argument('--concurrency', type=int, default=1, help='jobs run at the same time')
+    p.add_argument('--lease', type=float, default=120.0,
+                   help='seconds a job stays claimed without a heartbeat before other workers may take it')
+    p.add_argument('--max-flood-wait', type=float, default=30.0,
+                   help='put a fetch job back in the queue instead of sleeping through longer flood waits')
+    p.add_argument('--rate', type=float, default=5.0, help='limit on backfill history requests per second')
+    p.add_argument('--once', action='store_true', help='exit when no job is ready instead of waiting for more')
+    p.add_argument('--worker-id', help='name recorded on claimed jobs (default: host:pid)')
+    p.add_argument('--spool-dir', default='.spool',
+                   help='where to spool messages while Postgres is unavailable (see scripts/replay_spool.py)')
+    p.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port while running')
+    p.add_argument('--metrics-json', help='write the end-of-run metrics snapshot to this JSON file')
+    args = p.parse_args()
+    try:
+        raise SystemExit(asyncio.run(main(
+            session=args.session,
+            pg_dsn=args.pg_dsn,
+            kinds=args.kind,
+            concurrency=args.concurrency,
+            lease=args.lease,
+            max_flood_wait=args.max_flood_wait,
+            rate=args.rate,
+            once=args.once,
+            worker_id=args.worker_id,
+            metrics_port=args.metrics_port,
+            metrics_json=args.metrics_json,
+            spool_dir=args.spool_dir,
+        )))
+    except KeyboardInterrupt:
+        raise SystemExit(0)